@@ -0,0 +1,269 @@
+"""Benchmarks of the index build, query and learning hot paths
+
+Each benchmark runs over a synthetic corpus of a configurable size,
+it records the throughput, the latency percentiles of each operation
+and the peak memory, then compares them against a stored baseline.
+
+Usage
+-----
+  python -m tests.benchmark --docs 500 --repeat 3
+  python -m tests.benchmark --save-baseline tests/benchmark_baseline.json
+  python -m tests.benchmark --baseline tests/benchmark_baseline.json --tolerance 0.2
+  python -m tests.benchmark --only store_build inverted_build kgram_build --profile
+
+The index builds read the docs from a store filled in their setup, thus
+the tokenization and the analysis of the docs are timed by store_build.
+"""
+import argparse
+import cProfile
+import json
+import logging
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+from essential_generators import DocumentGenerator
+
+import numpy as np
+
+from tut_py_irtx.IndexController import *
+from tut_py_irtx.InvertedIndexer import *
+from tut_py_irtx.KGramIndexer import *
+from tut_py_irtx.Analyzer import *
+from tut_py_irtx.DocStore import *
+from tut_py_irtx.KMeansCluster import *
+from tut_py_irtx.PerceptronClassifier import *
+import tut_py_irtx.lev_dist as lev_dist
+
+DEFAULT_DOCS = 500
+DEFAULT_QUERIES = 200
+DEFAULT_REPEAT = 3
+DEFAULT_TOLERANCE = 0.2
+DEFAULT_SEED = 0
+PERCENTILES = [50, 90, 99]
+
+class Corpus():
+  """Synthetic docs and queries, reproducible for a given seed"""
+
+  def __init__(self, doc_count=DEFAULT_DOCS, query_count=DEFAULT_QUERIES, seed=DEFAULT_SEED):
+    # essential_generators draws from the global random
+    random.seed(seed)
+    gen = DocumentGenerator()
+    gen.init_word_cache(5000)
+    gen.init_sentence_cache(5000)
+    self.docs = [Doc(text=gen.paragraph(), index=i) for i in range(doc_count)]
+
+    rand = random.Random(seed)
+    words = sorted({word for doc in self.docs for word in DEFAULT_ANALYZER.analyze(doc.text) if word.isalpha()})
+    self.words = words
+    self.queries = [rand.sample(words, 2) for _ in range(query_count)]
+    self.wildcards = [word[:max(2, len(word) // 2)] + "*" for word, _ in self.queries]
+    self.word_pairs = [(first, second) for first, second in self.queries]
+
+class Benchmark():
+  """A timed hot path
+
+  Parameters
+  ----------
+  name : str
+  setup : function
+    Called with the corpus before each run, returns the state of the run
+  run : function
+    Called with the state, returns the list of per-operation latencies
+    in seconds, or None if the run is a single operation
+  items : function
+    Count of the processed items per run, given the corpus, for the throughput
+  """
+  def __init__(self, name, setup, run, items):
+    self.name = name
+    self.setup = setup
+    self.run = run
+    self.items = items
+
+  def measure(self, corpus, repeat, profile=False):
+    latencies = []
+    durations = []
+    for _ in range(repeat):
+      state = self.setup(corpus)
+      start = time.perf_counter()
+      run_latencies = self.run(state)
+      durations.append(time.perf_counter() - start)
+      latencies.extend(run_latencies if run_latencies is not None else [durations[-1]])
+
+    # tracing slows the run down, thus the memory is measured over a separate run
+    state = self.setup(corpus)
+    tracemalloc.start()
+    if profile:
+      cProfile.runctx("self.run(state)", globals(), locals(), sort="cumulative")
+    else:
+      self.run(state)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    best = min(durations)
+    result = {
+      "items": self.items(corpus),
+      "seconds": best,
+      "throughput": self.items(corpus) / best if best > 0 else float("inf"),
+      "peak_kb": peak / 1024,
+    }
+    for percentile, value in zip(PERCENTILES, np.percentile(latencies, PERCENTILES).tolist()):
+      result[f"p{percentile}_ms"] = value * 1000
+    return result
+
+def timed(operation, args_list):
+  """Run the operation over each of the args, returning the latency of each call"""
+  latencies = []
+  for args in args_list:
+    start = time.perf_counter()
+    operation(*args)
+    latencies.append(time.perf_counter() - start)
+  return latencies
+
+def setup_store(corpus):
+  store = DocStore()
+  store.add_docs(corpus.docs)
+  return store
+
+def setup_controller(corpus):
+  ic = IndexController(corpus.docs)
+  ic.build()
+  return ic
+
+def setup_labeled_docs(corpus):
+  # the label depends on the words of the doc, to have something to learn
+  label_words = set(corpus.words[::2])
+  docs = []
+  for doc in corpus.docs:
+    words = DEFAULT_ANALYZER.analyze(doc.text)
+    positives = sum(1 for word in words if word in label_words)
+    docs.append(Doc(text=doc.text, index=doc.index, labels=[1 if 2 * positives > len(words) else -1]))
+  return docs
+
+BENCHMARKS = [
+  # a fresh analyzer per run, so that its token cache starts cold
+  Benchmark("store_build",
+            lambda corpus: (DocStore(Analyzer()), corpus.docs),
+            lambda state: state[0].add_docs(state[1]) and None,
+            lambda corpus: len(corpus.docs)),
+  Benchmark("inverted_build",
+            lambda corpus: InvertedIndexer(corpus.docs, store=setup_store(corpus)),
+            lambda indexer: indexer.build(force=True) and None,
+            lambda corpus: len(corpus.docs)),
+  Benchmark("kgram_build",
+            lambda corpus: KGramIndexer(corpus.docs, store=setup_store(corpus)),
+            lambda indexer: indexer.build(force=True) and None,
+            lambda corpus: len(corpus.docs)),
+  Benchmark("query_boolean",
+            lambda corpus: (setup_controller(corpus), corpus.queries),
+            lambda state: timed(state[0].query_intersection, [(query,) for query in state[1]]),
+            lambda corpus: len(corpus.queries)),
+  Benchmark("query_wildcard",
+            lambda corpus: (setup_controller(corpus), corpus.wildcards),
+            lambda state: timed(state[0].query_intersection, [(query, True) for query in state[1]]),
+            lambda corpus: len(corpus.wildcards)),
+  Benchmark("query_ranked",
+            lambda corpus: (setup_controller(corpus), corpus.queries),
+            lambda state: timed(state[0].query_intersection, [(query, False, True) for query in state[1]]),
+            lambda corpus: len(corpus.queries)),
+  Benchmark("lev_dist",
+            lambda corpus: corpus.word_pairs,
+            lambda pairs: timed(lev_dist.get_from_words, pairs),
+            lambda corpus: len(corpus.word_pairs)),
+  Benchmark("kmeans_train",
+            lambda corpus: setup_store(corpus).get_matrix(corpus.docs),
+            lambda matrix: KMeansCluster(5, dimensions=matrix.shape[1], backend=BACKEND_NUMPY, spherical=True).train(matrix) and None,
+            lambda corpus: len(corpus.docs)),
+  Benchmark("perceptron_train",
+            lambda corpus: PerceptronClassifier(setup_labeled_docs(corpus), epochs=3),
+            lambda pc: pc.train() and None,
+            lambda corpus: len(corpus.docs)),
+]
+
+def compare(results, baseline, tolerance):
+  """Compare the throughput and the peak memory against the baseline
+
+  Returns
+  -------
+  list of str
+    A line per regression, a throughput lower or a memory higher than
+    the baseline by more than the tolerance ratio
+  """
+  regressions = []
+  for name, result in results.items():
+    base = baseline.get(name)
+    if base is None:
+      continue
+    if result["throughput"] < base["throughput"] * (1 - tolerance):
+      regressions.append(f"{name}: throughput {result['throughput']:.1f}/s, baseline {base['throughput']:.1f}/s")
+    if result["peak_kb"] > base["peak_kb"] * (1 + tolerance):
+      regressions.append(f"{name}: peak memory {result['peak_kb']:.0f}KB, baseline {base['peak_kb']:.0f}KB")
+  return regressions
+
+def format_results(results, baseline=None):
+  columns = ["items", "throughput"] + [f"p{percentile}_ms" for percentile in PERCENTILES] + ["peak_kb"]
+  out = f"{'benchmark':18}" + "".join(f"{column:>14}" for column in columns)
+  if baseline:
+    out += f"{'vs baseline':>14}"
+  out += "\n"
+  for name, result in results.items():
+    out += f"{name:18}" + "".join(f"{result[column]:14.2f}" for column in columns)
+    if baseline and name in baseline:
+      out += f"{result['throughput'] / baseline[name]['throughput']:13.2f}x"
+    out += "\n"
+  return out
+
+def parse_args(argv=None):
+  parser = argparse.ArgumentParser(description="Benchmark the index build, query and learning hot paths")
+  parser.add_argument("--docs", type=int, default=DEFAULT_DOCS, help="count of the synthetic docs")
+  parser.add_argument("--queries", type=int, default=DEFAULT_QUERIES, help="count of the queries per query benchmark")
+  parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="runs per benchmark, the best is kept")
+  parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="seed of the synthetic corpus")
+  parser.add_argument("--only", nargs="+", choices=[benchmark.name for benchmark in BENCHMARKS], help="benchmarks to run")
+  parser.add_argument("--baseline", help="JSON results to compare against")
+  parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="allowed regression ratio")
+  parser.add_argument("--save-baseline", help="store the results as a JSON baseline")
+  parser.add_argument("--profile", action="store_true", help="print a cProfile report of each benchmark")
+  return parser.parse_args(argv)
+
+def main(argv=None):
+  args = parse_args(argv)
+  logging.disable(logging.INFO)
+  baseline = None
+  if args.baseline:
+    if not os.path.exists(args.baseline):
+      print(f"The baseline {args.baseline} does not exist", file=sys.stderr)
+      return 2
+    with open(args.baseline) as f:
+      saved = json.load(f)
+    # the results of a different corpus are not comparable
+    for key in ["docs", "queries", "seed"]:
+      if saved.get(key) != getattr(args, key):
+        print(f"The baseline {args.baseline} ran with {key} {saved.get(key)}, got {getattr(args, key)}", file=sys.stderr)
+        return 2
+    baseline = saved["results"]
+
+  corpus = Corpus(args.docs, args.queries, args.seed)
+  results = {}
+  for benchmark in BENCHMARKS:
+    if args.only and benchmark.name not in args.only:
+      continue
+    results[benchmark.name] = benchmark.measure(corpus, args.repeat, args.profile)
+
+  print(format_results(results, baseline))
+
+  if args.save_baseline:
+    with open(args.save_baseline, "w") as f:
+      json.dump({"docs": args.docs, "queries": args.queries, "seed": args.seed, "results": results}, f, indent=2)
+
+  if baseline is not None:
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+      print(f"[REGRESSION] {regression}")
+    return 1 if regressions else 0
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,110 @@
+"""Serve a synthetic corpus through a QueryServer, and load test it
+
+The load test starts the server in process, then sends a mix of boolean,
+wildcard and ranked queries over concurrent connections, and reports the
+throughput, the latency percentiles and the count of each response status.
+
+Usage
+-----
+  python -m tests.query_server --docs 500 --port 8642
+  python -m tests.query_server --docs 500 --path /tmp/irtx.sock --workers 4
+  python -m tests.query_server --docs 500 --workers 4 --load 2000 --connections 16
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+
+import numpy as np
+
+from tut_py_irtx.IndexController import *
+from tut_py_irtx.QueryServer import *
+from tests.benchmark import Corpus, PERCENTILES
+
+DEFAULT_DOCS = 500
+DEFAULT_PORT = 8642
+DEFAULT_CONNECTIONS = 8
+
+def get_queries(corpus, count):
+  """Cycle through the boolean, wildcard and ranked queries of the corpus"""
+  kinds = [(corpus.queries, False, False), ([[wildcard] for wildcard in corpus.wildcards], True, False), (corpus.queries, False, True)]
+  queries = []
+  for i in range(count):
+    texts, wildcard, ranked = kinds[i % len(kinds)]
+    queries.append((texts[(i // len(kinds)) % len(texts)], wildcard, ranked))
+  return queries
+
+async def load(server, queries, connections, limit):
+  """Send the queries over the given count of connections, returns the latencies and the statuses"""
+  host_port = server.address
+  clients = []
+  for _ in range(connections):
+    if isinstance(host_port, str):
+      clients.append(await QueryClient().connect(path=host_port))
+    else:
+      clients.append(await QueryClient().connect(*host_port[:2]))
+
+  latencies = []
+  statuses = {}
+
+  async def send(client, text, wildcard, ranked):
+    start = time.perf_counter()
+    response = await client.query(text, wildcard, ranked, limit)
+    latencies.append(time.perf_counter() - start)
+    statuses[response["status"]] = statuses.get(response["status"], 0) + 1
+
+  try:
+    await asyncio.gather(*[send(clients[i % connections], *query) for i, query in enumerate(queries)])
+  finally:
+    for client in clients:
+      await client.close()
+  return latencies, statuses
+
+async def run(args):
+  corpus = Corpus(args.docs, max(1, args.load))
+  server = QueryServer(IndexController(corpus.docs), workers=args.workers, max_pending=args.max_pending, timeout=args.timeout)
+  await server.start(port=args.port, path=args.path)
+  print(f"serving {args.docs} docs on {server.address} with {args.workers} worker(s)")
+
+  try:
+    if args.load <= 0:
+      await server.serve_forever()
+      return 0
+
+    queries = get_queries(corpus, args.load)
+    start = time.perf_counter()
+    latencies, statuses = await load(server, queries, args.connections, args.limit)
+    seconds = time.perf_counter() - start
+  finally:
+    await server.close()
+
+  percentiles = np.percentile(np.array(latencies) * 1000, PERCENTILES)
+  print(f"{len(queries)} queries over {args.connections} connections in {seconds:.2f} seconds, {len(queries) / seconds:.1f} queries/s")
+  print(" | ".join(f"p{percentile}: {value:.2f}ms" for percentile, value in zip(PERCENTILES, percentiles)))
+  print(f"statuses: {statuses}")
+  return 0 if statuses.get(STATUS_OK, 0) == len(queries) else 1
+
+def parse_args(argv=None):
+  parser = argparse.ArgumentParser(description="Serve a synthetic corpus through a QueryServer, and load test it")
+  parser.add_argument("--docs", type=int, default=DEFAULT_DOCS, help="count of the synthetic docs")
+  parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="TCP port to listen on, 0 for any")
+  parser.add_argument("--path", help="Unix socket path to listen on, instead of the TCP port")
+  parser.add_argument("--workers", type=int, default=0, help="count of the worker processes, 0 for a thread pool querying the published snapshot")
+  parser.add_argument("--max-pending", type=int, default=QueryServer.DEFAULT_MAX_PENDING, help="max count of the queries in flight")
+  parser.add_argument("--timeout", type=float, default=QueryServer.DEFAULT_TIMEOUT, help="seconds a query may take")
+  parser.add_argument("--load", type=int, default=0, help="count of the queries to load test with, 0 to serve until interrupted")
+  parser.add_argument("--connections", type=int, default=DEFAULT_CONNECTIONS, help="count of the load test connections")
+  parser.add_argument("--limit", type=int, default=10, help="max count of the docs per response")
+  return parser.parse_args(argv)
+
+def main(argv=None):
+  args = parse_args(argv)
+  logging.disable(logging.INFO)
+  try:
+    return asyncio.run(run(args))
+  except KeyboardInterrupt:
+    return 0
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,118 @@
+import logging
+import unittest
+import xmlrunner
+
+import tut_py_irtx.tokenizer as tokenizer
+from tut_py_irtx.Analyzer import *
+from tut_py_irtx.IndexController import *
+from tut_py_irtx.PerceptronClassifier import *
+from tests.stub_inv_index import *
+
+def setUpModule():
+  """Triggered before all module tests"""
+  logging.debug("setUpModule is triggered")
+
+def tearDownModule():
+  """Triggered after all module tests"""
+  logging.debug("tearDownModule is triggered")
+
+class AnalyzerTest(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    """Triggered before all class tests"""
+    logging.debug("setUpModule is triggered")
+
+  def setUp(self):
+    """Triggered before each test"""
+    logging.debug("setUp is triggered")
+
+  def test01_default_analyzer(self):
+    """The default analyzer only normalizes the tokens"""
+    analyzer = Analyzer()
+    self.assertTrue(analyzer.is_default())
+    for text in [stub_doc1, stub_doc2, stub_doc3, "@Someone https://t.co/x #Tag"]:
+      self.assertEqual(analyzer.analyze(text), tokenizer.tokenize(text))
+
+  def test02_stopwords_and_stemming(self):
+    """Stopwords are dropped and the plural forms are stemmed"""
+    analyzer = Analyzer(stopwords=True, stemmer=True)
+    self.assertEqual(analyzer.analyze("The queries of the Docs, and a class"), ["query", "doc", "class"])
+    self.assertEqual(analyzer.count_terms("docs doc the"), {"doc": 2})
+    self.assertIsNone(analyzer.analyze_query("The"))
+    self.assertEqual(analyzer.analyze_query("Queries"), "query")
+    self.assertEqual(analyzer.analyze_query("Que*"), "que*")
+
+  def test03_urls_mentions_and_filters(self):
+    """URLs and mentions follow their policies, and filters run last"""
+    text = "@alice see https://t.co/abc now"
+
+    analyzer = Analyzer()
+    self.assertEqual(analyzer.analyze(text), ["alice", "see", "https://t.co/abc", "now"])
+
+    analyzer = Analyzer(urls=DROP, mentions=DROP, filters=[lambda t: None if len(t) < 4 else t])
+    self.assertEqual(analyzer.analyze(text), [])
+
+    with self.assertRaises(ValueError):
+      Analyzer(urls="mask")
+
+  def test04_cache(self):
+    """The chain runs once per distinct token"""
+    calls = []
+    def stemmer(text):
+      calls.append(text)
+      return text
+
+    analyzer = Analyzer(stemmer=stemmer)
+    analyzer.analyze("a b a b a")
+    self.assertEqual(calls, ["a", "b"])
+    self.assertEqual(analyzer.cache_misses, 2)
+    self.assertEqual(analyzer.cache_hits, 3)
+
+    analyzer = Analyzer(max_cache_size=1)
+    self.assertEqual(analyzer.analyze("a b c a"), ["a", "b", "c", "a"])
+    self.assertLessEqual(len(analyzer.cache), 1)
+
+  def test05_shared_by_indexers_and_query(self):
+    """The indexers and the query path share the controller analyzer"""
+    doc1 = Doc(text=stub_doc1, index=stub_doc1_id)
+    doc2 = Doc(text=stub_doc2, index=stub_doc2_id)
+
+    analyzer = Analyzer(stopwords=True, stemmer=True)
+    ic = IndexController([doc1, doc2], analyzer=analyzer)
+    ic.build()
+
+    for indexer in ic.indexers:
+      self.assertIs(indexer.analyzer, analyzer)
+
+    inv_index = ic.get_inv_index()
+    self.assertNotIn("is", inv_index)
+    self.assertIn("doc", inv_index)
+    self.assertNotIn("docs", inv_index)
+
+    # stopwords are ignored, and the query is stemmed as the index
+    docs = ic.query_intersection(["the", "Documents"])
+    self.assertEqual(len(docs), 2)
+    docs = ic.query_intersection(["docs"])
+    self.assertEqual(len(docs), 1)
+    docs = ic.query_intersection(["doc*"], wildcard=True)
+    self.assertEqual(len(docs), 2)
+
+    kgram_index = ic.kgram_indexer().index
+    self.assertNotIn("is$", kgram_index)
+
+  def test06_perceptron_analyzer(self):
+    """The perceptron features are the analyzed texts"""
+    instances = [Doc(index=0, text="The Docs", labels=[1]), Doc(index=1, text="the doc", labels=[-1])]
+    pc = PerceptronClassifier(instances, analyzer=Analyzer(stopwords=True, stemmer=True))
+    pc.train()
+    self.assertEqual(list(pc.weights.keys()), ["doc"])
+
+  def tearDown(self):
+    """Triggered after each test"""
+    logging.debug("tearDown is triggered")
+
+  @classmethod
+  def tearDownClass(cls):
+    """Triggered  after all class tests"""
+    logging.debug("tearDownClass is triggered")
@@ -0,0 +1,105 @@
+import logging
+import unittest
+import xmlrunner
+
+from tut_py_irtx.DocStore import *
+from tut_py_irtx.IndexController import *
+from tut_py_irtx.PerceptronClassifier import *
+from tests.stub_inv_index import *
+
+def setUpModule():
+  """Triggered before all module tests"""
+  logging.debug("setUpModule is triggered")
+
+def tearDownModule():
+  """Triggered after all module tests"""
+  logging.debug("tearDownModule is triggered")
+
+class DocStoreTest(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    """Triggered before all class tests"""
+    logging.debug("setUpModule is triggered")
+
+  def setUp(self):
+    """Triggered before each test"""
+    logging.debug("setUp is triggered")
+
+  def test01_analyze_once(self):
+    """Each doc is analyzed once, then read from the store"""
+    store = DocStore()
+    doc = Doc(text="b a b c", index="1")
+
+    entry = store.get(doc)
+    self.assertIs(store.get(doc), entry)
+    self.assertEqual(store.analyzed_count, 1)
+
+    self.assertEqual(store.terms, ["b", "a", "c"])
+    self.assertEqual(entry.term_ids.tolist(), [0, 1, 2])
+    self.assertEqual(entry.counts.tolist(), [2, 1, 1])
+    self.assertEqual(store.get_term_counts(doc), {"b": 2, "a": 1, "c": 1})
+    self.assertEqual(store.get_dense_vector(doc), [2, 1, 1])
+
+  def test02_conflicting_index_and_no_growth(self):
+    """A different doc with a stored index is analyzed without being stored"""
+    store = DocStore()
+    doc = Doc(text="a b", index="1")
+    other = Doc(text="c a", index="1")
+    store.get(doc)
+
+    entry = store.get(other, grow=False)
+    self.assertEqual(entry.term_ids.tolist(), [0])
+    self.assertEqual(store.terms, ["a", "b"])
+    self.assertIs(store.entries["1"].doc, doc)
+
+    store.remove_doc(doc)
+    self.assertEqual(len(store), 0)
+
+  def test03_shared_by_indexers_and_learners(self):
+    """The controller docs are tokenized once for all the indexers and learners"""
+    doc1 = Doc(text=stub_doc1, index=stub_doc1_id, labels=[1])
+    doc2 = Doc(text=stub_doc2, index=stub_doc2_id, labels=[-1])
+
+    ic = IndexController([doc1, doc2])
+    ic.build()
+    ic.build(force=True)
+
+    self.assertEqual(ic.store.analyzed_count, 2)
+    self.assertEqual(len(ic.store.terms), len(ic.get_inv_index()))
+
+    pc = PerceptronClassifier([doc1, doc2], store=ic.store)
+    pc.train()
+    pc.assign_labels([doc1, doc2])
+    self.assertEqual(ic.store.analyzed_count, 2)
+
+  def test04_reload_docs(self):
+    """Reloading the docs replaces the stale entries, each new doc is analyzed once"""
+    docs = [Doc(text="hello world", index=str(i)) for i in range(5)]
+    ic = IndexController(docs)
+    ic.build()
+    self.assertEqual(ic.store.analyzed_count, 5)
+
+    for reload in range(1, 4):
+      docs = [Doc(text=f"reload {reload}", index=str(i)) for i in range(5)]
+      ic.set_docs(docs)
+      ic.build()
+      ic.query_intersection("reload")
+      self.assertEqual(ic.store.analyzed_count, 5 * (reload + 1))
+      self.assertEqual(len(ic.store), 5)
+      self.assertTrue(all(ic.store.entries[doc.index].doc is doc for doc in docs))
+    self.assertEqual(ic.store.get_term_counts(docs[0]), {"reload": 1, "3": 1})
+
+    # the docs left out of the new set are evicted
+    ic.set_docs(docs[:2])
+    self.assertEqual(sorted(ic.store.entries), ["0", "1"])
+    self.assertEqual(ic.store.analyzed_count, 20)
+
+  def tearDown(self):
+    """Triggered after each test"""
+    logging.debug("tearDown is triggered")
+
+  @classmethod
+  def tearDownClass(cls):
+    """Triggered  after all class tests"""
+    logging.debug("tearDownClass is triggered")
@@ -342,6 +342,117 @@ class InvIndexTest(unittest.TestCase):
     8 (19.51%) terms in    2 docs|........
 """)
 
+  def test10_query_explain(self):
+    """explain=True profiles each query term and stage, without changing the results"""
+    doc1 = Doc(text=stub_doc1, index=stub_doc1_id)
+    doc2 = Doc(text=stub_doc2, index=stub_doc2_id)
+    ic   = IndexController([doc1, doc2])
+
+    samples = ["information", "test*", "mining", "the"]
+    docs, explanation = ic.query_intersection(samples, wildcard=True, explain=True)
+    self.assertEqual(docs, ic.query_intersection(samples, wildcard=True))
+
+    info, wildcard, mining, stopword = explanation.terms
+    self.assertEqual((info.postings, info.intersection), (2, 2))
+    self.assertEqual(sorted(wildcard.expansions), ["test", "testing"])
+    self.assertIsNone(wildcard.cache_hit)
+    self.assertEqual((mining.postings, mining.intersection, mining.union), (1, 1, 2))
+    self.assertEqual(stopword.analyzed, "the")
+    self.assertEqual(explanation.results, len(docs))
+    for stage in ["build", "analyze", "expand", "lookup", "intersect"]:
+      self.assertIn(stage, explanation.seconds)
+    self.assertGreaterEqual(explanation.total_seconds, sum(explanation.seconds.values()))
+
+    docs, explanation = ic.query_intersection(["information", "text"], ranked=True, explain=True)
+    self.assertEqual(explanation.docs_scored, 2)
+    self.assertEqual(explanation.cache_hits, 2)
+    self.assertEqual(explanation.to_dict()["terms"][1]["postings"], 1)
+    self.assertIn("docs scored: 2", str(explanation))
+
+  def test11_memory_report(self):
+    """Each index reports its estimated memory from the kept counts"""
+    doc1 = Doc(text=stub_doc1, index=stub_doc1_id)
+    doc2 = Doc(text=stub_doc2, index=stub_doc2_id)
+    ic   = IndexController([doc1, doc2])
+    ic.build()
+
+    reports = ic.get_memory_report(top=3)
+    self.assertEqual(list(reports.keys()), ["DocStore", "InvertedIndexer", "DocIndexer", "KGramIndexer"])
+
+    inv_index = ic.get_inv_index()
+    report = reports["InvertedIndexer"]
+    postings = sum(term.occurances.get_count() for term in inv_index.values())
+    self.assertEqual(report.entries, len(inv_index))
+    self.assertEqual(report.components["postings"], postings * (get_node_size() + get_posting_size()))
+    self.assertEqual(report.total, sum(report.components.values()))
+    self.assertEqual([count for _, count, _ in report.largest], [2, 2, 2])
+
+    kgram_index = ic.kgram_indexer().index
+    report = reports["KGramIndexer"]
+    self.assertEqual(report.components["word lists"], ic.kgram_indexer().words_count * get_node_size())
+    self.assertEqual(report.largest[0][1], max(gram.words.get_count() for gram in kgram_index.values()))
+
+    self.assertEqual(reports["DocIndexer"].largest[0][0], stub_doc2_id)
+    self.assertEqual(reports["DocStore"].to_dict()["entries"], 2)
+    self.assertIn("postings", str(reports["InvertedIndexer"]))
+
+  def test12_snapshot_queries(self):
+    """Snapshots are read-only, carry the ranks, and get swapped by a rebuild"""
+    doc1 = Doc(text=stub_doc1, index=stub_doc1_id)
+    doc2 = Doc(text=stub_doc2, index=stub_doc2_id)
+    ic   = IndexController([doc1, doc2])
+
+    snapshot = ic.get_snapshot()
+    with self.assertRaises(TypeError):
+      snapshot.inv_index["new"] = None
+
+    # querying does not rebuild, nor republish
+    self.assertEqual(len(ic.query_intersection(["information"])), 2)
+    self.assertIs(ic.get_snapshot(), snapshot)
+
+    result = ic.query(["information", "mining"], ranked=True)
+    self.assertFalse(any(hasattr(doc, "rank") for doc in [doc1, doc2]))
+    self.assertEqual(list(result.ranks), sorted(result.ranks, reverse=True))
+    qtfs, qidfs = IndexSnapshot.get_query_frequencies(["information", "mining"])
+    for doc, rank in result.get_hits():
+      dtfs, didfs = IndexSnapshot.get_doc_frequencies(snapshot.inv_index, Posting(doc.index), ["information", "mining"])
+      self.assertEqual(rank, tfidf.get_query_similarity(qtfs, qidfs, dtfs, didfs)[0])
+
+    # a rebuild publishes a new snapshot, the previous one still serves its docs
+    doc3 = Doc(text="information retrieval", index="3")
+    ic.set_docs([doc1, doc2, doc3])
+    self.assertIs(ic.get_snapshot(), snapshot)
+    ic.build()
+    self.assertEqual(ic.get_snapshot().version, snapshot.version + 1)
+    self.assertEqual(sorted(doc.index for doc in ic.query("information")), sorted([doc1.index, doc2.index, doc3.index]))
+    self.assertEqual(sorted(doc.index for doc in snapshot.query("information")), sorted([doc1.index, doc2.index]))
+
+  def test13_concurrent_snapshot_queries(self):
+    """Threads query consistent snapshots while the docs get rebuilt"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    docs = [Doc(text=stub_doc1, index=stub_doc1_id), Doc(text=stub_doc2, index=stub_doc2_id)]
+    extra_doc = Doc(text="information retrieval", index="3")
+    ic = IndexController(docs)
+    ic.build()
+
+    expected = {ic.version: sorted([stub_doc1_id, stub_doc2_id])}
+
+    def run_query(i):
+      result = ic.query(["information", "inf*"], wildcard=True)
+      return result.version, sorted(doc.index for doc in result)
+
+    with ThreadPoolExecutor(8) as executor:
+      futures = [executor.submit(run_query, i) for i in range(200)]
+      for i in range(3):
+        ic.set_docs(docs + [extra_doc] if i % 2 == 0 else docs)
+        ic.build()
+        expected[ic.version] = sorted(doc.index for doc in ic.doc_list)
+      results = [future.result() for future in futures]
+
+    for version, indices in results:
+      self.assertEqual(indices, expected[version])
+
   def tearDown(self):
     """Triggered after each test"""
     logging.debug("tearDown is triggered")
@@ -1,7 +1,6 @@
 import logging
 import unittest
 import xmlrunner
-import cProfile
 
 from tut_py_irtx.IndexController import *
 from tut_py_irtx.InvertedIndexer import *
@@ -137,8 +136,8 @@ class KGramIndexTest(unittest.TestCase):
     for i in range(1000):
       docs.append(doc2)
     ic   = IndexController(docs)
-
-    index_controller = ic.build()
+    ic.build()
+    return ic
 
   @staticmethod
   def build_core_various():
@@ -153,35 +152,47 @@ class KGramIndexTest(unittest.TestCase):
       doc = Doc(text=gen_doc, index=i)
       docs.append(doc)
     ic   = IndexController(docs)
-
-    index_controller = ic.build()
-
-  def test05_profile_redundant_kgrams(self):
-    """query() shall return relevant documents to the given term"""
-    profiled_exec = False
-
-    d1 = datetime.datetime.now()
-    if profiled_exec:
-      cProfile.runctx('KGramIndexTest.build_core()', globals(), locals())
-    else:
-      KGramIndexTest.build_core()
-
-    d2 = datetime.datetime.now()
-    threshold = 2
-    self.assertLessEqual((d2-d1).seconds, threshold, f"time shall be less than or equal {threshold} seconds")
-
-  def test06_profile_various_kgrams(self):
-    """query() shall return relevant documents to the given term"""
-    profiled_exec = False
-    d1 = datetime.datetime.now()
-    if profiled_exec:
-      cProfile.runctx('KGramIndexTest.build_core_various()', globals(), locals())
-    else:
-      KGramIndexTest.build_core_various()
-
-    d2 = datetime.datetime.now()
-    threshold = 5
-    self.assertLessEqual((d2-d1).seconds, threshold, f"time shall be less than or equal {threshold} seconds")
+    ic.build()
+    return ic
+
+  def test05_build_redundant_kgrams(self):
+    """build() shall index the kgrams of redundant docs, timed by the kgram_build benchmark"""
+    ic = KGramIndexTest.build_core()
+    self.assertTrue(ic.kgram_indexer().is_index_built)
+    self.assertEqual({doc.index for doc in ic.query_intersection("inf*", wildcard=True)}, {stub_doc1_id, stub_doc2_id})
+
+  def test06_build_various_kgrams(self):
+    """build() shall index the kgrams of generated docs, timed by the kgram_build benchmark"""
+    ic = KGramIndexTest.build_core_various()
+    self.assertTrue(ic.kgram_indexer().is_index_built)
+    self.assertGreater(len(ic.kgram_indexer().index), 0)
+
+  def test07_build_progress(self):
+    """build() shall report its progress from running counters"""
+    for late_sort in [True, False]:
+      docs = [Doc(text=stub_doc1, index=stub_doc1_id), Doc(text=stub_doc2, index=stub_doc2_id), Doc(text="banana anan", index="3")]
+      reports = []
+      indexer = KGramIndexer(docs, late_sort=late_sort, progress=reports.append, progress_every=1)
+      indexer.build()
+
+      words_count = sum(gram.words.get_count() for gram in indexer.index.values())
+      self.assertEqual(indexer.words_count, words_count)
+      self.assertEqual(indexer.index_words_count(), words_count)
+
+      merges = [report for report in reports if report.stage == STAGE_MERGE]
+      self.assertEqual([report.done for report in merges], [1, 2, 3])
+      self.assertTrue(all(report.total == 3 for report in merges))
+
+      sorts = [report for report in reports if report.stage == STAGE_SORT]
+      if late_sort:
+        self.assertEqual(sorts[-1].done, len(indexer.index))
+        self.assertEqual(sorts[-1].words, words_count)
+      else:
+        self.assertEqual(sorts, [])
+        self.assertEqual(merges[-1].words, words_count)
+
+    with self.assertRaises(ValueError):
+      indexer.set_progress(print, 0)
 
   def tearDown(self):
     """Triggered after each test"""
@@ -8,10 +8,14 @@ from tut_py_irtx.InvertedIndexer import *
 from tut_py_irtx.DocIndexer import *
 from tut_py_irtx.KGramIndexer import *
 from tut_py_irtx.Doc import *
+from tut_py_irtx.DocStore import *
 from tests.stub_inv_index import *
 from tut_py_irtx.KMeansCluster import *
+from tut_py_irtx.FeatureHasher import *
 
 from datetime import datetime
+import random
+import numpy as np
 
 def setUpModule():
   """Triggered before all module tests"""
@@ -190,20 +194,15 @@ class KMeansTest(unittest.TestCase):
     elapsed = datetime.now() - self.test_start_time
     print(f"Indexed in {elapsed.total_seconds()} seconds")
 
-    print(f"Ordering terms ...")
-    for i, key in enumerate(ii.index.keys()):
-      ii.index[key].order = i
-    elapsed = (datetime.now() - self.test_start_time) - elapsed
-    print(f"Ordered in {elapsed.total_seconds()} seconds")
-
     print("Updating docs locations and Creating Instances ... ")
-    term_count = len(ii.index)
+    # each term id of the shared store is a dimension,
+    # the docs got already analyzed while indexing
+    term_count = len(ic.store.terms)
+    self.assertEqual(term_count, len(ii.index))
 
     instances = []
     for doc in docs:
-      doc.values = [0]* term_count
-      for term in Doc.fetch_terms(doc):
-        doc.values[ii.index[term.text].order] += 1
+      doc.values = ic.store.get_dense_vector(doc, term_count)
       instances.append(Instance(values=doc.values, data=doc))
     elapsed = (datetime.now() - self.test_start_time) - elapsed
     print(f"Updated docs in {elapsed.total_seconds()} seconds")
@@ -211,6 +210,213 @@ class KMeansTest(unittest.TestCase):
     self.verbose_clustering(2, 3, instances, term_count)
     self.verbose_clustering(20, 1, instances, term_count)
 
+  def test06_kmeans_backends_agree(self):
+    """The numpy backend clusters as the python backend"""
+    rand = random.Random(1)
+    values = [[rand.randrange(0, 20) + 30 * (i % 3), rand.randrange(0, 20), rand.random()] for i in range(60)]
+
+    kmeans_py = KMeansCluster(3, dimensions=3, backend=BACKEND_PYTHON)
+    kmeans_py.train([Instance(values=v) for v in values])
+
+    kmeans_np = KMeansCluster(3, dimensions=3, backend=BACKEND_NUMPY)
+    kmeans_np.train(np.array(values, dtype=float))
+
+    self.assertAlmostEqual(kmeans_py.RSS(), kmeans_np.RSS())
+    for cluster_py, cluster_np in zip(kmeans_py.clusters, kmeans_np.clusters):
+      self.assertEqual([i.values for i in cluster_py.get_instances_ordered_by_dist()],
+                       [list(i.values) for i in cluster_np.get_instances_ordered_by_dist()])
+
+    with self.assertRaises(ValueError):
+      KMeansCluster(3, backend="cuda")
+
+  def test07_kmeans_sparse_matches_dense(self):
+    """Sparse matrices cluster as their dense form, in both metrics"""
+    rand = random.Random(2)
+    values = np.array([[rand.randrange(0, 3) * (j % 4 == i % 4) for j in range(12)] for i in range(40)], dtype=float)
+    sparse = SparseMatrix.from_dense(values)
+
+    for spherical in [False, True]:
+      kmeans_dense = KMeansCluster(4, dimensions=12, spherical=spherical)
+      kmeans_dense.train(values, items=list(range(len(values))))
+      kmeans_sparse = KMeansCluster(4, dimensions=12, spherical=spherical)
+      kmeans_sparse.train(sparse)
+
+      self.assertAlmostEqual(kmeans_dense.RSS(), kmeans_sparse.RSS())
+      for cluster_dense, cluster_sparse in zip(kmeans_dense.clusters, kmeans_sparse.clusters):
+        self.assertEqual(cluster_dense.instances, cluster_sparse.instances)
+        self.assertTrue(np.allclose(np.sort(cluster_dense.get_member_dists()), np.sort(cluster_sparse.get_member_dists())))
+
+    with self.assertRaises(ValueError):
+      KMeansCluster(4, backend=BACKEND_PYTHON, spherical=True)
+    with self.assertRaises(TypeError):
+      KMeansCluster(4, backend=BACKEND_PYTHON).train(sparse)
+
+  def test08_kmeans_spherical_docs(self):
+    """Docs are clustered by their cosine distance straight from the store"""
+    docs = [Doc(index=i, text=text) for i, text in enumerate(
+              ["apple banana apple", "banana apple fruit", "apple fruit fruit",
+               "car engine wheel", "engine car car", "wheel engine road"])]
+
+    ic = IndexController(docs)
+    matrix = ic.store.get_matrix(docs)
+    self.assertEqual(matrix.shape, (len(docs), len(ic.store.terms)))
+
+    kmeans = KMeansClusterOptimizer(2, dimensions=matrix.shape[1], spherical=True).train(matrix, items=docs)
+    groups = sorted(sorted(doc.index for doc in cluster.instances) for cluster in kmeans.clusters)
+    self.assertEqual(groups, [[0, 1, 2], [3, 4, 5]])
+
+    for cluster in kmeans.clusters:
+      dists = cluster.get_member_dists()
+      self.assertTrue(((dists >= -1e-9) & (dists <= 1 + 1e-9)).all())
+      self.assertAlmostEqual(cluster.GetRSS(), dists.sum())
+
+  def test09_kmeans_parallel_seeds(self):
+    """Seeds trained across processes give the sequential clustering"""
+    rand = random.Random(3)
+    values = np.array([[rand.random() + 5 * (i % 4), rand.random(), rand.random()] for i in range(200)])
+
+    sequential = KMeansClusterOptimizer(4, dimensions=3, seed_count=4).train(values)
+    parallel = KMeansClusterOptimizer(4, dimensions=3, seed_count=4, workers=2).train(values)
+    self.assertAlmostEqual(sequential.RSS(), parallel.RSS())
+    self.assertEqual([c.members.tolist() for c in sequential.clusters], [c.members.tolist() for c in parallel.clusters])
+
+    sparse = SparseMatrix.from_dense(values)
+    parallel_sparse = KMeansClusterOptimizer(4, dimensions=3, seed_count=4, workers=2).train(sparse)
+    self.assertAlmostEqual(sequential.RSS(), parallel_sparse.RSS())
+
+    # the first run has no finished run to be compared to
+    optimizer = KMeansClusterOptimizer(4, dimensions=3, seed_count=4, abandon_ratio=1.0)
+    abandoning = optimizer.train(values)
+    self.assertNotIn(0, optimizer.abandoned_seeds)
+    self.assertGreaterEqual(abandoning.RSS() + 1e-9, sequential.RSS())
+
+  def test10_kmeans_init_and_stops(self):
+    """k-means++ seeding, more clusters than instances and the stop controls"""
+    rand = random.Random(4)
+    values = [[rand.random() + 10 * (i % 5), rand.random() + 10 * (i % 5)] for i in range(100)]
+
+    kmeans_py = KMeansCluster(5, dimensions=2, backend=BACKEND_PYTHON, init=INIT_KMEANS_PP)
+    kmeans_py.train([Instance(values=v) for v in values], seed=7)
+    kmeans_np = KMeansCluster(5, dimensions=2, init=INIT_KMEANS_PP)
+    kmeans_np.train(np.array(values), seed=7)
+
+    self.assertAlmostEqual(kmeans_py.RSS(), kmeans_np.RSS())
+    # the spread seeding finds the 5 groups
+    self.assertEqual(sorted(len(c.instances) for c in kmeans_np.clusters), [20] * 5)
+    self.assertEqual(kmeans_np.stop_reason, STOP_NO_REASSIGNMENT)
+
+    for backend in [BACKEND_PYTHON, BACKEND_NUMPY]:
+      kmeans = KMeansCluster(4, dimensions=2, backend=backend)
+      kmeans.train([Instance(values=[1, 1]), Instance(values=[5, 5])], seed=3)
+      self.assertEqual(sorted(len(c.instances) for c in kmeans.clusters), [0, 0, 1, 1])
+      self.assertEqual(kmeans.RSS(), 0)
+
+    kmeans = KMeansCluster(5, dimensions=2, max_iter=1)
+    kmeans.train(np.array(values), seed=1)
+    self.assertEqual(kmeans.iterations, 1)
+    self.assertEqual(kmeans.stop_reason, STOP_MAX_ITER)
+
+    # the tolerance is first checked against the RSS of the first iteration
+    for backend in [BACKEND_PYTHON, BACKEND_NUMPY]:
+      kmeans = KMeansCluster(5, dimensions=2, tol=1.0, backend=backend)
+      kmeans.train(np.array(values) if backend == BACKEND_NUMPY else [Instance(values=v) for v in values], seed=1)
+      self.assertEqual(kmeans.iterations, 2)
+      self.assertEqual(kmeans.stop_reason, STOP_TOLERANCE)
+
+    with self.assertRaises(ValueError):
+      KMeansCluster(2, init="forgy")
+
+  def test11_kmeans_mini_batches(self):
+    """Mini-batch KMeans follows a stream of batches"""
+    rand = random.Random(5)
+    values = np.array([[rand.random() + 10 * (i % 3), rand.random() + 10 * (i % 3)] for i in range(300)])
+
+    kmeans = MiniBatchKMeansCluster(3, dimensions=2, init=INIT_KMEANS_PP)
+    kmeans.train(values, seed=1, batch_size=30)
+    self.assertEqual(kmeans.batches, 10)
+    self.assertEqual(kmeans.counts.sum(), 300)
+    self.assertEqual(sorted(len(c.instances) for c in kmeans.clusters), [100] * 3)
+    self.assertTrue(np.allclose(sorted(kmeans.get_centroids()[:, 0]), [0.5, 10.5, 20.5], atol=0.2))
+    self.assertEqual(kmeans.predict(np.array([[20.5, 20.5]])).tolist(), kmeans.predict(values[2:3]).tolist())
+
+    # the centroids grow with the vocabulary of the streamed docs
+    store = DocStore()
+    stream = MiniBatchKMeansCluster(2, dimensions=0, spherical=True)
+    batches = [["apple banana", "car engine"], ["apple fruit banana", "engine wheel car"], ["fruit apple", "road wheel"]]
+    for b_iter, texts in enumerate(batches):
+      docs = [Doc(index=f"{b_iter}-{i}", text=text) for i, text in enumerate(texts)]
+      labels = stream.partial_fit(store.get_matrix(docs))
+      self.assertNotEqual(labels[0], labels[1])
+      self.assertEqual(stream.get_centroids().shape, (2, len(store.terms)))
+    self.assertTrue(np.allclose(np.linalg.norm(stream.get_centroids(), axis=1), 1))
+
+    with self.assertRaises(ValueError):
+      MiniBatchKMeansCluster(2).predict(values)
+
+  def test12_kmeans_hamerly(self):
+    """The bounded KMeans clusters as KMeans, skipping distances"""
+    rand = random.Random(6)
+    values = np.array([[rand.gauss(3 * (i % 8), 1.5) for d in range(6)] for i in range(400)])
+
+    # the exact RSS of each iteration is only computed for a tol
+    for matrix, tol in [(values, None), (SparseMatrix.from_dense(values), None), (values, 1e-9)]:
+      kmeans = KMeansCluster(8, dimensions=6, tol=tol)
+      kmeans.train(matrix, seed=2)
+      hamerly = HamerlyKMeansCluster(8, dimensions=6, tol=tol)
+      hamerly.train(matrix, seed=2)
+
+      self.assertEqual(kmeans.iterations, hamerly.iterations)
+      self.assertAlmostEqual(kmeans.RSS(), hamerly.RSS())
+      self.assertEqual([c.members.tolist() for c in kmeans.clusters], [c.members.tolist() for c in hamerly.clusters])
+
+      # KMeansCluster computes every distance on each iteration, then the final RSS
+      plain = kmeans.iterations * 400 * 8 + 400
+      self.assertEqual(hamerly.distances_evaluated + hamerly.distances_skipped, plain)
+      self.assertLess(hamerly.distances_evaluated, plain / 2)
+
+  def test13_compact_instances(self):
+    """Instances keep their values in arrays, possibly views of a matrix"""
+    matrix = np.array([[1, 2], [3, 4]], dtype=float)
+    instance = Instance(values=matrix[0])
+    self.assertFalse(hasattr(instance, "__dict__"))
+    self.assertTrue(np.shares_memory(instance.array, matrix))
+    self.assertEqual(instance.values, [1, 2])
+    self.assertEqual(instance.dimensions, 2)
+
+    # the arithmetic API is kept
+    self.assertEqual((instance + Instance(values=[1, 1])).values, [2, 3])
+    self.assertEqual((instance / 2).values, [0.5, 1])
+    self.assertEqual(instance.get_dist(Instance(values=[4, 6])), 5)
+
+    # in-place updates never write into the shared matrix
+    instance += Instance(values=matrix[1])
+    instance -= 1
+    self.assertEqual(instance.values, [3, 5])
+    self.assertEqual(matrix.tolist(), [[1, 2], [3, 4]])
+
+    # nor into the array of the caller
+    values = np.array([1., 2.])
+    instance = Instance(values=values)
+    instance += Instance(values=[1, 1])
+    self.assertEqual(values.tolist(), [1, 2])
+    self.assertEqual(instance.values, [2, 3])
+
+  def test14_kmeans_hashed_stream(self):
+    """Hashed batches keep the centroids at a fixed width, without any vocabulary"""
+    hasher = FeatureHasher(width=32, signed=True)
+    stream = MiniBatchKMeansCluster(2, dimensions=hasher.width, spherical=True)
+    batches = [["apple banana", "car engine"], ["apple fruit banana", "engine wheel car"], ["fruit apple", "road wheel"]]
+    for b_iter, texts in enumerate(batches):
+      docs = [Doc(index=f"{b_iter}-{i}", text=text) for i, text in enumerate(texts)]
+      labels = stream.partial_fit(hasher.transform(docs))
+      self.assertNotEqual(labels[0], labels[1])
+      self.assertEqual(stream.get_centroids().shape, (2, 32))
+
+    docs = [Doc(index=i, text=text) for i, text in enumerate(["apple banana", "car engine", "banana apple fruit", "car wheel"])]
+    kmeans = KMeansCluster(2, dimensions=hasher.width, backend=BACKEND_NUMPY, spherical=True)
+    kmeans.train(hasher.transform(docs), items=docs)
+    self.assertEqual(sorted(sorted(doc.index for doc in c.instances) for c in kmeans.clusters), [[0, 2], [1, 3]])
+
   def verbose_clustering(self, cluster_count, seed_count, instances, dimensions):
     start_time = datetime.now()
 
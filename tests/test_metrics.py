@@ -0,0 +1,94 @@
+import logging
+import unittest
+import xmlrunner
+
+from tut_py_irtx.IndexController import *
+from tut_py_irtx.Metrics import *
+from tests.stub_inv_index import *
+
+def setUpModule():
+  """Triggered before all module tests"""
+  logging.debug("setUpModule is triggered")
+
+def tearDownModule():
+  """Triggered after all module tests"""
+  logging.debug("tearDownModule is triggered")
+
+class MetricsTest(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    """Triggered before all class tests"""
+    logging.debug("setUpModule is triggered")
+
+  def setUp(self):
+    """Triggered before each test"""
+    logging.debug("setUp is triggered")
+    METRICS.reset()
+
+  def test01_disabled_records_nothing(self):
+    """A disabled registry hands out the shared no-op timer"""
+    metrics = Metrics()
+    self.assertIs(metrics.timer(STAGE_MERGE), NULL_TIMER)
+    with metrics.timer(STAGE_MERGE):
+      metrics.increment("docs")
+      metrics.observe("sizes", 3)
+    self.assertEqual(metrics.to_dict(), {"counters": {}, "histograms": {}, "timers": {}})
+    self.assertEqual(metrics.to_prometheus(), "")
+
+  def test02_export(self):
+    """Counters, histograms and timers are exported to a dict and the Prometheus format"""
+    metrics = Metrics(enabled=True, buckets=(1, 10))
+    metrics.increment("docs")
+    metrics.increment("docs", 2)
+    for value in [0.5, 5, 50]:
+      metrics.observe("sizes", value)
+    with metrics.timer(STAGE_SORT):
+      pass
+
+    out = metrics.to_dict()
+    self.assertEqual(out["counters"], {"docs": 3})
+    self.assertEqual(out["histograms"]["sizes"], {"count": 3, "sum": 55.5, "buckets": {"1": 1, "10": 2, "+Inf": 3}})
+    self.assertEqual(out["timers"][STAGE_SORT]["count"], 1)
+    self.assertGreaterEqual(metrics.get_seconds(STAGE_SORT), 0)
+
+    lines = metrics.to_prometheus(prefix="test").splitlines()
+    self.assertIn("# TYPE test_docs_total counter", lines)
+    self.assertIn("test_docs_total 3", lines)
+    self.assertIn('test_sizes_bucket{le="10"} 2', lines)
+    self.assertIn("test_sizes_count 3", lines)
+    self.assertIn('test_stage_seconds_bucket{stage="sort",le="+Inf"} 1', lines)
+    self.assertIn('test_stage_seconds_count{stage="sort"} 1', lines)
+
+  def test03_instrumented_stages(self):
+    """Building and querying report their stages"""
+    METRICS.enable()
+    try:
+      ic = IndexController([Doc(text=stub_doc1, index=stub_doc1_id), Doc(text=stub_doc2, index=stub_doc2_id)])
+      ic.build()
+      new_terms = METRICS.counters["inverted_new_terms"]
+      grams_sorted = METRICS.counters["kgram_grams_sorted"]
+      ic.query_intersection(["the", "numb*"], wildcard=True)
+      ic.query_intersection(["the", "data"], ranked=True)
+    finally:
+      METRICS.disable()
+
+    for stage in [STAGE_TOKENIZE, STAGE_MERGE, STAGE_SORT, STAGE_INTERSECT, STAGE_SCORE, STAGE_EXPAND]:
+      self.assertIn(stage, METRICS.timers)
+    self.assertEqual(METRICS.counters["docs_analyzed"], 2)
+    self.assertEqual(METRICS.counters["queries"], 2)
+    self.assertEqual(new_terms, len(ic.get_inv_index()))
+    self.assertEqual(grams_sorted, len(ic.kgram_indexer().index))
+
+  def tearDown(self):
+    """Triggered after each test"""
+    logging.debug("tearDown is triggered")
+    METRICS.reset()
+
+  @classmethod
+  def tearDownClass(cls):
+    """Triggered  after all class tests"""
+    logging.debug("tearDownClass is triggered")
+
+if __name__ == '__main__':
+  unittest.main(testRunner=xmlrunner.XMLTestRunner(output='test-reports'))
@@ -1,8 +1,14 @@
 import csv
 import logging
 import math
+import multiprocessing
+import os
+import random
+import time
 import unittest
 import xmlrunner
+import zlib
+from unittest import mock
 
 # import matplotlib.pyplot as plt
 
@@ -12,6 +18,7 @@ from tests.stub_lev_dist import *
 from tut_py_irtx.InvertedIndexer import *
 from tut_py_irtx.Doc import *
 from tut_py_irtx.PerceptronClassifier import *
+from tut_py_irtx.MultiLabelPerceptronClassifier import *
 
 import tut_py_irtx.ClassifierUtil as cu
 
@@ -23,6 +30,13 @@ def tearDownModule():
   """Triggered after all module tests"""
   logging.debug("tearDownModule is triggered")
 
+def _fail_or_hang_shard(connection, indptr, indices, data, labels, factor):
+  """Worker of a shard, the positive shard fails on its first epoch, the other one hangs"""
+  connection.recv()
+  if labels[0] == 1:
+    os._exit(1)
+  time.sleep(60)
+
 class PerceptronTest(unittest.TestCase):
 
   PREDICTION_MAP = {"pos": 1, "neg": -1}
@@ -255,6 +269,197 @@ NOT_CAT |          0          1          0
     # now for the magic ... positive f1score (fire)^inf
     self.assertEqual(math.round(f1score, 2), 1.11)
 
+  def test09_vectorized_training(self):
+    """Mispredicted instances only update the weights, over multiple epochs"""
+    instances = [Doc(index=0, text="good great", labels=[1]),
+                 Doc(index=1, text="bad awful", labels=[-1]),
+                 Doc(index=2, text="great fun", labels=[1]),
+                 Doc(index=3, text="awful boring", labels=[-1])]
+
+    for averaged in [False, True]:
+      random.seed(1)
+      pc = PerceptronClassifier(instances, epochs=5, averaged=averaged)
+      pc.train()
+
+      self.assertEqual(list(pc.weights.keys()), ["good", "great", "bad", "awful", "fun", "boring"])
+      for text, weight in pc.weights.items():
+        self.assertEqual(weight, pc.weight_vector[pc.store.vocabulary[text]])
+
+      predictions = [pc.predict(instance)[0] for instance in instances]
+      self.assertEqual(predictions, [1, -1, 1, -1])
+      self.assertGreater(pc.weights["great"], 0)
+      self.assertLess(pc.weights["awful"], 0)
+
+    # a correctly predicted instance leaves the weights as they are
+    weights = dict(pc.weights)
+    pc.train()
+    self.assertEqual(pc.weights, weights)
+
+    # unseen terms are ignored while testing
+    self.assertEqual(pc.predict(Doc(index=4, text="unseen words")), [-1])
+    self.assertNotIn("unseen", pc.store.vocabulary)
+
+  def test10_predict_batch(self):
+    """Batch predictions match the per instance predictions"""
+    instances = PerceptronTest.parse_csv_reviews("tests/stub_semantics_train.csv")
+    test_instances = PerceptronTest.parse_csv_reviews("tests/stub_semantics_test.csv")
+
+    pc = PerceptronClassifier(instances, epochs=3)
+    pc.train()
+    vocabulary_size = len(pc.store.terms)
+
+    labels, margins = pc.predict_batch(test_instances + instances)
+    self.assertEqual(labels.tolist(), [pc.predict(instance)[0] for instance in test_instances + instances])
+    for instance, margin in zip(instances, margins[len(test_instances):].tolist()):
+      term_counts = pc.get_term_counts(instance)
+      self.assertAlmostEqual(margin, sum(pc.weights[text] * count for text, count in term_counts))
+
+    # the test docs are neither stored nor grow the vocabulary
+    self.assertEqual(len(pc.store.terms), vocabulary_size)
+    self.assertEqual(len(pc.store), len(instances))
+
+    pc.assign_labels(test_instances)
+    self.assertEqual([instance.predicted_labels for instance in test_instances], [[label] for label in labels[:4].tolist()])
+
+  def test11_multi_class_and_multi_label(self):
+    """One-vs-rest perceptrons share the analyzed docs and the features"""
+    instances = [Doc(index=0, text="goal match striker", labels=["sport"]),
+                 Doc(index=1, text="election vote party", labels=["politics"]),
+                 Doc(index=2, text="stock market shares", labels=["economy"]),
+                 Doc(index=3, text="striker transfer fee market", labels=["economy", "sport"]),
+                 Doc(index=4, text="party vote budget shares", labels=["economy", "politics"])]
+
+    random.seed(2)
+    pc = MultiLabelPerceptronClassifier(instances, epochs=10)
+    pc.train()
+    self.assertEqual(pc.labels, ["economy", "politics", "sport"])
+    self.assertEqual(pc.store.analyzed_count, len(instances))
+    self.assertEqual(pc.weight_vector.shape[1], 3)
+
+    labels, margins = pc.predict_batch(instances[:3])
+    self.assertEqual(labels, [["sport"], ["politics"], ["economy"]])
+    self.assertEqual(margins.shape, (3, 3))
+    self.assertEqual(pc.weights["sport"]["striker"], pc.weight_vector[pc.store.vocabulary["striker"], 2])
+
+    random.seed(2)
+    pc = MultiLabelPerceptronClassifier(instances, epochs=10, multi_label=True)
+    pc.train()
+    tests = [Doc(index=5, text="striker market"), Doc(index=6, text="unseen")]
+    pc.assign_labels(tests)
+    self.assertEqual([test.predicted_labels for test in tests], [["economy", "sport"], []])
+
+    cmatrix = cu.get_confusion_matrix([i.labels for i in instances], pc.predict_batch(instances)[0])
+    self.assertEqual(sum(cmatrix[label][label] for label in pc.labels), 7)
+
+    random.seed(2)
+    pc = MultiLabelPerceptronClassifier(instances, epochs=10, hasher=FeatureHasher(width=64, signed=True))
+    pc.train()
+    self.assertEqual(pc.weight_vector.shape, (64, 3))
+    self.assertEqual(pc.predict_batch(instances[:3])[0], [["sport"], ["politics"], ["economy"]])
+
+  def test12_hashed_and_parallel_training(self):
+    """Hashed features train as the term ids do, in parallel over shards mixed each epoch"""
+    instances = [Doc(index=i, text=text, labels=[label]) for i, (text, label) in enumerate(
+                   [("good great", 1), ("bad awful", -1), ("great fun", 1), ("awful boring", -1),
+                    ("fun good movie", 1), ("boring bad plot", -1)])]
+
+    hasher = FeatureHasher(width=64)
+    self.assertRaises(ValueError, FeatureHasher, 0)
+
+    random.seed(1)
+    pc = PerceptronClassifier(instances, epochs=5, hasher=hasher, track_terms=True)
+    pc.train()
+    self.assertEqual(len(pc.weight_vector), 64)
+    self.assertEqual(pc.weights["great"], pc.weight_vector[hasher.hash_text("great")])
+    self.assertEqual([pc.predict(instance)[0] for instance in instances], [1, -1, 1, -1, 1, -1])
+
+    # nothing is kept per term nor per doc unless tracked, whatever the count of docs
+    stream = [Doc(index=i, text=f"term{i} other{i} common", labels=[1 if i % 2 else -1]) for i in range(500)]
+    pc = PerceptronClassifier(stream, epochs=2, hasher=hasher)
+    pc.train()
+    pc.predict(Doc(index=500, text="term500 common"), test=False)
+    self.assertEqual((len(pc.store), len(pc.store.terms)), (0, 0))
+    self.assertEqual((len(pc.weights), len(pc.hashed_terms)), (0, 0))
+    self.assertEqual(vars(hasher), {"width": 64, "signed": False})
+    self.assertEqual(len(pc.weight_vector), 64)
+    self.assertLessEqual(len(pc.feature_ids), 64)
+
+    # unseen terms get the weight of their column
+    unseen = Doc(index=501, text="unseen words")
+    columns, values = hasher.get_row(pc.analyzer.count_terms(unseen.text))
+    expected = float(np.where(pc.is_feature, pc.weight_vector, 0)[columns].dot(values))
+    self.assertAlmostEqual(pc.predict_batch([unseen])[1][0], expected)
+    self.assertNotEqual(expected, 0)
+
+    # signed hashing cancels the colliding counts out, a term keeps the signed weight of its column
+    signed = FeatureHasher(width=64, signed=True)
+    column, sign = signed.hash_signed_text("great")
+    self.assertEqual(column, hasher.hash_text("great"))
+    self.assertIn(sign, [1, -1])
+    columns, values = signed.get_row({"great": 2, "bad": 1})
+    self.assertEqual(signed.transform([Doc(index=0, text="great bad great")]).to_dense()[0, columns].tolist(), values.tolist())
+
+    random.seed(1)
+    pc = PerceptronClassifier(instances, epochs=5, hasher=signed, track_terms=True)
+    pc.train()
+    self.assertEqual(pc.weights["great"], sign * pc.weight_vector[column])
+    self.assertEqual(pc.predict_batch(instances)[0].tolist(), [1, -1, 1, -1, 1, -1])
+
+    for averaged in [False, True]:
+      random.seed(1)
+      pc = PerceptronClassifier(instances, epochs=5, averaged=averaged, workers=2)
+      pc.train()
+      self.assertEqual(len(pc.get_shards(2)), 2)
+      self.assertEqual(pc.predict_batch(instances)[0].tolist(), [1, -1, 1, -1, 1, -1])
+      self.assertEqual(pc.predict(Doc(index=6, text="good fun")), [1])
+
+  def test13_confusion_matrix_arrays(self):
+    """Labels are compared as sets, in any order, the stats come from the row and column sums"""
+    ys    = [[1, 0], [1], [0]   , [0], []]
+    yhats = [[0]   , [1], [1, 0], [1], [1]]
+
+    cmatrix = cu.ConfusionMatrix.from_labels(ys, yhats, support_not_categorized=True)
+    self.assertEqual(cmatrix.labels, [0, 1, cu.NOT_CAT])
+    self.assertEqual(cmatrix.counts.tolist(), [[2, 1, 0], [0, 1, 1], [0, 2, 0]])
+    self.assertEqual(cmatrix.to_dict(), cu.get_confusion_matrix(ys, yhats, True))
+
+    self.assertEqual(cmatrix.get_precisions(), {0: 2/3, 1: 1/2, cu.NOT_CAT: 0})
+    self.assertEqual(cmatrix.get_recalls(), {0: 1, 1: 1/4, cu.NOT_CAT: 0})
+    self.assertEqual(cu.get_precisions(cmatrix.to_dict()), cmatrix.get_precisions())
+    self.assertEqual(cu.get_f1score(cmatrix), cmatrix.get_f1score())
+    self.assertEqual(cu.get_confusion_matrix([], []), {})
+
+  def test14_confusion_accumulator(self):
+    """Batches accumulated and merged across accumulators give the matrix of all the instances"""
+    ys    = [[1, 0], [1], [0]   , [0], [], ["x"], [1]]
+    yhats = [[0]   , [1], [1, 0], [1], [1], [0], ["x"]]
+
+    first = cu.ConfusionAccumulator(support_not_categorized=True)
+    first.update(ys[:2], yhats[:2]).update(ys[2:4], yhats[2:4])
+    second = cu.ConfusionAccumulator(support_not_categorized=True)
+    second.update(ys[4:], yhats[4:])
+    first.merge(second)
+
+    self.assertEqual(len(first), len(ys))
+    self.assertEqual(first.get_confusion_matrix(), cu.get_confusion_matrix(ys, yhats, True))
+    self.assertEqual(first.get_matrix().labels, [0, 1, "x", cu.NOT_CAT])
+    self.assertEqual(first.get_f1score(), cu.get_f1score(cu.get_confusion_matrix(ys, yhats, True)))
+    self.assertRaises(ValueError, first.merge, cu.ConfusionAccumulator())
+
+  def test15_parallel_worker_failure(self):
+    """A failing worker raises, and every worker gets stopped, even a hung one"""
+    # the labels follow the shards, thus a shard is all positive and the other all negative
+    instances = [Doc(index=i, text=f"term{i} common", labels=[1 if zlib.crc32(str(i).encode("utf-8")) % 2 == 0 else -1])
+                 for i in range(10)]
+    pc = PerceptronClassifier(instances, epochs=3, workers=2)
+    pc.JOIN_TIMEOUT = 0.2
+
+    start = time.perf_counter()
+    with mock.patch("tut_py_irtx.PerceptronClassifier._train_shard", _fail_or_hang_shard):
+      self.assertRaises(EOFError, pc.train)
+    self.assertLess(time.perf_counter() - start, 30)
+    self.assertEqual(multiprocessing.active_children(), [])
+
   def tearDown(self):
     """Triggered after each test"""
     logging.debug("tearDown is triggered")
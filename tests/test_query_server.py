@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import os
+import tempfile
+import time
+import unittest
+import xmlrunner
+
+from tut_py_irtx.IndexController import *
+from tut_py_irtx.QueryServer import *
+from tests.stub_inv_index import *
+
+def setUpModule():
+  """Triggered before all module tests"""
+  logging.debug("setUpModule is triggered")
+
+def tearDownModule():
+  """Triggered after all module tests"""
+  logging.debug("tearDownModule is triggered")
+
+def slow_query(seconds):
+  time.sleep(seconds)
+  return 0, []
+
+class SlowQueryServer(QueryServer):
+  """Serves every query after a delay, regardless of the index"""
+  DELAY = 0.2
+
+  def submit(self, request):
+    return self.executor.submit(slow_query, SlowQueryServer.DELAY)
+
+def get_controller():
+  return IndexController([Doc(text=stub_doc1, index=stub_doc1_id), Doc(text=stub_doc2, index=stub_doc2_id)])
+
+def get_indices(docs):
+  return [doc.index for doc in docs]
+
+class QueryServerTest(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    """Triggered before all class tests"""
+    logging.debug("setUpModule is triggered")
+
+  def setUp(self):
+    """Triggered before each test"""
+    logging.debug("setUp is triggered")
+
+  def test01_request_parsing(self):
+    """A request line is parsed into a query, invalid ones raise along with their id"""
+    request = QueryRequest.parse(b'{"id": 3, "query": "inf*", "wildcard": true, "limit": 2}\n')
+    self.assertEqual((request.request_id, request.op, request.text_list), (3, "query", ["inf*"]))
+    self.assertEqual((request.wildcard, request.ranked, request.limit), (True, False, 2))
+
+    self.assertEqual(QueryRequest.parse('{"op": "stats"}').op, "stats")
+
+    for line, request_id in [("not json", None), ("[1]", None), ('{"id": 4}', 4), ('{"id": 5, "query": []}', 5),
+                             ('{"id": 6, "query": "x", "limit": -1}', 6), ('{"id": 7, "op": "drop"}', 7),
+                             ('{"id": 8, "query": "x", "wildcard": "false"}', 8), ('{"id": 9, "query": "x", "ranked": 1}', 9),
+                             ('{"id": 10, "query": "x", "limit": true}', 10)]:
+      with self.assertRaises(QueryRequestError) as context:
+        QueryRequest.parse(line)
+      self.assertEqual(context.exception.request_id, request_id)
+
+  def test02_concurrent_queries(self):
+    """Concurrent queries of several clients match the direct queries"""
+    ic = get_controller()
+    queries = [(["the", "data"], False, False), (["the", "numb*"], True, False),
+               ("inf*", True, False), (["the", "data"], False, True)]
+    expected = [get_indices(ic.query_intersection(text, wildcard=wildcard, ranked=ranked))
+                for text, wildcard, ranked in queries]
+
+    async def run():
+      server = await QueryServer(get_controller()).start()
+      host, port = server.address
+      clients = [await QueryClient().connect(host, port) for _ in range(3)]
+      try:
+        responses = await asyncio.gather(*[clients[i % len(clients)].query(text, wildcard, ranked)
+                                           for i, (text, wildcard, ranked) in enumerate(queries * 3)])
+        limited = await clients[0].query("inf*", wildcard=True, limit=1)
+        invalid = await clients[0].request({"query": 1})
+        stats = await clients[1].stats()
+      finally:
+        for client in clients:
+          await client.close()
+        await server.close()
+      return responses, limited, invalid, stats
+
+    responses, limited, invalid, stats = asyncio.run(run())
+
+    for response, indices in zip(responses, expected * 3):
+      self.assertEqual(response["status"], STATUS_OK)
+      self.assertEqual([doc["index"] for doc in response["docs"]], indices)
+      self.assertEqual(response["count"], len(indices))
+    ranked = responses[3]["docs"]
+    self.assertTrue(all(doc["rank"] is not None for doc in ranked))
+    self.assertEqual([doc["rank"] for doc in ranked], sorted([doc["rank"] for doc in ranked], reverse=True))
+
+    self.assertEqual((limited["count"], len(limited["docs"])), (2, 1))
+    self.assertEqual(invalid["status"], STATUS_ERROR)
+    self.assertEqual(stats["stats"]["served"], len(queries) * 3 + 1)
+    self.assertEqual(stats["stats"]["errors"], 1)
+    self.assertEqual(stats["stats"]["pending"], 0)
+
+  def test03_timeout_and_backpressure(self):
+    """Slow queries time out, and hold their slot until their worker is done"""
+    async def run():
+      server = await SlowQueryServer(get_controller(), max_pending=1, timeout=SlowQueryServer.DELAY / 4).start()
+      client = await QueryClient().connect(*server.address)
+      try:
+        start = time.perf_counter()
+        responses = await asyncio.gather(client.query("the"), client.query("data"))
+        seconds = time.perf_counter() - start
+        pending = server.pending
+        await asyncio.sleep(SlowQueryServer.DELAY * 1.5)
+        stats = await client.stats()
+      finally:
+        await client.close()
+        await server.close()
+      return responses, seconds, pending, stats
+
+    responses, seconds, pending, stats = asyncio.run(run())
+    self.assertEqual([response["status"] for response in responses], [STATUS_TIMEOUT, STATUS_TIMEOUT])
+    # the second query is only read once the first one released its slot
+    self.assertGreaterEqual(seconds, SlowQueryServer.DELAY)
+    self.assertEqual(pending, 1)
+    self.assertEqual(stats["stats"]["timeouts"], 2)
+    self.assertEqual(stats["stats"]["pending"], 0)
+
+    # a query done once the loop is closed has no slot to release
+    loop = asyncio.new_event_loop()
+    loop.close()
+    SlowQueryServer(get_controller()).release_slot_threadsafe(loop)
+
+  def test04_process_workers(self):
+    """Worker processes serve over a Unix socket the same docs as the controller"""
+    ic = get_controller()
+    expected = get_indices(ic.query_intersection(["*nf*", "*est"], wildcard=True))
+
+    async def run(path):
+      server = await QueryServer(get_controller(), workers=2).start(path=path)
+      # the worker processes are started before the first query
+      self.assertEqual(len(server.executor._processes), 2)
+      client = await QueryClient().connect(path=path)
+      try:
+        return await asyncio.gather(*[client.query(["*nf*", "*est"], wildcard=True) for _ in range(4)])
+      finally:
+        await client.close()
+        await server.close()
+
+    with tempfile.TemporaryDirectory() as directory:
+      responses = asyncio.run(run(os.path.join(directory, "query.sock")))
+
+    for response in responses:
+      self.assertEqual(response["status"], STATUS_OK)
+      self.assertEqual([doc["index"] for doc in response["docs"]], expected)
+
+  def test05_broken_pool(self):
+    """A query that can not be submitted gets an error, and releases its slot"""
+    async def run():
+      server = await QueryServer(get_controller(), max_pending=1).start()
+      client = await QueryClient().connect(*server.address)
+      try:
+        server.executor.shutdown()
+        responses = [await client.query("the") for _ in range(2)]
+        stats = await client.stats()
+      finally:
+        await client.close()
+        await server.close()
+      return responses, stats
+
+    responses, stats = asyncio.run(run())
+    self.assertEqual([response["status"] for response in responses], [STATUS_ERROR, STATUS_ERROR])
+    self.assertIn("shutdown", responses[0]["error"])
+    self.assertEqual(stats["stats"]["errors"], 2)
+    self.assertEqual(stats["stats"]["pending"], 0)
+
+  def tearDown(self):
+    """Triggered after each test"""
+    logging.debug("tearDown is triggered")
+
+  @classmethod
+  def tearDownClass(cls):
+    """Triggered  after all class tests"""
+    logging.debug("tearDownClass is triggered")
+
+if __name__ == '__main__':
+  unittest.main(testRunner=xmlrunner.XMLTestRunner(output='test-reports'))
@@ -0,0 +1,76 @@
+import logging
+import unittest
+import xmlrunner
+
+import numpy as np
+
+from tut_py_irtx.SparseMatrix import *
+
+def setUpModule():
+  """Triggered before all module tests"""
+  logging.debug("setUpModule is triggered")
+
+def tearDownModule():
+  """Triggered after all module tests"""
+  logging.debug("tearDownModule is triggered")
+
+class SparseMatrixTest(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    """Triggered before all class tests"""
+    logging.debug("setUpModule is triggered")
+
+  def setUp(self):
+    """Triggered before each test"""
+    logging.debug("setUp is triggered")
+    self.dense = np.array([[1, 0, 2], [0, 0, 0], [0, 3, 0], [4, 0, 5]], dtype=float)
+    self.sparse = SparseMatrix.from_dense(self.dense)
+
+  def test01_structure(self):
+    """The matrix keeps the non-zero values only"""
+    self.assertEqual(self.sparse.nnz, 5)
+    self.assertEqual(len(self.sparse), 4)
+    self.assertTrue((self.sparse.to_dense() == self.dense).all())
+
+    rows = SparseMatrix.from_rows([([0, 2], [1, 2]), ([], []), ([1], [3]), ([0, 2], [4, 5])])
+    self.assertTrue((rows.to_dense() == self.dense).all())
+
+    taken = self.sparse.take_rows([3, 1, 0])
+    self.assertTrue((taken.to_dense() == self.dense[[3, 1, 0]]).all())
+
+    normalized = self.sparse.normalize_rows().to_dense()
+    self.assertTrue(np.allclose((normalized * normalized).sum(axis=1), [1, 0, 1, 1]))
+
+  def test02_products(self):
+    """The products match the dense products"""
+    vectors = np.arange(6, dtype=float).reshape(2, 3)
+    labels = np.array([1, 0, 0, 1])
+
+    self.assertTrue(np.allclose(self.sparse.dot(vectors[0]), self.dense @ vectors[0]))
+    self.assertTrue(np.allclose(self.sparse.dot(vectors.T), self.dense @ vectors.T))
+    self.assertTrue(np.allclose(self.sparse.dot_rows(vectors, labels), (self.dense * vectors[labels]).sum(axis=1)))
+    self.assertTrue(np.allclose(self.sparse.get_row_norms_squared(), (self.dense ** 2).sum(axis=1)))
+
+    sums = self.sparse.get_grouped_sums(labels, 2)
+    self.assertTrue(np.allclose(sums, [self.dense[labels == 0].sum(axis=0), self.dense[labels == 1].sum(axis=0)]))
+
+  def test03_sum_duplicates(self):
+    """Values at the same row and column are summed"""
+    matrix = SparseMatrix.from_rows([([2, 0, 2], [1, 1, 3]), ([], []), ([1, 1], [1, 2])], 3)
+    summed = matrix.sum_duplicates()
+    self.assertEqual(summed.nnz, 3)
+    self.assertEqual(summed.indices.tolist(), [0, 2, 1])
+    self.assertTrue((summed.to_dense() == [[1, 0, 4], [0, 0, 0], [0, 3, 0]]).all())
+
+  def tearDown(self):
+    """Triggered after each test"""
+    logging.debug("tearDown is triggered")
+
+  @classmethod
+  def tearDownClass(cls):
+    """Triggered  after all class tests"""
+    logging.debug("tearDownClass is triggered")
+
+if __name__ == '__main__':
+  unittest.main(testRunner=xmlrunner.XMLTestRunner(output='test-reports'))
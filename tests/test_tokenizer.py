@@ -0,0 +1,79 @@
+import logging
+import unittest
+import xmlrunner
+
+import tut_py_irtx.tokenizer as tokenizer
+import tut_py_irtx.util as util
+from tut_py_irtx.Doc import *
+from tests.stub_inv_index import *
+
+def setUpModule():
+  """Triggered before all module tests"""
+  logging.debug("setUpModule is triggered")
+
+def tearDownModule():
+  """Triggered after all module tests"""
+  logging.debug("tearDownModule is triggered")
+
+class TokenizerTest(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    """Triggered before all class tests"""
+    logging.debug("setUpModule is triggered")
+
+  def setUp(self):
+    """Triggered before each test"""
+    logging.debug("setUp is triggered")
+
+  @staticmethod
+  def legacy_preprocess(text):
+    return text.replace("[newline]", " "). \
+        replace("[NEWLINE]", " "). \
+        replace(",", " "). \
+        replace('"', " "). \
+        replace("”", " "). \
+        replace("“", " "). \
+        replace("?", " "). \
+        replace("!", " "). \
+        encode('ascii', 'ignore').decode('ascii')
+
+  def test01_preprocess_matches_chained_replace(self):
+    """The compiled preprocessing matches the chained replacements"""
+    samples = [stub_doc1, stub_doc2, stub_doc3,
+               'He said “hi”,[newline]then "bye"?[NEWLINE]Café is fun!',
+               ""]
+    for sample in samples:
+      self.assertEqual(tokenizer.preprocess(sample), TokenizerTest.legacy_preprocess(sample))
+
+  def test02_tokenize(self):
+    """Tokens are normalized and kept in order, including the repeated ones"""
+    text = 'This is a test, "a Test"! #tag @mention'
+    tokens = tokenizer.tokenize(text)
+    expected = [util.normalize(t) for t in TokenizerTest.legacy_preprocess(text).split()]
+    self.assertEqual(tokens, expected)
+    self.assertEqual(tokens, ["this", "is", "a", "test", "a", "test", "tag", "mention"])
+
+  def test03_count_tokens(self):
+    """Tokens are counted in order of their first appearance"""
+    counts = tokenizer.count_tokens("b a b. c B")
+    self.assertEqual(list(counts.items()), [("b", 3), ("a", 1), ("c", 1)])
+
+  def test04_fetch_terms_compatibility(self):
+    """fetch_terms still returns a Term per token"""
+    doc = Doc(text=stub_doc2, index=stub_doc2_id)
+    terms = Doc.fetch_terms(doc)
+    self.assertEqual([term.text for term in terms], Doc.tokenize(doc))
+    self.assertEqual(terms[0].occurances.head.data.doc_id, stub_doc2_id)
+
+    with self.assertRaises(TypeError):
+      Doc.tokenize("not a doc")
+
+  def tearDown(self):
+    """Triggered after each test"""
+    logging.debug("tearDown is triggered")
+
+  @classmethod
+  def tearDownClass(cls):
+    """Triggered  after all class tests"""
+    logging.debug("tearDownClass is triggered")
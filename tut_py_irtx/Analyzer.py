@@ -0,0 +1,213 @@
+import tut_py_irtx.tokenizer as tokenizer
+import tut_py_irtx.util as util
+
+# Policies for the URL and mention tokens
+KEEP = "keep"
+DROP = "drop"
+
+URL_PREFIXES = ("http:", "https:")
+MENTION_PREFIX = "@"
+
+ENGLISH_STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been
+before being below between both but by can could did do does doing down during
+each few for from further had has have having he her here hers herself him
+himself his how i if in into is it its itself just me more most my myself no nor
+not now of off on once only or other our ours ourselves out over own same she
+should so some such than that the their theirs them themselves then there these
+they this those through to too under until up very was we were what when where
+which while who whom why will with would you your yours yourself yourselves
+""".split())
+
+def s_stem(text):
+  """Light stemmer, that only conflates the plural forms (the S-stemmer)
+
+  Examples
+  --------
+  queries -> query, does -> doe, docs -> doc, status -> status, class -> class
+  """
+  if len(text) > 3 and text.endswith("ies") and not text.endswith(("eies", "aies")):
+    return text[:-3] + "y"
+  if len(text) > 3 and text.endswith("es") and not text.endswith(("aes", "ees", "oes")):
+    return text[:-1]
+  if len(text) > 2 and text.endswith("s") and not text.endswith(("us", "ss")):
+    return text[:-1]
+  return text
+
+class Analyzer():
+  """An analysis chain turning a raw text into the texts of the terms to index
+
+  The same analyzer should be shared by the indexers, the classifiers and
+  the query path, otherwise a query text would not match its indexed form.
+
+  The chain runs on each token as follows:
+  mention handling -> normalization -> URL handling -> stopword removal
+  -> stemming -> token filters
+
+  The analyzed form of each distinct token is cached, thus the chain runs
+  only once per distinct token.
+  """
+
+  DEFAULT_MAX_CACHE_SIZE = 100000
+
+  def __init__(self, stopwords=None, stemmer=None, urls=KEEP, mentions=KEEP, filters=None, max_cache_size=DEFAULT_MAX_CACHE_SIZE):
+    """
+
+    Parameters
+    ----------
+    stopwords : iterable of str or bool
+      Texts to drop, True to use the ENGLISH_STOPWORDS,
+      None or False to keep all the texts
+    stemmer : callable or bool
+      Callable mapping a normalized text to its stem, True to use `s_stem()`,
+      None or False to skip stemming
+    urls : str
+      KEEP or DROP the URL tokens, URLs are never stemmed
+    mentions : str
+      KEEP or DROP the mention tokens (starting with an '@'),
+      kept mentions are normalized into the mentioned name
+    filters : list of callable
+      Extra filters applied in order on each analyzed text,
+      a filter returns the (updated) text or None to drop it
+    max_cache_size : int
+      Max count of cached tokens, the cache is reset when exceeded
+    """
+    if stopwords is True:
+      stopwords = ENGLISH_STOPWORDS
+    self.stopwords = frozenset(util.normalize(s) for s in stopwords) if stopwords else frozenset()
+
+    self.stemmer = s_stem if stemmer is True else (stemmer or None)
+
+    if urls not in (KEEP, DROP) or mentions not in (KEEP, DROP):
+      raise ValueError(f"Unsupported token policy, expected either '{KEEP}' or '{DROP}'")
+    self.urls = urls
+    self.mentions = mentions
+
+    self.filters = [] if filters is None else list(filters)
+
+    self.max_cache_size = max_cache_size
+    self.cache = {}
+    self.cache_hits = 0
+    self.cache_misses = 0
+
+  @staticmethod
+  def is_url(text):
+    return text.startswith(URL_PREFIXES)
+
+  @staticmethod
+  def is_mention(text):
+    return text.startswith(MENTION_PREFIX)
+
+  def is_default(self):
+    """Return True if the analyzer only normalizes the tokens"""
+    return not (self.stopwords or self.stemmer or self.filters) and \
+           self.urls == KEEP and self.mentions == KEEP
+
+  def analyze_token_uncached(self, token):
+    """Run the analysis chain on a lowered raw token
+
+    Returns
+    -------
+    str
+      The analyzed text, None if the token is dropped
+    """
+    if self.mentions == DROP and Analyzer.is_mention(token):
+      return None
+
+    text = token.strip(util.NORMALIZE_STRIP_CHARS)
+
+    if Analyzer.is_url(text):
+      return None if self.urls == DROP else text
+
+    if text in self.stopwords:
+      return None
+
+    if self.stemmer is not None:
+      text = self.stemmer(text)
+
+    for token_filter in self.filters:
+      text = token_filter(text)
+      if text is None:
+        return None
+
+    return text
+
+  def analyze_token(self, token):
+    """Cached `analyze_token_uncached()`"""
+    try:
+      text = self.cache[token]
+      self.cache_hits += 1
+      return text
+    except KeyError:
+      pass
+
+    self.cache_misses += 1
+    text = self.analyze_token_uncached(token)
+    if len(self.cache) >= self.max_cache_size:
+      self.cache = {}
+    self.cache[token] = text
+    return text
+
+  def analyze(self, text):
+    """Return the analyzed texts of the given raw text, in order of appearance
+
+    Repeated texts are kept, dropped tokens are removed.
+    """
+    cache = self.cache
+    out = []
+    for token in tokenizer.preprocess(text).lower().split():
+      # inlined analyze_token(), as this is the hot loop of all the indexers
+      if token in cache:
+        self.cache_hits += 1
+        analyzed = cache[token]
+      else:
+        analyzed = self.analyze_token(token)
+        cache = self.cache
+
+      if analyzed is not None:
+        out.append(analyzed)
+    return out
+
+  def count_terms(self, text):
+    """Return a mapping of each analyzed text to its count in the given raw text
+
+    Returns
+    -------
+    dict
+      text -> count, ordered by the first appearance of each text
+    """
+    counts = {}
+    for analyzed in self.analyze(text):
+      counts[analyzed] = counts.get(analyzed, 0) + 1
+    return counts
+
+  def analyze_query(self, text):
+    """Analyze a single query text
+
+    Wildcard queries are only normalized, as they are expanded into
+    already analyzed texts.
+
+    Returns
+    -------
+    str
+      The analyzed text, None if the query text is dropped
+      (for example a stopword)
+    """
+    if "*" in text:
+      return util.normalize(text)
+    return self.analyze_token(text.lower())
+
+  def clear_cache(self):
+    self.cache = {}
+    self.cache_hits = 0
+    self.cache_misses = 0
+
+  def __str__(self):
+    out  = f"stopwords: {len(self.stopwords)}"
+    out += f" | stemmer: {getattr(self.stemmer, '__name__', self.stemmer)}"
+    out += f" | urls: {self.urls} | mentions: {self.mentions} | filters: {len(self.filters)}"
+    out += f" | cache: {len(self.cache)} tokens ({self.cache_hits} hits, {self.cache_misses} misses)"
+    return out
+
+# The analyzer used when none is given, it only normalizes the tokens
+DEFAULT_ANALYZER = Analyzer()
@@ -1,10 +1,249 @@
 import logging
 
+import numpy as np
+
 NOT_CAT = "NOT_CAT"
 
 def append_unique(inlist, val):
   return inlist if val in inlist else inlist + [val]
 
+class ConfusionMatrix():
+  """Label-encoded confusion matrix, the counts are kept in a NumPy array
+
+  Each instance is compared as a set of labels against its set of predicted
+  labels, every matched label counts once on the diagonal, then every
+  unmatched label counts once against each unmatched predicted label.
+  An instance with unmatched labels on one side only counts against
+  NOT_CAT, if the non categorized instances are supported.
+
+  Attributes
+  ----------
+  labels : list
+    The label of each row and column, sorted if orderable,
+    followed by NOT_CAT if it got used
+  counts : numpy.ndarray
+    (labels x labels) counts, rows are the targets and columns the predictions
+  """
+
+  def __init__(self, labels, counts):
+    self.labels = labels
+    self.counts = counts
+
+  @classmethod
+  def from_labels(cls, ys, yhats, support_not_categorized=False):
+    """Build the confusion matrix of the targets and the predicted labels
+
+    Parameters
+    ----------
+    ys : list of list
+      Target labels of each instance
+    yhats : list of list
+      Predicted labels of each instance
+    support_not_categorized : bool
+      Count the unmatched labels of an instance with no unmatched
+      labels on the other side against NOT_CAT
+    """
+    label_ids = {}
+    y_instances, y_labels = cls.encode(ys, label_ids)
+    yhat_instances, yhat_labels = cls.encode(yhats, label_ids)
+    count = len(label_ids)
+
+    # a key per distinct label of an instance, sorted by instance
+    y_keys = np.unique(y_instances * count + y_labels)
+    yhat_keys = np.unique(yhat_instances * count + yhat_labels)
+    matched = np.intersect1d(y_keys, yhat_keys, assume_unique=True)
+    y_missed = np.setdiff1d(y_keys, yhat_keys, assume_unique=True)
+    yhat_missed = np.setdiff1d(yhat_keys, y_keys, assume_unique=True)
+
+    size = count + 1
+    counts = np.bincount((matched % count) * (size + 1), minlength=size * size) if count > 0 \
+             else np.zeros(size * size, dtype=np.int64)
+    counts = counts.reshape(size, size)
+
+    if count > 0:
+      instances = len(ys)
+      y_instances, y_labels = np.divmod(y_missed, count)
+      yhat_instances, yhat_labels = np.divmod(yhat_missed, count)
+      y_counts = np.bincount(y_instances, minlength=instances)
+      yhat_counts = np.bincount(yhat_instances, minlength=instances)
+
+      # each unmatched target against each unmatched prediction of its instance,
+      # both sorted by instance, thus the predictions of an instance are contiguous
+      repeats = yhat_counts[y_instances]
+      yhat_starts = np.concatenate(([0], np.cumsum(yhat_counts)[:-1]))
+      pair_starts = np.concatenate(([0], np.cumsum(repeats)[:-1]))
+      positions = np.repeat(yhat_starts[y_instances] - pair_starts, repeats) + np.arange(repeats.sum())
+      np.add.at(counts, (np.repeat(y_labels, repeats), yhat_labels[positions]), 1)
+
+      if support_not_categorized:
+        y_only = yhat_counts[y_instances] == 0
+        yhat_only = y_counts[yhat_instances] == 0
+        counts[:count, count] += np.bincount(y_labels[y_only], minlength=count)
+        counts[count, :count] += np.bincount(yhat_labels[yhat_only], minlength=count)
+
+    labels = list(label_ids.keys())
+    if counts[count].any() or counts[:, count].any():
+      labels.append(NOT_CAT)
+    else:
+      counts = counts[:count, :count]
+    return cls.from_unordered(labels, counts)
+
+  @classmethod
+  def from_unordered(cls, labels, counts):
+    """Create a matrix with the labels sorted if orderable, NOT_CAT last"""
+    order = [i for i, label in enumerate(labels) if label != NOT_CAT]
+    try:
+      order.sort(key=lambda i: labels[i])
+    except TypeError:
+      pass
+    order.extend(i for i, label in enumerate(labels) if label == NOT_CAT)
+    return cls([labels[i] for i in order], counts[np.ix_(order, order)])
+
+  @staticmethod
+  def encode(label_lists, label_ids):
+    """Encode the labels of the instances, by their order of first appearance
+
+    Parameters
+    ----------
+    label_ids : dict
+      label -> id, extended in place with the unseen labels
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+      (instances, ids), the instance and the label id of each label
+    """
+    instances = []
+    ids = []
+    for i, labels in enumerate(label_lists):
+      for label in labels:
+        label_id = label_ids.setdefault(label, len(label_ids))
+        instances.append(i)
+        ids.append(label_id)
+    return np.array(instances, dtype=np.int64), np.array(ids, dtype=np.int64)
+
+  @classmethod
+  def from_dict(cls, cmatrix):
+    labels = list(cmatrix.keys())
+    counts = np.array([[cmatrix[row][column] for column in labels] for row in labels], dtype=np.int64)
+    return cls(labels, counts.reshape(len(labels), len(labels)))
+
+  def to_dict(self):
+    """Get the counts as target label -> (predicted label -> count)"""
+    rows = self.counts.tolist()
+    return {label: dict(zip(self.labels, row)) for label, row in zip(self.labels, rows)}
+
+  def get_ratios(self, sums):
+    """Map each label of a non-zero sum to its diagonal count over the sum"""
+    tps = np.diagonal(self.counts)
+    kept = np.flatnonzero(sums != 0)
+    ratios = tps[kept] / sums[kept]
+    return {self.labels[i]: ratio for i, ratio in zip(kept.tolist(), ratios.tolist())}
+
+  def get_precisions(self):
+    return self.get_ratios(self.counts.sum(axis=1))
+
+  def get_recalls(self):
+    return self.get_ratios(self.counts.sum(axis=0))
+
+  def get_f1score(self):
+    count = len(self.labels)
+
+    precision = sum(self.get_precisions().values())/count
+    recall = sum(self.get_recalls().values())/count
+
+    if (precision + recall) == 0:
+      logging.error("The classifier got 0 precision and 0 recall!\
+      The labels could be inverted")
+      return 0
+
+    return (2 * precision * recall) / (precision + recall)
+
+  def __str__(self):
+    return visualize_cmatrix(self.to_dict())
+
+class ConfusionAccumulator():
+  """Accumulate a confusion matrix batch by batch
+
+  Only the counts are kept, not the label lists, thus the predictions could
+  be evaluated while being streamed. Accumulators of worker processes are
+  merged into a single one, the result does not depend on the batches split.
+  """
+  def __init__(self, support_not_categorized=False):
+    """
+
+    Parameters
+    ----------
+    support_not_categorized : bool
+      Check ConfusionMatrix.from_labels()
+    """
+    self.support_not_categorized = support_not_categorized
+    self.clear()
+
+  def clear(self):
+    # labels in order of their first appearance, counts are grown geometrically
+    self.labels = []
+    self.label_ids = {}
+    self.counts = np.zeros((0, 0), dtype=np.int64)
+    self.instances = 0
+
+  def __len__(self):
+    """Count of the accumulated instances"""
+    return self.instances
+
+  def get_label_ids(self, labels):
+    """Get the ids of the labels, adding the unseen ones"""
+    for label in labels:
+      if label not in self.label_ids:
+        self.label_ids[label] = len(self.labels)
+        self.labels.append(label)
+
+    if len(self.labels) > len(self.counts):
+      capacity = max(len(self.labels), 2 * len(self.counts))
+      counts = np.zeros((capacity, capacity), dtype=np.int64)
+      counts[:len(self.counts), :len(self.counts)] = self.counts
+      self.counts = counts
+
+    return np.array([self.label_ids[label] for label in labels], dtype=np.int64)
+
+  def add_matrix(self, cmatrix, instances=0):
+    ids = self.get_label_ids(cmatrix.labels)
+    self.counts[np.ix_(ids, ids)] += cmatrix.counts
+    self.instances += instances
+
+  def update(self, ys, yhats):
+    """Accumulate a batch of targets and their predicted labels"""
+    self.add_matrix(ConfusionMatrix.from_labels(ys, yhats, self.support_not_categorized), len(ys))
+    return self
+
+  def merge(self, other):
+    """Add the counts of another accumulator, for example of a worker process"""
+    if other.support_not_categorized != self.support_not_categorized:
+      raise ValueError("Only accumulators of the same NOT_CAT support could be merged")
+    self.add_matrix(other.get_matrix(), other.instances)
+    return self
+
+  def get_matrix(self):
+    """Get the ConfusionMatrix of the accumulated instances"""
+    count = len(self.labels)
+    return ConfusionMatrix.from_unordered(self.labels, self.counts[:count, :count])
+
+  def get_confusion_matrix(self):
+    """Check get_confusion_matrix()"""
+    return self.get_matrix().to_dict()
+
+  def get_precisions(self):
+    return self.get_matrix().get_precisions()
+
+  def get_recalls(self):
+    return self.get_matrix().get_recalls()
+
+  def get_f1score(self):
+    return self.get_matrix().get_f1score()
+
+  def __str__(self):
+    return f"confusion accumulator of {self.instances} instances over {len(self.labels)} labels"
+
 def get_confusion_matrix(ys, yhats, support_not_categorized=False):
   """
   Parameters
@@ -13,109 +252,16 @@ def get_confusion_matrix(ys, yhats, support_not_categorized=False):
     If a target is not categorized at all and it should be categorized
     add a new label called NOT_CAT and append into it
     This should only be needed if a multi target labeling problem is given
+
+  Returns
+  -------
+  dict
+    target label -> (predicted label -> count), check ConfusionMatrix
   """
-  cm = {}
+  return ConfusionMatrix.from_labels(ys, yhats, support_not_categorized).to_dict()
 
-  visited_labels = []
-
-  logging.debug("\n")
-  for i in range(len(ys)):
-    logging.debug(f"[CM][INSTANCE: {i}][LABELS:      {ys[i]}]")
-    logging.debug(f"[CM][INSTANCE: {i}][PRED_LABELS: {yhats[i]}]")
-    yl_iter  = iter(ys[i])
-    yhl_iter = iter(yhats[i])
-    try:
-      non_matched_yls = []
-      non_matched_yhls = []
-
-      ylabel    = next(yl_iter)
-      yhatlabel = next(yhl_iter)
-      while True:
-        matching_y = False
-        matching_yh = False
-
-        # for a single labeled target, there is only one or none
-        if ylabel == yhatlabel:
-          visited_labels = append_unique(visited_labels, ylabel)
-
-          yl = ylabel
-          cm.setdefault(yl, {})
-          cm[yl].setdefault(yl, 0)
-          cm[yl][yl] = cm[yl][yl] + 1
-
-          try:
-            ylabel    = next(yl_iter)
-          except StopIteration as ex:
-            while True:
-              non_matched_yhls.append(next(yhl_iter))
-
-          try:
-            yhatlabel    = next(yhl_iter)
-          except StopIteration as ex:
-            while True:
-              non_matched_yls.append(ylabel)
-              ylabel = next(yl_iter)
-
-        if ylabel < yhatlabel:
-          matching_yh = True
-          non_matched_yls.append(ylabel)
-          ylabel = next(yl_iter)
-
-          visited_labels = append_unique(visited_labels, ylabel)
-
-        if ylabel > yhatlabel:
-          matching_y = True
-          non_matched_yhls.append(yhatlabel)
-          yhatlabel = next(yhl_iter)
-
-          visited_labels = append_unique(visited_labels, yhatlabel)
-
-    except StopIteration as ex:
-      # eventually, add all non_matched_yls vs all non_matched_yls to cm[yl][yhl]
-      # to cover the FP and FN
-
-      # just before the exception, we may have been searching for a match
-      # for either y or yh, and we couldn't find a match, so we append it here
-      if matching_y:
-        non_matched_yls.append(ylabel)
-      if matching_yh:
-        non_matched_yhls.append(yhatlabel)
-
-      if len(non_matched_yhls) == len(non_matched_yls) == 0:
-        pass
-      elif len(non_matched_yls) > 0 and len(non_matched_yhls) > 0:
-        for nmyl in non_matched_yls:
-          cm.setdefault(nmyl, {})
-
-          for nmyhl in non_matched_yhls:
-            cm[nmyl].setdefault(nmyhl, 0)
-            cm[nmyl][nmyhl] += 1
-
-      elif support_not_categorized:
-        visited_labels = append_unique(visited_labels, NOT_CAT)
-        for nmyl in non_matched_yls:
-          cm.setdefault(nmyl, {})
-          cm[nmyl].setdefault(NOT_CAT, 0)
-          cm[nmyl][NOT_CAT] += 1
-
-        for nmyhl in non_matched_yhls:
-          cm.setdefault(NOT_CAT, {})
-          cm[NOT_CAT].setdefault(nmyhl, 0)
-          cm[NOT_CAT][nmyhl] += 1
-
-      for nmyl in non_matched_yls:
-        visited_labels = append_unique(visited_labels, nmyl)
-      for nmyhl in non_matched_yhls:
-        visited_labels = append_unique(visited_labels, nmyhl)
-
-  # Add zero cells 
-  for visited_label in visited_labels:
-    cm.setdefault(visited_label, {})
-  for key in cm.keys():
-    for visited_label in visited_labels:
-      cm[key].setdefault(visited_label, 0)
-
-  return cm
+def as_confusion_matrix(cmatrix):
+  return cmatrix if isinstance(cmatrix, ConfusionMatrix) else ConfusionMatrix.from_dict(cmatrix)
 
 def get_mapped_labels(labels, label_map):
   """
@@ -171,55 +317,15 @@ def visualize_cmatrix(cmatrix, label_map=None):
   return out
 
 def get_precisions(cmatrix):
-  labels = cmatrix.keys()
-
-  precisions = {}
-
-  for current in labels:
-
-    tp = cmatrix[current][current]
-    tpfp = 0
-    for label in labels:
-      tpfp += cmatrix[current][label]
-
-    if tpfp == 0:
-      continue
-
-    precisions.setdefault(current, (float(tp)/float(tpfp)))
-
-  return precisions
+  """Diagonal count of each label over its row sum, a dict or ConfusionMatrix is expected"""
+  return as_confusion_matrix(cmatrix).get_precisions()
 
 def get_recalls(cmatrix):
-  labels = cmatrix.keys()
-
-  recalls = {}
-
-  for current in labels:
-
-    tp = cmatrix[current][current]
-    tptn = 0
-    for label in labels:
-      tptn += cmatrix[label][current]
-
-    if tptn == 0:
-      continue
-
-    recalls.setdefault(current, (float(tp)/float(tptn)))
-
-  return recalls
+  """Diagonal count of each label over its column sum"""
+  return as_confusion_matrix(cmatrix).get_recalls()
 
 def get_f1score(cmatrix):
-  count = len(cmatrix.keys())
-
-  precision = sum(get_precisions(cmatrix).values())/count
-  recall = sum(get_recalls(cmatrix).values())/count
-
-  if (precision + recall) == 0:
-    logging.error("The classifier got 0 precision and 0 recall!\
-      The labels could be inverted")
-    return 0
-
-  return (2 * precision * recall) / (precision + recall)
+  return as_confusion_matrix(cmatrix).get_f1score()
 
 def visualize_tps(cmatrix, label_map=None):
   """Visualize true positives"""
@@ -1,3 +1,4 @@
+import tut_py_irtx.tokenizer as tokenizer
 from tut_py_irtx.Term import *
 from tut_py_irtx.Posting import *
 
@@ -29,26 +30,47 @@ class Doc():
 
   @staticmethod
   def preprocess(text):
-    return text.replace("[newline]", " "). \
-        replace("[NEWLINE]", " "). \
-        replace(",", " "). \
-        replace('"', " "). \
-        replace("”", " "). \
-        replace("“", " "). \
-        replace("?", " "). \
-        replace("!", " "). \
-        encode('ascii', 'ignore').decode('ascii')
+    return tokenizer.preprocess(text)
 
   @staticmethod
-  def fetch_terms(doc):
-    """Get a list of terms given a doc"""
+  def check_type(doc):
     if not isinstance(doc, Doc):
       raise TypeError("Unsupported Document type")
 
-    text = doc.text
+  @staticmethod
+  def tokenize(doc, analyzer=None):
+    """Get a list of the normalized token texts given a doc
+
+    Parameters
+    ----------
+    analyzer : Analyzer
+      Analysis chain to run on the tokens, they are only normalized if None
+    """
+    Doc.check_type(doc)
+    if analyzer is not None:
+      return analyzer.analyze(doc.text)
+    return tokenizer.tokenize(doc.text)
+
+  @staticmethod
+  def count_terms(doc, analyzer=None):
+    """Get a mapping of each normalized token text to its count given a doc
+
+    Parameters
+    ----------
+    analyzer : Analyzer
+      Analysis chain to run on the tokens, they are only normalized if None
+    """
+    Doc.check_type(doc)
+    if analyzer is not None:
+      return analyzer.count_terms(doc.text)
+    return tokenizer.count_tokens(doc.text)
 
-    text = Doc.preprocess(text)
+  @staticmethod
+  def fetch_terms(doc):
+    """Get a list of terms given a doc
 
-    tokens = text.split()
-    terms = [Term(elem, [Posting(doc.index)]) for elem in tokens]
-    return terms
+    Kept for compatibility, a Term is allocated for every token
+    including the repeated ones, prefer `Doc.tokenize()` or `Doc.count_terms()`
+    when the Term structure is not needed
+    """
+    return [Term(text, [Posting(doc.index)]) for text in Doc.tokenize(doc)]
@@ -1,11 +1,12 @@
 import logging
+import sys
 
 from tut_py_irtx.Indexer import *
 
 class DocIndexer(Indexer):
 
-  def __init__(self, docs=None, docs_hash="", build_time=""):
-    super().__init__(docs, docs_hash, build_time)
+  def __init__(self, docs=None, docs_hash="", build_time="", analyzer=None, store=None):
+    super().__init__(docs, docs_hash, build_time, analyzer, store)
 
   def build(self, force=False):
     """a doc dictionary to capture the dictionary given a document index"""
@@ -20,3 +21,16 @@ class DocIndexer(Indexer):
 
     return self.index
 
+  def get_memory_report(self, top=10):
+    """Estimate the memory of the docs and their texts, the largest docs
+    are the ones of the longest texts"""
+    report = super().get_memory_report(top)
+    docs = self.index.values()
+
+    report.add("docs", sum(get_object_size(doc) + sys.getsizeof(doc.labels) + sys.getsizeof(doc.predicted_labels) for doc in docs))
+    report.add("texts", sum(sys.getsizeof(doc.text) for doc in docs))
+
+    largest = MemoryReport.get_largest(docs, top, key=lambda doc: len(doc.text))
+    report.largest = [(doc.index, len(doc.text), sys.getsizeof(doc.text)) for doc in largest]
+    return report
+
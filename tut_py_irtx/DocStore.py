@@ -0,0 +1,236 @@
+import sys
+
+import numpy as np
+
+from tut_py_irtx.Doc import *
+from tut_py_irtx.Analyzer import *
+from tut_py_irtx.SparseMatrix import *
+from tut_py_irtx.Metrics import *
+from tut_py_irtx.MemoryReport import *
+
+TERM_ID_DTYPE = np.int32
+COUNT_DTYPE = np.int32
+
+class AnalyzedDoc():
+  """The analyzed form of a doc, its distinct term ids and their counts
+
+  Attributes
+  ----------
+  doc : Doc
+    The analyzed doc
+  term_ids : numpy.ndarray
+    Ids of the distinct terms of the doc, in order of their first appearance
+  counts : numpy.ndarray
+    Count of each term of term_ids in the doc
+  """
+  __slots__ = ("doc", "term_ids", "counts")
+
+  def __init__(self, doc, term_ids, counts):
+    self.doc = doc
+    self.term_ids = term_ids
+    self.counts = counts
+
+  def __len__(self):
+    return len(self.term_ids)
+
+class DocStore():
+  """Tokenize-once store of the analyzed docs
+
+  Each doc is analyzed once when ingested, then every indexer and learner
+  reads its term ids and counts from the store, instead of tokenizing it again.
+
+  The term ids refer to the store vocabulary, which grows with every
+  newly analyzed term.
+
+  Docs are stored by their index, in case of a conflicting index
+  (a different Doc with the same index), the newer doc replaces the stored
+  one, unless it is analyzed without growing the store.
+  """
+
+  def __init__(self, analyzer=None):
+    """
+
+    Attributes
+    ----------
+    analyzer : Analyzer
+      Analysis chain of the docs
+    vocabulary : dict
+      term text -> term id
+    terms : list of str
+      term id -> term text
+    entries : dict
+      doc index -> AnalyzedDoc
+    analyzed_count : int
+      Count of the analysis runs, useful to check a doc is analyzed once
+    """
+    self.analyzer = DEFAULT_ANALYZER if analyzer is None else analyzer
+    self.clear()
+
+  def clear(self):
+    self.vocabulary = {}
+    self.terms = []
+    self.entries = {}
+    self.analyzed_count = 0
+
+  def set_analyzer(self, analyzer):
+    """Set the analyzer, dropping the analyzed docs if it got changed"""
+    if analyzer is not self.analyzer:
+      self.analyzer = analyzer
+      self.clear()
+
+  def __len__(self):
+    return len(self.entries)
+
+  def add_docs(self, docs):
+    for doc in docs:
+      self.get(doc)
+
+  def set_docs(self, docs):
+    """Store the given docs in place of the stored ones
+
+    The entries of the docs that are not given are evicted, the entries of
+    the given docs are kept, unless their Doc got replaced by a new one.
+    The vocabulary is kept, as the kept entries refer to its term ids.
+    """
+    indices = {doc.index for doc in docs}
+    for index in [index for index in self.entries if index not in indices]:
+      del self.entries[index]
+    self.add_docs(docs)
+
+  def remove_doc(self, doc):
+    """Drop the stored analysis of the doc, for example after its text changed"""
+    entry = self.entries.get(doc.index)
+    if entry is not None and entry.doc is doc:
+      del self.entries[doc.index]
+
+  def analyze(self, doc, grow=True):
+    """Analyze the doc without storing it
+
+    Parameters
+    ----------
+    grow : bool
+      Add the unseen terms to the vocabulary, otherwise they are dropped
+
+    Returns
+    -------
+    AnalyzedDoc
+    """
+    Doc.check_type(doc)
+    self.analyzed_count += 1
+
+    with METRICS.timer(STAGE_TOKENIZE):
+      term_counts = self.analyzer.count_terms(doc.text)
+    METRICS.increment("docs_analyzed")
+
+    vocabulary = self.vocabulary
+    term_ids = []
+    counts = []
+    for text, count in term_counts.items():
+      term_id = vocabulary.get(text)
+      if term_id is None:
+        if not grow:
+          continue
+        term_id = len(self.terms)
+        vocabulary[text] = term_id
+        self.terms.append(text)
+
+      term_ids.append(term_id)
+      counts.append(count)
+
+    return AnalyzedDoc(doc, np.array(term_ids, dtype=TERM_ID_DTYPE), np.array(counts, dtype=COUNT_DTYPE))
+
+  def get(self, doc, grow=True):
+    """Get the analyzed doc, analyzing and storing it if not yet stored
+
+    Parameters
+    ----------
+    grow : bool
+      If False, the vocabulary is left untouched and an unstored doc
+      is not stored, useful for predicting over unseen docs
+
+    Returns
+    -------
+    AnalyzedDoc
+    """
+    entry = self.entries.get(doc.index)
+    if entry is not None and entry.doc is doc:
+      return entry
+
+    entry = self.analyze(doc, grow)
+    if grow:
+      # replaces the entry of a previous doc with the same index, if any
+      self.entries[doc.index] = entry
+    return entry
+
+  def get_memory_report(self, top=10):
+    """Estimate the memory of the vocabulary and the analyzed docs,
+    the largest docs are the ones of the most distinct terms"""
+    report = MemoryReport(type(self).__name__, len(self.entries))
+    report.add("vocabulary", get_dict_size(self.vocabulary) + sys.getsizeof(self.terms))
+    report.add("entries", sys.getsizeof(self.entries))
+
+    entries = self.entries.values()
+    entry_sizes = {index: sys.getsizeof(entry) + sys.getsizeof(entry.term_ids) + sys.getsizeof(entry.counts)
+                   for index, entry in self.entries.items()}
+    report.add("analyzed", sum(entry_sizes.values()))
+
+    largest = MemoryReport.get_largest(entries, top, key=len)
+    report.largest = [(entry.doc.index, len(entry), entry_sizes[entry.doc.index]) for entry in largest]
+    return report
+
+  def get_term_counts(self, doc):
+    """Get a mapping of each term text of the doc to its count
+
+    Returns
+    -------
+    dict
+      text -> count, ordered by the first appearance of each text
+    """
+    entry = self.get(doc)
+    terms = self.terms
+    return {terms[term_id]: count for term_id, count in zip(entry.term_ids.tolist(), entry.counts.tolist())}
+
+  def get_dense_vector(self, doc, dimensions=None):
+    """Get the term counts of the doc as a dense vector indexed by the term ids
+
+    Parameters
+    ----------
+    dimensions : int
+      Size of the vector, defaults to the vocabulary size
+
+    Returns
+    -------
+    list of int
+    """
+    entry = self.get(doc)
+    dimensions = len(self.terms) if dimensions is None else dimensions
+
+    values = [0] * dimensions
+    for term_id, count in zip(entry.term_ids.tolist(), entry.counts.tolist()):
+      if term_id < dimensions:
+        values[term_id] = count
+    return values
+
+  def get_matrix(self, docs, dimensions=None, grow=True):
+    """Get the term counts of the docs as a sparse matrix, a row per doc
+
+    Parameters
+    ----------
+    dimensions : int
+      Count of the columns, defaults to the vocabulary size,
+      terms with a greater id are dropped
+    grow : bool
+      Store the docs and grow the vocabulary, check get()
+
+    Returns
+    -------
+    SparseMatrix
+    """
+    entries = [self.get(doc, grow) for doc in docs]
+    dimensions = len(self.terms) if dimensions is None else dimensions
+
+    rows = []
+    for entry in entries:
+      kept = entry.term_ids < dimensions
+      rows.append((entry.term_ids[kept], entry.counts[kept]))
+    return SparseMatrix.from_rows(rows, dimensions)
@@ -0,0 +1,86 @@
+import zlib
+
+import numpy as np
+
+from tut_py_irtx.Analyzer import *
+from tut_py_irtx.SparseMatrix import *
+
+DEFAULT_WIDTH = 2 ** 18
+
+class FeatureHasher():
+  """Map the terms into a fixed count of columns by hashing their texts
+
+  Known as the hashing trick, the feature space stays bounded whatever the
+  vocabulary size, at the cost of the colliding terms sharing a column.
+  crc32 is used since it is stable across processes and runs, unlike hash().
+
+  The signed hashing multiplies the count of each term by a +1/-1 sign,
+  taken from the highest bit of its hash, the column being its remainder,
+  thus the collisions cancel out in expectation instead of adding up.
+  """
+  def __init__(self, width=DEFAULT_WIDTH, signed=False):
+    """
+
+    Parameters
+    ----------
+    width : int
+      Count of the columns of the feature space
+    signed : bool
+      Hash each term into a signed count
+    """
+    if width <= 0:
+      raise ValueError(f"The hashing width should be positive, got {width}")
+    self.width = width
+    self.signed = signed
+
+  def __str__(self):
+    signed = "signed " if self.signed else ""
+    return f"{signed}feature hasher of {self.width} columns"
+
+  def hash_text(self, text):
+    return zlib.crc32(text.encode("utf-8")) % self.width
+
+  def hash_signed_text(self, text):
+    """Get the (column, sign) of the text, the sign is always 1 if not signed"""
+    hashed = zlib.crc32(text.encode("utf-8"))
+    sign = -1 if self.signed and hashed >> 31 else 1
+    return hashed % self.width, sign
+
+  def get_row(self, term_counts):
+    """Hash the term counts of a doc
+
+    Parameters
+    ----------
+    term_counts : dict
+      text -> count
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+      (columns, values), a column could repeat for colliding terms
+    """
+    hashed = [self.hash_signed_text(text) for text in term_counts]
+    columns = np.array([column for column, _ in hashed], dtype=np.int64)
+    values = np.array([sign for _, sign in hashed], dtype=float) * np.fromiter(term_counts.values(), dtype=float, count=len(term_counts))
+    return columns, values
+
+  def transform(self, docs, analyzer=None):
+    """Hash the term counts of the docs without any vocabulary, a row per doc
+
+    Nothing is kept per term or per doc, thus the memory stays bounded
+    over an open-vocabulary stream of docs, for example a batch of tweets
+    fed to MiniBatchKMeansCluster.partial_fit().
+
+    Parameters
+    ----------
+    analyzer : Analyzer
+      Analysis chain of the docs, defaults to the DEFAULT_ANALYZER
+
+    Returns
+    -------
+    SparseMatrix
+      of width columns
+    """
+    analyzer = DEFAULT_ANALYZER if analyzer is None else analyzer
+    rows = [self.get_row(analyzer.count_terms(doc.text)) for doc in docs]
+    return SparseMatrix.from_rows(rows, self.width).sum_duplicates()
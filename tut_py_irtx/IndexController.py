@@ -1,59 +1,51 @@
 import logging
+import threading
+import time
 
 from tut_py_irtx.errors import *
 from tut_py_irtx.util import *
 from tut_py_irtx.Doc import *
+from tut_py_irtx.Analyzer import *
+from tut_py_irtx.DocStore import *
+from tut_py_irtx.Metrics import *
+from tut_py_irtx.QueryExplanation import *
 import tut_py_irtx.Term
 from tut_py_irtx.InvertedIndexer import *
 from tut_py_irtx.DocIndexer import *
 from tut_py_irtx.KGramIndexer import *
-
-def get_joint(list1, list2):
-  """Return the join of 2 lists"""
-  list1.extend(list2)
-  return list(set(list1))
-
-def get_joint_multi(lists):
-  if len(lists) < 1:
-    return []
-  else:
-    joint = []
-    curr_list = lists[0]
-    for curr_l in lists[1:]:
-      joint = get_joint(curr_l, joint)
-
-  return joint
-
-def get_intersection_of_sorted(list1, list2):
-  """Return the intersection of 2 lists"""
-  # surprisingly, that doesn't save time
-  # if list1[0] > list2[-1] or list2[0] > list1[-1]:
-  #   return []
-
-  iter1 = iter(list1)
-  iter2 = iter(list2)
-
-  intersection = []
-  try:
-    i = next(iter1)
-    j = next(iter2)
-    while True:
-      if i == j:
-        intersection.append(i)
-        i = next(iter1)
-        j = next(iter2)
-      if i < j:
-        i = next(iter1)
-      if i > j:
-        j = next(iter2)
-  except StopIteration as ex:
-    pass
-
-  return intersection
+from tut_py_irtx.IndexSnapshot import *
 
 class IndexController():
 
-  def __init__(self, docs=None):
+  def __init__(self, docs=None, analyzer=None):
+    """
+
+    Parameters
+    ----------
+    docs : list of Doc
+      Documents to index
+    analyzer : Analyzer
+      Analysis chain shared by all the indexers and the query path,
+      the DEFAULT_ANALYZER only normalizes the tokens
+
+    Attributes
+    ----------
+    store : DocStore
+      Store of the analyzed docs, filled once when the docs are set,
+      then read by all the indexers
+    snapshot : IndexSnapshot
+      Read-only view of the indexes published by the last build, queried by
+      the readers while the indexes get rebuilt, None until the first build
+    version : int
+      Version of the last published snapshot
+    """
+    self.analyzer = DEFAULT_ANALYZER if analyzer is None else analyzer
+    self.store = DocStore(self.analyzer)
+
+    self.snapshot = None
+    self.version = 0
+    # serializes the builds, the readers only read the snapshot reference
+    self.lock = threading.RLock()
 
     self.indexers = []
     self.add_indexer(InvertedIndexer())
@@ -69,6 +61,7 @@ class IndexController():
     self.is_doc_index_built = False
 
   def add_indexer(self, indexer):
+    indexer.set_store(self.store)
     self.indexers.append(indexer)
 
   def set_docs(self, docs):
@@ -82,6 +75,9 @@ class IndexController():
     else:
       raise TypeError("Unsupported Document type")
 
+    # tokenize each doc once, the indexers read the analyzed docs from the store
+    self.store.set_docs(self.doc_list)
+
     for indexer in self.indexers:
       # TODO: ensure not updating here follows the least astonishment principle
       # indexer.doc_list = self.doc_list
@@ -109,14 +105,71 @@ class IndexController():
     return self.inv_indexer().index
 
   def set_inv_index(self, index):
-    self.inv_indexer().index = index
+    with self.lock:
+      self.inv_indexer().index = index
+      self.publish()
 
   def build(self, force=False):
+    """Build the invalidated indexers, all of them if forced,
+    then publish a snapshot of the indexes if any got rebuilt
+
+    Setting the docs invalidates all the indexers, until then building
+    is a no-op, thus it is cheap to call before each query.
+    """
+    with self.lock:
+      rebuilt = False
+      for indexer in self.indexers:
+        if force or not indexer.is_index_built:
+          # doc_list is saved twice, can we fix that?
+          # if so, we need to cleanup
+          indexer.set_docs(self.doc_list)
+          indexer.build(force)
+          rebuilt = True
+
+      if rebuilt or self.snapshot is None:
+        self.publish()
+
+  def publish(self):
+    """Publish a snapshot of the current indexes, replacing the previous one
+
+    The snapshot is swapped in by a single reference assignment, thus a
+    reader gets either the previous snapshot or the new one, never a mix.
+
+    Returns
+    -------
+    IndexSnapshot
+    """
+    with self.lock:
+      try:
+        kgram_index = self.kgram_indexer().index
+      except IndexNotFoundError:
+        kgram_index = None
+
+      snapshot = IndexSnapshot(self.analyzer, self.get_inv_index(), self.doc_indexer().index, kgram_index, self.version + 1)
+      self.version = snapshot.version
+      self.snapshot = snapshot
+    return snapshot
+
+  def get_snapshot(self):
+    """Return the published snapshot, the indexes get built first if none is"""
+    snapshot = self.snapshot
+    if snapshot is None:
+      self.build()
+      snapshot = self.snapshot
+    return snapshot
+
+  def get_memory_report(self, top=10):
+    """Estimate the memory of the store and of each indexer
+
+    Returns
+    -------
+    dict
+      name -> MemoryReport, the store and the indexers by their class name
+    """
+    reports = {"DocStore": self.store.get_memory_report(top)}
     for indexer in self.indexers:
-      # doc_list is saved twice, can we fix that?
-      # if so, we need to cleanup
-      indexer.set_docs(self.doc_list)
-      indexer.build(force)
+      reports[type(indexer).__name__] = indexer.get_memory_report(top)
+    return reports
 
   def get_doc_index_slice(self, n = 10):
     """Unpack and return n doc indexers"""
@@ -140,176 +193,63 @@ class IndexController():
         matched.append(doc)
     return matched
 
-  def get_query_frequencies(queries):
-    """ fetch the tfs and idfs of the terms in the queries"""
-    queryDoc = Doc(text=" ".join(queries))
-    terms = Doc.fetch_terms(queryDoc)
-    unique_terms = set(terms)
-
-    uterm_counts = []
-    qtfs = []
-    qidfs = []
-
-    # This loop is only necessary when (len(set(terms)) != len(terms))
-    # however, it's not necessary to treat that specially,
-    # query terms won't exceed a hundred anyway
-    for i, uterm in enumerate(unique_terms):
-      uterm_counts.append(0)
+  # kept for compatibility, the frequencies are computed by the snapshots
+  get_query_frequencies = staticmethod(IndexSnapshot.get_query_frequencies)
+  get_doc_frequencies = staticmethod(IndexSnapshot.get_doc_frequencies)
 
-      for term in terms:
-        term == uterm
-        uterm_counts[i] = uterm_counts[i] + 1
+  def query_intersection_core(self, text_list, support_wildcards_kgram=True, support_ranking=False, explanation=None):
+    """Core query function, over the published snapshot, check IndexSnapshot.query_core()"""
+    return self.get_snapshot().query_core(text_list, support_wildcards_kgram, support_ranking, explanation)
 
-      qtfs.append(tfidf.calc_tf(uterm_counts[i]))
-
-    # a query is a single document thus the idf is just 1, normalized to the multiplier
-    qidfs.extend([1 *tfidf.IDF_MULTIPLIER] * len(unique_terms))
+  def query_intersection_wildcards(self, text):
+    return self.query_intersection(text, True)
 
-    return qtfs, qidfs
+  def query(self, text, wildcard=False, ranked=False, explain=False):
+    """Query the published snapshot, safe to call from several threads
 
-  def get_doc_frequencies(index, posting, queries):
-    """ fetch the tfs and idfs of the terms in the index, that match the given queries
+    The docs set since the last build() are not queried until it gets called,
+    check IndexSnapshot.query() for the parameters.
 
-    notes:
-    - docs could be extracted from the index + queries, but it's kept separate until
-      it's decided how bad is it to refetch the docs
-    - keep unique_terms extraction in sync with get_query_frequencies,
-      until it's decided whether it's better to separate the logics
-      or to combine them
+    Returns
+    -------
+    QueryResult
+      The matching docs along with their ranks
     """
-    queryDoc = Doc(text=" ".join(queries))
-    terms = Doc.fetch_terms(queryDoc)
-    unique_terms = set(terms)
-
-    dtfs = []
-    didfs = []
-
-    for uterm in unique_terms:
-      occ, _ = index[uterm.text].occurances.has(Node(posting))
-      if occ is not None:
-        logging.debug(f"[DOCMATCH][TERM:{uterm.text:8}] mentioned [{occ.data.count:2} times] in [DOC:{posting}]")
-        dtfs.append(occ.data.tf)
-      else:
-        dtfs.append(0)
-
-      didfs.append(index[uterm.text].idf)
+    return self.get_snapshot().query(text, wildcard, ranked, explain)
 
-    return dtfs, didfs
+  def query_intersection(self, text, wildcard=False, ranked=False, explain=False):
+    """Query the intersection of documents in the indexers
+       that the given text appeared at, with wildcard support
 
-  def query_intersection_core(self, text_list, support_wildcards_kgram=True, support_ranking=False):
-    """Core query function
+    The indexes get built first if the docs got updated, the ranks are
+    set on the returned docs, which are shared by all the queries,
+    thus the concurrent readers should use query() instead.
 
     Parameters
     ----------
-    text_list : list of str
-      Text to query
-    support_wildcards_kgram : bool
-      Whether to support wildcard expansion using kgrams or not
+    explain : bool
+      Profile the query, per term and per stage
 
     Returns
     -------
-    list
-      Docs corresponding to the given query text_list
+    list of Doc
+      The matching docs, along with a QueryExplanation if explain is set
     """
-    log = logging.getLogger("query")
-    # logging.getLogger( "query" ).setLevel( logging.DEBUG )
-    ii = self.inv_indexer()
-
-    out_docs_intersect = []
-    out_docs_join      = []
-
-    for i, text in enumerate(text_list):
-      text_docs = []
-
-      if (support_wildcards_kgram and "*" in text):
-        # kgram index is used only if support_wildcard_kgrams is used
-        kgram_index = self.kgram_indexer().index
-        wc_exp_list = KGramIndexer.expand_wildcard_to_list(text, kgram_index)
-        for wc_exp in wc_exp_list:
-          term = ii.get_corresponding_term(util.normalize(wc_exp))
-          if term is not None:
-            # posting_ids = [posting.doc_id for posting in term.occurances]
-            # we don't use term.occurances directly for text_docs,
-            # as the occurances(Posting type) is not hashable, which should be the case
-            text_docs = get_joint(text_docs, term.get_first_n_occurances(-1))
-
-      else:
-        term = ii.get_corresponding_term(util.normalize(text))
-        if term is not None:
-          text_docs = term.get_first_n_occurances(-1)
-
-      # enable for extensive debugging only
-      # log.debug(f"[{text}] found in the docs: {text_docs}")
-
-      if i == 0:
-        out_docs_intersect = text_docs
-        out_docs_join      = text_docs
-      else:
-        out_docs_intersect = get_intersection_of_sorted(sorted(out_docs_intersect), sorted(text_docs))
-        out_docs_join      = get_joint(out_docs_join, text_docs)
-
-      log.info(f"[DOC-INTERSECTION][TERM:{text}]: {[d.doc_id for d in out_docs_intersect]}")
-
-    ranks = []
-    if support_ranking:
-      qtfs, qidfs = IndexController.get_query_frequencies(text_list)
-
-      log.debug(f"[SIMILARITY] [QUERY: {text_list}]")
-      log.debug(f"[SIMILARITY]   [QTFS]:  {[round(v) for v in qtfs]}\t" + \
-                             f"[QIDFS]: {[round(v) for v in qidfs]}")
-
-      if sum(qidfs) == 0:
-        log.warning("Given query is very common in our dictionary, \
-                     that all the words are included in all the docs")
-
-      for doc in set(out_docs_join):
-        dtfs, didfs = IndexController.get_doc_frequencies(self.inv_indexer().index, doc, text_list)
-        rank, err = tfidf.get_query_similarity(qtfs, qidfs, dtfs, didfs)
-        ranks.append(rank)
-
-        if err != None:
-          log.debug(err)
-
-        log.debug(f"[SIMILARITY]   [DTFS]:  {[round(v) for v in dtfs]}\t" + \
-                                     f"[DIDFS]: {[round(v) for v in didfs]}\t" + \
-                                     f"[VALUE: {round(rank*100)}%] [DOC: {doc.doc_id}]")
-
-      return out_docs_join, ranks
-
-    # else
-    return out_docs_intersect, ranks
-
-  def query_intersection_wildcards(self, text):
-    return self.query_intersection(text, True)
-
-  def query_intersection(self, text, wildcard=False, ranked=False):
-    """Query the intersection of documents in the indexers
-       that the given text appeared at, with wildcard support"""
-    if isinstance(text, str):
-      text_list = [text]
-    elif isinstance(text, list):
-      text_list = text
-    else:
-      raise TypeError("Unexpected query type")
-
+    start = time.perf_counter() if explain else 0.0
     self.build()
+    build_seconds = time.perf_counter() - start if explain else 0.0
 
-    postings, ranks = self.query_intersection_core(text_list, support_wildcards_kgram=wildcard, support_ranking=ranked)
-
-    doc_index = self.doc_indexer().index
+    result = self.snapshot.query(text, wildcard, ranked, explain)
 
     if ranked:
       # set doc ranks
-      docs = []
-      for i, posting in enumerate(postings):
-        doc = doc_index[posting.doc_id]
-        doc.rank = ranks[i]
-        docs.append(doc)
-
-      docs.sort(key=lambda x:x.rank, reverse=True)
-
-    else:
-      docs = [doc_index[posting.doc_id] for posting in postings]
+      for doc, rank in zip(result.docs, result.ranks):
+        doc.rank = rank
 
-    return  docs
+    docs = list(result.docs)
+    if explain:
+      result.explanation.add_seconds("build", build_seconds)
+      result.explanation.total_seconds += build_seconds
+      return docs, result.explanation
 
+    return docs
@@ -0,0 +1,363 @@
+import logging
+import time
+from types import MappingProxyType
+
+import tut_py_irtx.tfidf as tfidf
+from tut_py_irtx.errors import *
+from tut_py_irtx.Analyzer import *
+from tut_py_irtx.LinkedList import *
+from tut_py_irtx.Metrics import *
+from tut_py_irtx.QueryExplanation import *
+from tut_py_irtx.KGramIndexer import *
+
+def get_joint(list1, list2):
+  """Return the join of 2 lists"""
+  list1.extend(list2)
+  return list(set(list1))
+
+def get_joint_multi(lists):
+  if len(lists) < 1:
+    return []
+  else:
+    joint = []
+    curr_list = lists[0]
+    for curr_l in lists[1:]:
+      joint = get_joint(curr_l, joint)
+
+  return joint
+
+def get_intersection_of_sorted(list1, list2):
+  """Return the intersection of 2 lists"""
+  # surprisingly, that doesn't save time
+  # if list1[0] > list2[-1] or list2[0] > list1[-1]:
+  #   return []
+
+  iter1 = iter(list1)
+  iter2 = iter(list2)
+
+  intersection = []
+  try:
+    i = next(iter1)
+    j = next(iter2)
+    while True:
+      if i == j:
+        intersection.append(i)
+        i = next(iter1)
+        j = next(iter2)
+      if i < j:
+        i = next(iter1)
+      if i > j:
+        j = next(iter2)
+  except StopIteration as ex:
+    pass
+
+  return intersection
+
+class QueryResult():
+  """Docs matching a query, owned by the query that produced them
+
+  The ranks are kept along with the docs, instead of being set on the
+  shared Doc objects, thus concurrent queries do not overwrite each other.
+
+  Attributes
+  ----------
+  docs : tuple of Doc
+    The matching docs, in descending order of rank if ranked
+  ranks : tuple of float
+    The rank of each doc, None if the query is not ranked
+  explanation : QueryExplanation
+    Profile of the query, None unless explained
+  version : int
+    Version of the snapshot that got queried
+  """
+  __slots__ = ("docs", "ranks", "explanation", "version")
+
+  def __init__(self, docs, ranks=None, explanation=None, version=0):
+    self.docs = tuple(docs)
+    self.ranks = None if ranks is None else tuple(ranks)
+    self.explanation = explanation
+    self.version = version
+
+  def __len__(self):
+    return len(self.docs)
+
+  def __iter__(self):
+    return iter(self.docs)
+
+  def __getitem__(self, i):
+    return self.docs[i]
+
+  def get_hits(self):
+    """(doc, rank) of each doc, the rank is None if the query is not ranked"""
+    ranks = self.ranks if self.ranks is not None else [None] * len(self.docs)
+    return list(zip(self.docs, ranks))
+
+class IndexSnapshot():
+  """Read-only view of the indexes of a controller, as they were when published
+
+  A snapshot is never updated, the controller publishes a new one
+  after each build, that replaces the previous one in a single reference
+  swap, thus any count of threads may query a snapshot while the indexes
+  get rebuilt. A rebuild creates new index dicts along with their terms and
+  grams, the published ones are only read.
+
+  The queries do not write to the indexes nor to the docs, only the
+  analyzer cache and its hit counters are shared, the counters may thus
+  lose increments while queried from several threads.
+
+  Attributes
+  ----------
+  analyzer : Analyzer
+    Analysis chain of the query texts, the one of the indexes
+  inv_index : mappingproxy
+    text -> Term
+  doc_index : mappingproxy
+    doc index -> Doc
+  kgram_index : mappingproxy
+    gram text -> Gram, None if the controller has no kgram indexer,
+    in which case the wildcards are not supported
+  version : int
+    Incremented by the controller on each publish
+  """
+
+  def __init__(self, analyzer, inv_index, doc_index, kgram_index=None, version=0):
+    self.analyzer = analyzer
+    # the dicts are copied, as the controller may still merge into its own
+    self.inv_index = MappingProxyType(dict(inv_index))
+    self.doc_index = MappingProxyType(dict(doc_index))
+    self.kgram_index = None if kgram_index is None else MappingProxyType(dict(kgram_index))
+    self.version = version
+
+  def get_term(self, text):
+    return self.inv_index.get(text)
+
+  def expand_wildcard(self, wildcard):
+    """Expand an analyzed wildcard into the indexed texts it matches"""
+    if self.kgram_index is None:
+      raise IndexNotFoundError(KGramIndexer)
+    return KGramIndexer.expand_wildcard_to_list(wildcard, self.kgram_index)
+
+  @staticmethod
+  def get_query_frequencies(queries, analyzer=DEFAULT_ANALYZER):
+    """ fetch the tfs and idfs of the terms in the queries"""
+    term_counts = analyzer.count_terms(" ".join(queries))
+
+    qtfs = [tfidf.calc_tf(count) for count in term_counts.values()]
+
+    # a query is a single document thus the idf is just 1, normalized to the multiplier
+    qidfs = [1 *tfidf.IDF_MULTIPLIER] * len(term_counts)
+
+    return qtfs, qidfs
+
+  @staticmethod
+  def get_doc_frequencies(index, posting, queries, analyzer=DEFAULT_ANALYZER):
+    """ fetch the tfs and idfs of the terms in the index, that match the given queries
+
+    notes:
+    - docs could be extracted from the index + queries, but it's kept separate until
+      it's decided how bad is it to refetch the docs
+    - keep unique_terms extraction in sync with get_query_frequencies,
+      until it's decided whether it's better to separate the logics
+      or to combine them
+    """
+    unique_terms = analyzer.count_terms(" ".join(queries))
+
+    dtfs = []
+    didfs = []
+
+    for text in unique_terms:
+      term = index.get(text)
+      if term is None:
+        # e.g. an unexpanded wildcard, or a text that is not indexed
+        dtfs.append(0)
+        didfs.append(0)
+        continue
+
+      occ, _ = term.occurances.has(Node(posting))
+      if occ is not None:
+        logging.debug(f"[DOCMATCH][TERM:{text:8}] mentioned [{occ.data.count:2} times] in [DOC:{posting}]")
+        dtfs.append(occ.data.tf)
+      else:
+        dtfs.append(0)
+
+      didfs.append(term.idf)
+
+    return dtfs, didfs
+
+  def query_core(self, text_list, support_wildcards_kgram=True, support_ranking=False, explanation=None):
+    """Core query function
+
+    Parameters
+    ----------
+    text_list : list of str
+      Text to query
+    support_wildcards_kgram : bool
+      Whether to support wildcard expansion using kgrams or not
+    explanation : QueryExplanation
+      Filled with the profile of each term and stage, if given
+
+    Returns
+    -------
+    list of Posting
+      Postings of the docs matching all the texts, or any of them if ranked
+    list of float
+      Rank of each posting, empty unless ranked
+    """
+    log = logging.getLogger("query")
+    # logging.getLogger( "query" ).setLevel( logging.DEBUG )
+    analyzer = self.analyzer
+
+    out_docs_intersect = []
+    out_docs_join      = []
+
+    METRICS.increment("queries")
+    clock = StageClock(explanation)
+    is_first = True
+    for text in text_list:
+      text_docs = []
+
+      explained = None
+      if explanation is not None:
+        explained = explanation.add_term(text)
+        cache_hits = analyzer.cache_hits
+
+      analyzed = analyzer.analyze_query(text)
+      clock.lap("analyze", explained)
+      if explained is not None:
+        explained.analyzed = analyzed
+        if analyzed is not None and "*" not in analyzed:
+          explained.cache_hit = analyzer.cache_hits > cache_hits
+
+      if analyzed is None:
+        # dropped by the analyzer, for example a stopword
+        log.info(f"[DOC-INTERSECTION][TERM:{text}]: ignored by the analyzer")
+        continue
+
+      if (support_wildcards_kgram and "*" in analyzed):
+        # kgram index is used only if support_wildcard_kgrams is used
+        with METRICS.timer(STAGE_EXPAND):
+          wc_exp_list = self.expand_wildcard(analyzed)
+        METRICS.increment("wildcard_expansions", len(wc_exp_list))
+        clock.lap("expand", explained)
+        if explained is not None:
+          explained.expansions = list(wc_exp_list)
+        for wc_exp in wc_exp_list:
+          # expansions are already analyzed, as they are fetched from the kgram index
+          term = self.get_term(wc_exp)
+          if term is not None:
+            # posting_ids = [posting.doc_id for posting in term.occurances]
+            # we don't use term.occurances directly for text_docs,
+            # as the occurances(Posting type) is not hashable, which should be the case
+            text_docs = get_joint(text_docs, term.get_first_n_occurances(-1))
+
+      else:
+        term = self.get_term(analyzed)
+        if term is not None:
+          text_docs = term.get_first_n_occurances(-1)
+      clock.lap("lookup", explained)
+
+      # enable for extensive debugging only
+      # log.debug(f"[{text}] found in the docs: {text_docs}")
+
+      if is_first:
+        is_first = False
+        out_docs_intersect = text_docs
+        out_docs_join      = text_docs
+      else:
+        with METRICS.timer(STAGE_INTERSECT):
+          out_docs_intersect = get_intersection_of_sorted(sorted(out_docs_intersect), sorted(text_docs))
+          out_docs_join      = get_joint(out_docs_join, text_docs)
+
+      if explained is not None:
+        clock.lap("intersect", explained)
+        explained.postings = len(text_docs)
+        explained.intersection = len(out_docs_intersect)
+        explained.union = len(out_docs_join)
+
+      if log.isEnabledFor(logging.INFO):
+        log.info(f"[DOC-INTERSECTION][TERM:{text}]: {[d.doc_id for d in out_docs_intersect]}")
+
+    ranks = []
+    if support_ranking:
+      qtfs, qidfs = IndexSnapshot.get_query_frequencies(text_list, analyzer)
+
+      log.debug(f"[SIMILARITY] [QUERY: {text_list}]")
+      log.debug(f"[SIMILARITY]   [QTFS]:  {[round(v) for v in qtfs]}\t" + \
+                             f"[QIDFS]: {[round(v) for v in qidfs]}")
+
+      if sum(qidfs) == 0:
+        log.warning("Given query is very common in our dictionary, \
+                     that all the words are included in all the docs")
+
+      # ranked in the order of the returned postings, each posting once
+      postings = list(dict.fromkeys(out_docs_join))
+      is_debug = log.isEnabledFor(logging.DEBUG)
+      with METRICS.timer(STAGE_SCORE):
+        for doc in postings:
+          dtfs, didfs = IndexSnapshot.get_doc_frequencies(self.inv_index, doc, text_list, analyzer)
+          rank, err = tfidf.get_query_similarity(qtfs, qidfs, dtfs, didfs)
+          ranks.append(rank)
+
+          if err != None:
+            log.debug(err)
+
+          if is_debug:
+            log.debug(f"[SIMILARITY]   [DTFS]:  {[round(v) for v in dtfs]}\t" + \
+                                         f"[DIDFS]: {[round(v) for v in didfs]}\t" + \
+                                         f"[VALUE: {round(rank*100)}%] [DOC: {doc.doc_id}]")
+      METRICS.increment("docs_scored", len(ranks))
+      clock.lap("score")
+      if explanation is not None:
+        explanation.docs_scored = len(ranks)
+
+      return postings, ranks
+
+    # else
+    return out_docs_intersect, ranks
+
+  def query(self, text, wildcard=False, ranked=False, explain=False):
+    """Query the intersection of documents that the given text appeared at,
+       or their union in descending order of rank if ranked
+
+    Parameters
+    ----------
+    text : str or list of str
+      Text to query
+    wildcard : bool
+      Expand the wildcards through the kgram index
+    ranked : bool
+      Rank the docs matching any of the texts by their similarity to the query
+    explain : bool
+      Profile the query, per term and per stage
+
+    Returns
+    -------
+    QueryResult
+    """
+    if isinstance(text, str):
+      text_list = [text]
+    elif isinstance(text, list):
+      text_list = text
+    else:
+      raise TypeError("Unexpected query type")
+
+    explanation = QueryExplanation(text_list, wildcard, ranked) if explain else None
+    start = time.perf_counter() if explain else 0.0
+
+    postings, ranks = self.query_core(text_list, support_wildcards_kgram=wildcard, support_ranking=ranked,
+                                      explanation=explanation)
+
+    doc_index = self.doc_index
+    docs = [doc_index[posting.doc_id] for posting in postings]
+    if ranked:
+      hits = sorted(zip(docs, ranks), key=lambda hit: hit[1], reverse=True)
+      docs = [doc for doc, _ in hits]
+      ranks = [rank for _, rank in hits]
+    else:
+      ranks = None
+
+    if explain:
+      explanation.results = len(docs)
+      explanation.total_seconds = time.perf_counter() - start
+
+    return QueryResult(docs, ranks, explanation, self.version)
@@ -1,9 +1,12 @@
 from tut_py_irtx.util import *
 from tut_py_irtx.Doc import *
+from tut_py_irtx.Analyzer import *
+from tut_py_irtx.DocStore import *
+from tut_py_irtx.MemoryReport import *
 
 class Indexer():
 
-  def __init__(self, docs=None, docs_hash="", build_time=""):
+  def __init__(self, docs=None, docs_hash="", build_time="", analyzer=None, store=None):
     """Base class for the different indexers
     Attributes
     ----------
@@ -18,7 +21,14 @@ class Indexer():
       the doc_list is updated
     build_time : str
       Time spent building the index
+    analyzer : Analyzer
+      Analysis chain for the docs text, should be shared with the query path,
+      ignored if a store is given
+    store : DocStore
+      Store of the analyzed docs, shared with the other indexers and learners
+      to tokenize each doc once, a private store is created if None
     """
+    self.store = DocStore(analyzer) if store is None else store
     self.set_docs(docs)
     self.index = {}
     self.is_index_built = False
@@ -50,6 +60,20 @@ class Indexer():
 
     self.invalidate()
 
+  @property
+  def analyzer(self):
+    return self.store.analyzer
+
+  def set_analyzer(self, analyzer):
+    """Set the analyzer, through a new private store if it got changed"""
+    if analyzer is not self.analyzer:
+      self.set_store(DocStore(analyzer))
+
+  def set_store(self, store):
+    if store is not self.store:
+      self.store = store
+      self.invalidate()
+
   def get_index(self):
     if not self.is_index_built:
       self.build()
@@ -65,5 +89,17 @@ class Indexer():
     """a doc dictionary to capture the dictionary given a document index"""
     raise(NotImplementedError())
 
+  def get_memory_report(self, top=10):
+    """Estimate the memory used by the index, check MemoryReport
+
+    Parameters
+    ----------
+    top : int
+      Count of the largest entries to report
+    """
+    report = MemoryReport(type(self).__name__, len(self.index))
+    report.add("dictionary", get_dict_size(self.index))
+    return report
+
   def invalidate(self):
     self.is_index_built = False
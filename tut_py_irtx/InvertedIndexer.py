@@ -1,8 +1,10 @@
 import logging
+import sys
 
 from tut_py_irtx.Indexer import *
 from tut_py_irtx.Doc import *
 from tut_py_irtx.util import *
+from tut_py_irtx.Metrics import *
 
 class InvertedIndexerStats():
   def __init__(self, index=None):
@@ -44,8 +46,8 @@ class InvertedIndexer(Indexer):
   useTFIDF = True
   MAX_OCCURANCES = 3 # max occurances to display
 
-  def __init__(self, docs=None, docs_hash="", build_time=""):
-    super().__init__(docs, docs_hash, build_time)
+  def __init__(self, docs=None, docs_hash="", build_time="", analyzer=None, store=None):
+    super().__init__(docs, docs_hash, build_time, analyzer, store)
     self.is_stats_calced = False
     self.stats = InvertedIndexerStats()
 
@@ -63,18 +65,21 @@ class InvertedIndexer(Indexer):
     if (force or self.is_index_built == False):
       self.index = {}
       for doc in self.doc_list:
-        terms = Doc.fetch_terms(doc)
-        self.index = InvertedIndexer.merge_terms(self.index, terms)
-
-        # for each of the updated terms, update its idf
-        if (InvertedIndexer.useTFIDF):
-          for term in terms:
-            # Use the following for debugging the change of a term idf/tf, during indexing
-            #if term.text == "the":
-            #  print(InvertedIndexer.visualization_header() + \
-            #        self.visualize_term(term.text))
-            self.index[term.text].update_idf(len(self.doc_list))
+        term_counts = self.store.get_term_counts(doc)
 
+        with METRICS.timer(STAGE_MERGE):
+          self.index = InvertedIndexer.merge_term_counts(self.index, doc.index, term_counts)
+
+          # for each of the updated terms, update its idf
+          if (InvertedIndexer.useTFIDF):
+            for text in term_counts:
+              # Use the following for debugging the change of a term idf/tf, during indexing
+              #if text == "the":
+              #  print(InvertedIndexer.visualization_header() + \
+              #        self.visualize_term(text))
+              self.index[text].update_idf(len(self.doc_list))
+
+      logging.info(f"[MERGE] [STATS] [{len(self.doc_list)} DOCS][{len(self.index)} TERMS]")
       self.is_index_built = True
 
     return self.index
@@ -114,6 +119,21 @@ class InvertedIndexer(Indexer):
     return f"[{term_text:18}- {self.index[term_text].count:4} -{round(self.index[term_text].idf):5}] -> {tfs_str}\n"
 
 
+  def get_memory_report(self, top=10):
+    """Estimate the memory of the terms and their postings, the largest terms
+    are the ones of the longest posting lists"""
+    report = super().get_memory_report(top)
+    terms = self.index.values()
+    posting_size = get_node_size() + get_posting_size()
+
+    report.add("dictionary", sum(get_object_size(term) + get_object_size(term.occurances) for term in terms))
+    report.add("postings", sum(len(term.occurances) for term in terms) * posting_size)
+    report.add("buffers", sum(sys.getsizeof(term.buffer) for term in terms))
+
+    largest = MemoryReport.get_largest(terms, top, key=lambda term: len(term.occurances))
+    report.largest = [(term.text, len(term.occurances), len(term.occurances) * posting_size) for term in largest]
+    return report
+
   def get_stats(self):
     if self.is_stats_calced == False:
       self.stats.index = self.index
@@ -228,7 +248,7 @@ class InvertedIndexer(Indexer):
 
       inv_index[term.text].update_count()
 
-    log.info(f"[MERGE] [STATS] [NEW_TERMS {new_term_count}][NEW_POSTINGS {new_posting_count}][INC_TERM {inc_term_count}]")
+    InvertedIndexer.count_merged(new_term_count, new_posting_count, inc_term_count)
 
     # DO NOT DO THAT: it takes forever for large data
     #for key in indices:
@@ -236,3 +256,73 @@ class InvertedIndexer(Indexer):
 
     return inv_index
 
+  @staticmethod
+  def merge_term_counts(inv_index, doc_id, term_counts, update_tfs=True):
+    """Merge the term counts of a single doc with the given inv_index
+    and return the updated inv_index
+
+    Unlike `merge_terms()`, a single posting is allocated per distinct term
+    of the doc, instead of a Term per token.
+
+    Parameters
+    ----------
+    inv_index : dict
+      the index to merge into
+    doc_id : str
+      the global document id the term_counts belong to
+    term_counts : dict
+      the normalized term text -> count of occurances in the doc,
+      as returned by `Doc.count_terms()`
+    update_tfs : bool
+      update the term frequency of the merged postings
+
+    Returns
+    -------
+    dict
+      the updated inv_index
+    """
+    new_term_count = 0
+    inc_term_count = 0
+    new_posting_count = 0
+    for text, count in term_counts.items():
+      posting = Posting(doc_id)
+      term = inv_index.get(text)
+
+      if term is None:
+        new_term_count += 1
+        inc_term_count += count - 1
+        term = Term(text, [posting])
+        inv_index[text] = term
+        occ = term.occurances.head
+      else:
+        occ, stop = term.occurances.has(Node(posting))
+        if (occ is not None):
+          inc_term_count += count
+        else:
+          new_posting_count += 1
+          inc_term_count += count - 1
+          # docs are usually merged in a descending order,
+          # thus the new posting is mostly injected before the head
+          occ = Node(posting)
+          if (stop is not None):
+            term.occurances.inject_before(stop, occ)
+          else:
+            term.occurances.inject_tail(occ)
+
+      occ.data.count += count
+      if (InvertedIndexer.useTFIDF and update_tfs):
+        occ.data.update_tf()
+
+      term.update_count()
+
+    InvertedIndexer.count_merged(new_term_count, new_posting_count, inc_term_count)
+
+    return inv_index
+
+  @staticmethod
+  def count_merged(new_term_count, new_posting_count, inc_term_count):
+    """Report the merge stats of a doc to the metrics"""
+    if METRICS.enabled:
+      METRICS.increment("inverted_new_terms", new_term_count)
+      METRICS.increment("inverted_new_postings", new_posting_count)
+      METRICS.increment("inverted_amended_terms", inc_term_count)
@@ -1,12 +1,49 @@
-import datetime
 import logging
+import sys
+import time
 
 from tut_py_irtx.Indexer import *
+from tut_py_irtx.Metrics import *
 from tut_py_irtx.Doc import *
 from tut_py_irtx.Gram import *
 
+class BuildProgress():
+  """Snapshot of a running build, passed to the progress callback
+
+  Attributes
+  ----------
+  stage : str
+    STAGE_MERGE while merging the docs, STAGE_SORT while sorting the grams
+  done : int
+    Count of the docs merged, or of the grams sorted so far
+  total : int
+    Count of the docs, or of the grams to sort
+  grams : int
+    Count of the grams so far
+  words : int
+    Count of the gram words so far, while merging with the late sort,
+    the repeated words of a gram are counted until sorted
+  seconds : float
+    Monotonic time since the build started
+  """
+  __slots__ = ("stage", "done", "total", "grams", "words", "seconds")
+
+  def __init__(self, stage, done, total, grams, words, seconds):
+    self.stage = stage
+    self.done = done
+    self.total = total
+    self.grams = grams
+    self.words = words
+    self.seconds = seconds
+
+  def __str__(self):
+    return f"[GRAM-{self.stage.upper()}] [{self.done}/{self.total}] [{self.grams} GRAMS] [{self.words} WORDS] [{self.seconds:.3f} SECONDS]"
+
 class KGramIndexer(Indexer):
-  def __init__(self, docs=None, k=2, late_sort=True, docs_hash="", build_time=""):
+  DEFAULT_PROGRESS_EVERY = 1000
+
+  def __init__(self, docs=None, k=2, late_sort=True, docs_hash="", build_time="", analyzer=None, store=None,
+               progress=None, progress_every=DEFAULT_PROGRESS_EVERY):
     """KGram Indexer
 
     Attributes
@@ -18,15 +55,32 @@ class KGramIndexer(Indexer):
       setting it to True prevents from repeated ordered injections for the
       same Gram.words linked list, until a buffer list is compiled for all
       the index grams
+    progress : function
+      Called with a BuildProgress every progress_every docs merged
+      and grams sorted, then once at the end of each stage
+    words_count : int
+      Count of the words the grams point to, kept while building
     """
     self.k = 2
     self.late_sort = late_sort
-    super().__init__(docs, docs_hash, build_time)
+    self.words_count = 0
+    self.set_progress(progress, progress_every)
+    super().__init__(docs, docs_hash, build_time, analyzer, store)
+
+  def set_progress(self, progress, every=DEFAULT_PROGRESS_EVERY):
+    """Attach a progress callback to the builds, None to detach it"""
+    if every <= 0:
+      raise ValueError(f"The progress interval should be positive, got {every}")
+    self.progress = progress
+    self.progress_every = every
+
+  def report_progress(self, stage, done, total, start):
+    self.progress(BuildProgress(stage, done, total, len(self.index), self.words_count, time.perf_counter() - start))
 
   @staticmethod
   def is_term_ignored(text):
     """return true if a text is not kgram indexed"""
-    return text.startswith("https:")
+    return Analyzer.is_url(text)
 
   def build(self, force=False):
     """Build the KGram index of the given doc(s) and return it"""
@@ -34,50 +88,61 @@ class KGramIndexer(Indexer):
 
     if (force or self.is_index_built == False):
       self.index = {}
-
-      date_old = datetime.datetime.now()
+      self.words_count = 0
+      start = time.perf_counter()
+      progress = self.progress
+      every = self.progress_every
+
+      # a word shares the same grams regardless of the docs it appeared in,
+      # thus each distinct term of the store is merged once
+      terms = self.store.terms
+      merged_term_ids = set()
       doc_count = len(self.doc_list)
 
-      for i, doc in enumerate(self.doc_list):
-
-        # Info purposes
-        if i > 0 and \
-           ((not self.late_sort and i % 100  == 0) or \
-            (    self.late_sort and i % 1000 == 0)):
-          date_new = datetime.datetime.now()
-          logging.info(f"[GRAM-MERGING] [FINISHED: {i:5}/{doc_count}] [AT: {doc.index}] [{(date_new-date_old).seconds} SECONDS] [{len(self.index.keys())} GRAMS] [{self.index_words_count()} WORDS]")
-          date_old = date_new
-          if i == 100:
-            logging.debug(Gram.get_header())
-            for s in self.get_slice(-1):
-              logging.debug(s)
-        # End of info purposes
-
-        for term in Doc.fetch_terms(doc):
-          if KGramIndexer.is_term_ignored(term.text):
-            continue
-          if self.late_sort:
-            self.index = self.merge_grams_buffer_unordered(self.index, KGramIndexer.fetch_grams_raw(term.text, self.k), word=term.text)
-          else:
-            self.index = self.merge_grams_ordered(self.index, KGramIndexer.fetch_grams(term.text, self.k))
+      with METRICS.timer(STAGE_MERGE):
+        for i, doc in enumerate(self.doc_list):
+          if progress is not None and i > 0 and i % every == 0:
+            self.report_progress(STAGE_MERGE, i, doc_count, start)
+
+          for term_id in self.store.get(doc).term_ids.tolist():
+            if term_id in merged_term_ids:
+              continue
+            merged_term_ids.add(term_id)
+
+            text = terms[term_id]
+            if KGramIndexer.is_term_ignored(text):
+              continue
+            if self.late_sort:
+              grams = KGramIndexer.fetch_grams_raw(text, self.k)
+              self.index = self.merge_grams_buffer_unordered(self.index, grams, word=text)
+              self.words_count += len(grams)
+            else:
+              grams = KGramIndexer.fetch_grams(text, self.k)
+              # the ordered merge skips the words a gram already has
+              gram_texts = {gram.text for gram in grams}
+              words_count = sum(len(self.index[gram_text].words) for gram_text in gram_texts if gram_text in self.index)
+              self.index = self.merge_grams_ordered(self.index, grams)
+              self.words_count += sum(len(self.index[gram_text].words) for gram_text in gram_texts) - words_count
+      METRICS.increment("kgram_terms_merged", len(merged_term_ids))
+      if progress is not None:
+        self.report_progress(STAGE_MERGE, doc_count, doc_count, start)
 
       if self.late_sort:
-
-        date_old = datetime.datetime.now()
-        gram_count = len(self.index.keys())
-
-        for i, key in enumerate(self.index.keys()):
-
-          # Info purposes
-          if i % 100 == 0:
-            date_new = datetime.datetime.now()
-            logging.info(f"[GRAM-SORTING] [SORTED {i}/{gram_count} GRAMS] [AT: {self.index[key].text} {len(self.index[key].buffer)}][{(date_new-date_old).seconds} SECONDS] [{self.index_words_count()} WORDS]")
-            date_old = date_new
-          # End of info purposes
-
-          self.index[key].populate_from_processed_buffer()
-
-        logging.info(f"[POST-GRAM-SORTING] [{len(self.index.keys())} GRAMS] [{self.index_words_count()} WORDS]")
+        gram_count = len(self.index)
+        self.words_count = 0
+        with METRICS.timer(STAGE_SORT):
+          for i, gram in enumerate(self.index.values()):
+            if progress is not None and i > 0 and i % every == 0:
+              self.report_progress(STAGE_SORT, i, gram_count, start)
+
+            gram.populate_from_processed_buffer()
+            self.words_count += len(gram.words)
+        METRICS.increment("kgram_grams_sorted", gram_count)
+        if progress is not None:
+          self.report_progress(STAGE_SORT, gram_count, gram_count, start)
+
+      METRICS.increment("kgram_words", self.words_count)
+      logging.info(f"[GRAM-INDEXING] [{len(self.doc_list)} DOCS] [{len(self.index)} GRAMS] [{self.words_count} WORDS]")
 
       self.is_index_built = True
 
@@ -92,10 +157,25 @@ class KGramIndexer(Indexer):
       out += f"{i}\n"
     return out
 
+  def get_memory_report(self, top=10):
+    """Estimate the memory of the grams, their word lists and their buffers,
+    the largest grams are the ones of the longest word lists"""
+    report = super().get_memory_report(top)
+    grams = self.index.values()
+    node_size = get_node_size()
+
+    report.add("dictionary", sum(get_object_size(gram) + get_object_size(gram.words) for gram in grams))
+    report.add("word lists", sum(len(gram.words) for gram in grams) * node_size)
+    # the buffers keep the words a gram appeared in, as merged
+    report.add("buffers", sum(sys.getsizeof(gram.buffer) for gram in grams if gram.buffer is not None))
+
+    largest = MemoryReport.get_largest(grams, top, key=lambda gram: len(gram.words))
+    report.largest = [(gram.text, len(gram.words), len(gram.words) * node_size) for gram in largest]
+    return report
+
   def index_words_count(self):
-    """return count of words the index keys point to"""
-    counts = [self.index[key].words.get_count() for key in self.index.keys()]
-    return sum(counts)
+    """return count of words the index keys point to, from the kept count of each gram"""
+    return sum(len(gram.words) for gram in self.index.values())
 
   @staticmethod
   def fetch_grams(term, k=2):
@@ -1,21 +1,89 @@
 import random
 import logging
 import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Value
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from tut_py_irtx.SparseMatrix import *
 
 DEFAULT_DIMENSIONS=2
 
+# Training backends
+# - python: the reference implementation, built on the Instance arithmetic
+# - numpy: the instances are stacked into a single 2-D array,
+#          distances and centroids are computed with matrix operations
+BACKEND_PYTHON = "python"
+BACKEND_NUMPY = "numpy"
+DEFAULT_BACKEND = BACKEND_NUMPY
+
+# Initialization of the centroids
+# - sample: the first k instances for the seed 0, a random sample of k instances otherwise
+# - k-means++: a random first instance, then each next instance is drawn with
+#              a probability proportional to its squared distance to the nearest
+#              chosen instance, spreading the centroids over the instances
+INIT_SAMPLE = "sample"
+INIT_KMEANS_PP = "k-means++"
+DEFAULT_INIT = INIT_SAMPLE
+
+# Reasons of stopping the training
+STOP_RSS_CONVERGED = "rss-converged"
+STOP_TOLERANCE = "tolerance"
+STOP_NO_REASSIGNMENT = "no-reassignment"
+STOP_MAX_ITER = "max-iter"
+
 class KMeansClusterOptimizer:
-  def __init__(self, k=2, dimensions=DEFAULT_DIMENSIONS, seed_count=3):
+  """
+  Train a KMeansCluster per seed and keep the one of the lowest RSS
+
+  The seeds are independent, with the numpy backend they are trained
+  across a process pool sharing a read-only instance matrix.
+  """
+  def __init__(self, k=2, dimensions=DEFAULT_DIMENSIONS, seed_count=3, backend=DEFAULT_BACKEND, spherical=False,
+               workers=1, abandon_ratio=None, init=DEFAULT_INIT, max_iter=None, tol=None):
+    """
+
+    Parameters
+    ----------
+    backend, spherical, init, max_iter, tol
+      Options of each KMeansCluster, check KMeansCluster()
+    workers : int
+      Count of the processes training the seeds, None for the cpu count,
+      only used by the numpy backend
+    abandon_ratio : float
+      Abandon a run once its RSS exceeds the best finished RSS by this ratio,
+      for example 1.5, None to always run till convergence
+    """
     self.k = k
     self.dimensions = dimensions
     self.seed_count = seed_count
+    self.backend = backend
+    self.spherical = spherical
+    self.init = init
+    self.max_iter = max_iter
+    self.tol = tol
+    self.workers = os.cpu_count() if workers is None else workers
+    self.abandon_ratio = abandon_ratio
+    # seeds of the runs abandoned by the last training
+    self.abandoned_seeds = []
+
+  def get_kmeans_options(self):
+    """Keyword arguments of each trained KMeansCluster"""
+    return {"backend": self.backend, "spherical": self.spherical,
+            "init": self.init, "max_iter": self.max_iter, "tol": self.tol}
+
+  def train(self, instances, items=None):
+    if self.backend == BACKEND_NUMPY:
+      return self.train_numpy(instances, items)
 
-  def train(self, instances):
     kmeans_tries = []
     for seed in range(self.seed_count):
       print(f"[KMEANS][OPTIMIZATION][SEED][STARTED]")
-      kmeans = KMeansCluster(self.k, dimensions=self.dimensions)
-      kmeans.train(instances, seed=seed)
+      kmeans = KMeansCluster(self.k, dimensions=self.dimensions, **self.get_kmeans_options())
+      kmeans.train(instances, seed=seed, items=items)
       kmeans_tries.append(kmeans)
       print(f"[KMEANS][OPTIMIZATION][SEED][FINISHED][CURRENT_RSS: {kmeans.RSS()}]")
     
@@ -24,14 +92,193 @@ class KMeansClusterOptimizer:
 
     return min_kmeans
 
+  def train_numpy(self, instances, items=None):
+    """Train the seeds over a single matrix, in parallel if more than a worker is set
+
+    Only the labels, centroids and RSS of the runs are sent back from the workers,
+    the clusters of the best run are then built over the local matrix.
+    """
+    kmeans = KMeansCluster(self.k, dimensions=self.dimensions, **self.get_kmeans_options())
+    matrix, items = kmeans.prepare_matrix(instances, items)
+
+    self.abandoned_seeds = []
+    best = None
+    for seed, state in self.run_seeds(matrix):
+      if state is None:
+        logging.info(f"[KMEANS][OPTIMIZATION][SEED: {seed}][ABANDONED]")
+        self.abandoned_seeds.append(seed)
+        continue
+
+      rss = KMeansCluster.get_total_rss(state[2], self.k)
+      logging.info(f"[KMEANS][OPTIMIZATION][SEED: {seed}][FINISHED][CURRENT_RSS: {rss}]")
+      # ties are resolved to the lowest seed, as in the sequential training
+      if best is None or rss < best[0]:
+        best = (rss, state)
+
+    kmeans.set_clusters_state(items, matrix, *best[1])
+    logging.info(f"[KMEANS][OPTIMIZATION][BEST_RSS: {kmeans.RSS()}]")
+
+    return kmeans
+
+  def run_seeds(self, matrix):
+    """Yield (seed, state) of each seed run, the state is None for the abandoned runs"""
+    seeds = list(range(self.seed_count))
+    workers = min(self.workers, len(seeds))
+
+    if workers <= 1:
+      best_rss = math.inf
+      for seed in seeds:
+        state = _fit_seed(self.k, self.dimensions, self.get_kmeans_options(), matrix, seed,
+                          KMeansClusterOptimizer.get_abandon_check(lambda: best_rss, self.abandon_ratio))
+        if state is not None:
+          best_rss = min(best_rss, KMeansCluster.get_total_rss(state[2], self.k))
+        yield seed, state
+      return
+
+    shared = SharedArrays(matrix)
+    best_rss = Value("d", math.inf)
+    try:
+      with ProcessPoolExecutor(max_workers=workers, initializer=_init_seed_worker,
+                               initargs=(shared.get_specs(), best_rss)) as pool:
+        futures = [pool.submit(_fit_shared_seed, self.k, self.dimensions, self.get_kmeans_options(), seed,
+                               self.abandon_ratio)
+                   for seed in seeds]
+        for seed, future in zip(seeds, futures):
+          yield seed, future.result()
+    finally:
+      shared.close()
+
+  @staticmethod
+  def get_abandon_check(get_best_rss, abandon_ratio):
+    """Get a check of a running RSS against the best finished RSS, None if disabled"""
+    if abandon_ratio is None:
+      return None
+    return lambda rss: rss > get_best_rss() * abandon_ratio
+
+class SharedArrays():
+  """Dense or sparse matrix copied once into shared memory blocks
+
+  The workers attach the blocks as read-only arrays, instead of getting
+  a copy of the matrix pickled per task.
+  """
+  def __init__(self, matrix):
+    self.is_sparse = isinstance(matrix, SparseMatrix)
+    self.shape = matrix.shape
+    arrays = [matrix.data, matrix.indices, matrix.indptr] if self.is_sparse else [np.ascontiguousarray(matrix)]
+
+    self.blocks = []
+    self.arrays_specs = []
+    for array in arrays:
+      # zero sized blocks are not supported
+      block = SharedMemory(create=True, size=max(array.nbytes, 1))
+      np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+      self.blocks.append(block)
+      self.arrays_specs.append((block.name, array.shape, array.dtype.str))
+
+  def get_specs(self):
+    return (self.is_sparse, self.shape, self.arrays_specs)
+
+  @staticmethod
+  def attach(specs):
+    """Get the (blocks, matrix) of the given specs, the blocks must outlive the matrix"""
+    is_sparse, shape, arrays_specs = specs
+    blocks = []
+    arrays = []
+    for name, array_shape, dtype in arrays_specs:
+      block = SharedMemory(name=name)
+      array = np.ndarray(array_shape, dtype=np.dtype(dtype), buffer=block.buf)
+      array.flags.writeable = False
+      blocks.append(block)
+      arrays.append(array)
+
+    matrix = SparseMatrix(*arrays, shape) if is_sparse else arrays[0]
+    return blocks, matrix
+
+  def close(self):
+    for block in self.blocks:
+      block.close()
+      block.unlink()
+    self.blocks = []
+
+# state of each seed worker process, set once by _init_seed_worker
+_seed_worker = {}
+
+def _init_seed_worker(specs, best_rss):
+  blocks, matrix = SharedArrays.attach(specs)
+  _seed_worker["blocks"] = blocks
+  _seed_worker["matrix"] = matrix
+  _seed_worker["best_rss"] = best_rss
+
+def _fit_seed(k, dimensions, options, matrix, seed, abandon=None):
+  kmeans = KMeansCluster(k, dimensions=dimensions, **options)
+  return kmeans.fit(matrix, seed, abandon)
+
+def _fit_shared_seed(k, dimensions, options, seed, abandon_ratio):
+  best_rss = _seed_worker["best_rss"]
+  abandon = KMeansClusterOptimizer.get_abandon_check(lambda: best_rss.value, abandon_ratio)
+  state = _fit_seed(k, dimensions, options, _seed_worker["matrix"], seed, abandon)
+
+  if state is not None:
+    rss = KMeansCluster.get_total_rss(state[2], k)
+    with best_rss.get_lock():
+      best_rss.value = min(best_rss.value, rss)
+  return state
+
 class KMeansCluster:
   """
   KMeans Cluster algorithm
   """
-  def __init__(self, k=2, dimensions=DEFAULT_DIMENSIONS):
+  def __init__(self, k=2, dimensions=DEFAULT_DIMENSIONS, backend=DEFAULT_BACKEND, spherical=False,
+               init=DEFAULT_INIT, max_iter=None, tol=None):
+    """
+
+    Parameters
+    ----------
+    k : int
+      Count of the clusters
+    dimensions : int
+      Count of the dimensions of each instance
+    backend : str
+      BACKEND_NUMPY or BACKEND_PYTHON, both give the same clustering
+    spherical : bool
+      Cluster by the cosine distance (spherical KMeans), the instances and
+      the centroids are normalized to a unit length, and the distance of
+      an instance to a centroid is 1 - their dot product.
+      Only supported by the numpy backend
+    init : str
+      INIT_SAMPLE or INIT_KMEANS_PP
+    max_iter : int
+      Maximum count of iterations, None for no limit
+    tol : float
+      Stop once the RSS changes by at most this ratio of the previous RSS,
+      None to only stop once the RSS changes by less than 1e-5
+
+    Attributes
+    ----------
+    iterations : int
+      Count of the iterations of the last training
+    stop_reason : str
+      Why the last training stopped, one of the STOP_* reasons
+    """
+    if backend not in (BACKEND_PYTHON, BACKEND_NUMPY):
+      raise ValueError(f"Unsupported KMeans backend {backend}")
+    if spherical and backend != BACKEND_NUMPY:
+      raise ValueError("Spherical KMeans is only supported by the numpy backend")
+    if init not in (INIT_SAMPLE, INIT_KMEANS_PP):
+      raise ValueError(f"Unsupported KMeans initialization {init}")
+
     self.k = k
     self.clusters = []
     self.dimensions = dimensions
+    self.backend = backend
+    self.spherical = spherical
+    self.init = init
+    self.max_iter = max_iter
+    self.tol = tol
+    self.iterations = 0
+    self.stop_reason = None
+    # seeded on training, so that a seed always gives the same clustering
+    self.random = random.Random()
 
   def get_init_instances(self, instances, seed):
     """
@@ -39,6 +286,11 @@ class KMeansCluster:
     ----------
     seed : int
       if 0 return the elements in order
+
+    Returns
+    -------
+    list
+      k distinct instances, or all the instances in a random order if fewer
     """
     init_instances = []
 
@@ -46,75 +298,443 @@ class KMeansCluster:
     if seed == 0:
       for iter in range(min(self.k, len(instances))):
         init_instances.append(instances[iter]) 
-    elif self.k > len(instances):
-      for iter in len(instances):
-        next = random.choice(instances_range)
-        init_instances.append(instances[next])
     else:
-      sample = random.sample(instances_range, self.k)
+      sample = self.random.sample(instances_range, min(self.k, len(instances)))
       for iter in sample:
         init_instances.append(instances[iter])
 
     return init_instances
 
-  def train(self, instances, seed=0):
+  def get_kmeanspp_rows(self, matrix, matrix_sq):
+    """Choose the initial rows of the matrix by the k-means++ seeding
+
+    Returns
+    -------
+    list of int
+      up to k distinct rows, fewer if the remaining rows coincide with the chosen ones
     """
-    Parameters
-    ----------
-    seed : int
-      if 0, instances assigned initially to each cluster are not shuffled, but used in order 
+    if len(matrix) == 0:
+      return []
+
+    rows = [self.random.randrange(len(matrix))]
+    closest = self.get_dists_to_row(matrix, matrix_sq, rows[0])
+    while len(rows) < min(self.k, len(matrix)):
+      cumulative = np.cumsum(closest)
+      if cumulative[-1] <= 0:
+        break
+      row = int(np.searchsorted(cumulative, self.random.random() * cumulative[-1], side="right"))
+      row = min(row, len(matrix) - 1)
+      rows.append(row)
+      np.minimum(closest, self.get_dists_to_row(matrix, matrix_sq, row), out=closest)
+
+    return rows
+
+  def get_dists_to_row(self, matrix, matrix_sq, row):
+    """Squared euclidean, or cosine, distance of every row to the given row"""
+    centroid = KMeansCluster.get_row(matrix, row)[None, :]
+    if self.spherical:
+      return np.maximum(1 - KMeansCluster.get_products(matrix, centroid)[:, 0], 0)
+    return KMeansCluster.get_dists_squared(matrix, matrix_sq, centroid)[:, 0]
+
+  def get_init_rows(self, matrix, matrix_sq, seed):
+    """Get the rows of the matrix each cluster is initialized at"""
+    if self.init == INIT_KMEANS_PP:
+      return self.get_kmeanspp_rows(matrix, matrix_sq)
+    return self.get_init_instances(list(range(len(matrix))), seed)
+
+  def init_clusters(self, instances, seed):
+    """Create k clusters with an initial instance each
+
+    If there are fewer distinct initial instances than clusters,
+    the extra clusters are centered at one of them, and thus stay empty.
     """
-    # Step 1: Create k clusters with random centroids
-    for c_iter in range(self.k):
-      # NOTE: if a cluster's centroid was chosen very far,
-      #       the RSS may saturate while the cluster has no instances
-      #       to avoid that we could preassign each cluster an instance
-      #       that way the centroid would be updated next to the instance it has
-      #       and thus the cluster would converge to a state where each cluster
-      #       has at least one instance if K is =< len(instances)
+    # NOTE: if a cluster's centroid was chosen very far,
+    #       the RSS may saturate while the cluster has no instances
+    #       to avoid that each cluster is preassigned an instance
+    #       that way the centroid would be updated next to the instance it has
+    #       and thus the cluster would converge to a state where each cluster
+    #       has at least one instance if K is =< len(instances)
+    if self.init == INIT_KMEANS_PP:
+      matrix = KMeansCluster.get_matrix(instances)
+      rows = self.get_kmeanspp_rows(matrix, (matrix * matrix).sum(axis=1))
+      init_instances = [instances[row] for row in rows]
+    else:
       init_instances = self.get_init_instances(instances, seed)
+
+    self.clusters = []
+    for c_iter in range(self.k):
       if c_iter < len(init_instances):
         cluster = Cluster(dimensions=self.dimensions, label=str(c_iter), instances=[init_instances[c_iter]])
+      elif len(init_instances) > 0:
+        centroid = Instance.from_own_array(init_instances[c_iter % len(init_instances)].array.copy())
+        cluster = Cluster(dimensions=self.dimensions, label=str(c_iter), centroid=centroid)
       else:
         cluster = Cluster(dimensions=self.dimensions, label=str(c_iter))
       self.clusters.append(cluster)
 
+  def get_stop_reason(self, rss_old, rss_new):
+    """Get why the training should stop after the current iteration, None to continue
+
+    The rss_old of the first iteration is infinite, thus only the max_iter
+    may stop it.
+    """
+    if KMeansCluster.is_rss_similar(rss_old, rss_new):
+      return STOP_RSS_CONVERGED
+    if self.tol is not None and math.isfinite(rss_old) and abs(rss_old - rss_new) <= self.tol * abs(rss_old):
+      return STOP_TOLERANCE
+    if self.max_iter is not None and self.iterations >= self.max_iter:
+      return STOP_MAX_ITER
+    return None
+
+  def train(self, instances, seed=0, items=None):
+    """
+    Parameters
+    ----------
+    instances : list of Instance or numpy.ndarray or SparseMatrix
+      The instances to cluster, a matrix holds an instance per row,
+      sparse matrices are only supported by the numpy backend
+    seed : int
+      if 0, instances assigned initially to each cluster are not shuffled, but used in order 
+    items : list
+      The objects set as the cluster instances, one per instance,
+      defaults to the given Instances, or to Instance views of the rows of
+      a dense matrix, or to the row ids of a sparse matrix
+    """
+    self.random.seed(seed)
+    if self.backend == BACKEND_NUMPY:
+      return self.train_numpy(instances, seed, items)
+
+    if isinstance(instances, SparseMatrix):
+      raise TypeError("Sparse matrices are only supported by the numpy backend")
+    if isinstance(instances, np.ndarray):
+      instances = [Instance(values=row) for row in instances]
+
+    # Step 1: Create k clusters with an initial instance each
+    self.init_clusters(instances, seed)
+
+    # the clusters keep running sums of their instances,
+    # updated only for the instances that moved
+    for cluster in self.clusters:
+      cluster.clear_instances()
+
     # Step 2: Calculate the RSS
-    rss_old = 1000000 # <- TODO: use infinity
+    rss_old = math.inf
+    labels = [None] * len(instances)
+    self.iterations = 0
     while (True):
     # Step 3: While() -> Re-assign instances to the nearest cluster
 
 
       logging.info(f"\n[KMEANS][CURRENT-CLUSTERING]\n{self}")
+      self.iterations += 1
 
-      for cluster in self.clusters:
-        cluster.instances = [] # <- the "re" part in "reassign"
-
-      distances = {}
+      centroids = [cluster.GetCentroid() for cluster in self.clusters]
+      # the RSS of the current centroids, out of the assignment distances
+      cluster_rss = [0] * self.k
+      changed = set()
       logging.info(f"[KMEANS][REASSIGNMENTS]")
-      for instance in instances:
-        for c_iter, cluster in enumerate(self.clusters):
-          distances.setdefault(c_iter, 0)
-          distances[c_iter] = instance.get_dist(cluster.GetCentroid())
+      for i, instance in enumerate(instances):
+        distances = [instance.get_dist(centroid) for centroid in centroids]
+        nearest = min(range(self.k), key=distances.__getitem__)
+        cluster_rss[nearest] += distances[nearest]
+
+        if labels[i] != nearest:
+          logging.info(f"Instance {instance} got assigned to cluster {nearest} [DIST: {distances[nearest]}]")
+          if labels[i] is not None:
+            self.clusters[labels[i]].remove_instance(instance)
+            changed.add(labels[i])
+          self.clusters[nearest].add_instance(instance)
+          changed.add(nearest)
+          labels[i] = nearest
 
-        nearest_cluster_iter = min(distances.items(), key=lambda x: x[1]) 
-        logging.info(f"Instance {instance} got assigned to cluster {nearest_cluster_iter[0]} [DIST: {nearest_cluster_iter[1]}]")
-        self.clusters[nearest_cluster_iter[0]].instances.append(instance)
+      # no instance got reassigned, the centroids and the RSS would not change
+      if len(changed) == 0:
+        self.stop_reason = STOP_NO_REASSIGNMENT
+        break
 
     # Step 4: While() -> Adjust the centroid
-      for c_iter, cluster in enumerate(self.clusters):
-        cluster.UpdateCentroid()
+      for c_iter in changed:
+        self.clusters[c_iter].UpdateCentroid()
 
       # Step 5: Once RSS converges break the while()
-      rss_new = self.RSS(True)
+      rss_new = sum(rss/self.k for rss in cluster_rss)
 
       print(f"[KMEANS][RSS: ({round(rss_old,2)} -> {round(rss_new,2)}][DIFF: {abs(rss_new-rss_old)}]")
-      if KMeansCluster.is_rss_similar(rss_old, rss_new):
-        print(f"\n[KMEANS][FINAL-CLUSTERING]\n{self}")
+      self.stop_reason = self.get_stop_reason(rss_old, rss_new)
+      if self.stop_reason is not None:
+        # the centroids moved since the assignment, the RSS gets recomputed once
+        cluster_rss = None
+        break
+
+      rss_old = rss_new
+
+    self.set_instances(instances, labels, cluster_rss)
+    print(f"\n[KMEANS][FINAL-CLUSTERING]\n{self}")
+
+  def set_instances(self, instances, labels, cluster_rss=None):
+    """Set the instances of each cluster out of their labels
+
+    Parameters
+    ----------
+    cluster_rss : list of float
+      The RSS of each cluster, recomputed if None
+    """
+    for cluster in self.clusters:
+      cluster.instances = []
+    for instance, label in zip(instances, labels):
+      self.clusters[label].instances.append(instance)
+
+    for c_iter, cluster in enumerate(self.clusters):
+      if cluster_rss is None:
+        cluster.UpdateRSS()
+      else:
+        cluster.cache_rss = cluster_rss[c_iter]
+
+  @staticmethod
+  def get_matrix(instances):
+    """Stack the values of the instances into a 2-D float array"""
+    if len(instances) == 0:
+      return np.zeros((0, 0))
+    return np.array([instance.array for instance in instances], dtype=float)
+
+  @staticmethod
+  def get_products(matrix, centroids):
+    """Dot product of every instance with every centroid
+
+    Parameters
+    ----------
+    matrix : numpy.ndarray or SparseMatrix
+      (instances x dimensions) matrix
+    centroids : numpy.ndarray
+      (clusters x dimensions) array
+
+    Returns
+    -------
+    numpy.ndarray
+      (instances x clusters) array
+    """
+    if isinstance(matrix, SparseMatrix):
+      return matrix.dot(centroids.T)
+    return matrix @ centroids.T
+
+  @staticmethod
+  def get_dists_squared(matrix, matrix_sq, centroids):
+    """Squared euclidean distance of every instance to every centroid
+
+    Parameters
+    ----------
+    matrix : numpy.ndarray or SparseMatrix
+      (instances x dimensions) matrix
+    matrix_sq : numpy.ndarray
+      squared norm of each instance of the matrix
+    centroids : numpy.ndarray
+      (clusters x dimensions) array
+
+    Returns
+    -------
+    numpy.ndarray
+      (instances x clusters) array
+    """
+    # |x - c|^2 = |x|^2 - 2 x.c + |c|^2, computed in a single matrix product
+    dists = KMeansCluster.get_products(matrix, centroids)
+    dists *= -2
+    dists += matrix_sq[:, None]
+    dists += (centroids * centroids).sum(axis=1)[None, :]
+    # cancellation could produce tiny negative values
+    np.maximum(dists, 0, out=dists)
+    return dists
+
+  @staticmethod
+  def get_grouped_sums(matrix, labels, k):
+    """Sum the instances of each cluster"""
+    if isinstance(matrix, SparseMatrix):
+      return matrix.get_grouped_sums(labels, k)
+
+    # through a one-hot matrix product
+    one_hot = np.zeros((k, len(labels)))
+    one_hot[labels, np.arange(len(labels))] = 1
+    return one_hot @ matrix
+
+  @staticmethod
+  def get_row(matrix, row):
+    """Get a row of the matrix as a dense array"""
+    if isinstance(matrix, SparseMatrix):
+      values = np.zeros(matrix.shape[1])
+      indices, data = matrix.get_row(row)
+      values[indices] = data
+      return values
+    return np.array(matrix[row], dtype=float)
+
+  @staticmethod
+  def normalize(matrix):
+    """Scale each non-zero row of the matrix to a unit length"""
+    if isinstance(matrix, SparseMatrix):
+      return matrix.normalize_rows()
+    norms = np.sqrt((matrix * matrix).sum(axis=1))
+    norms[norms == 0] = 1
+    return matrix / norms[:, None]
+
+  @staticmethod
+  def get_assigned_dists(matrix, matrix_sq, centroids, labels, spherical=False):
+    """Distance of every instance to the centroid of its cluster"""
+    if spherical:
+      if isinstance(matrix, SparseMatrix):
+        products = matrix.dot_rows(centroids, labels)
+      else:
+        products = np.einsum("ij,ij->i", matrix, centroids[labels])
+      return 1 - products
+
+    if isinstance(matrix, SparseMatrix):
+      centroids_sq = (centroids * centroids).sum(axis=1)
+      dists_sq = matrix_sq - 2 * matrix.dot_rows(centroids, labels) + centroids_sq[labels]
+      return np.sqrt(np.maximum(dists_sq, 0))
+
+    # exact distances on dense matrices, same as Cluster.UpdateRSS
+    return np.sqrt(((matrix - centroids[labels]) ** 2).sum(axis=1))
+
+  def init_centroids(self, matrix, matrix_sq, seed):
+    """Create the initial centroids, the same way init_clusters() does"""
+    rows = self.get_init_rows(matrix, matrix_sq, seed)
+    centroids = np.zeros((self.k, matrix.shape[1]))
+    for c_iter in range(self.k):
+      if len(rows) > 0:
+        centroids[c_iter] = KMeansCluster.get_row(matrix, rows[c_iter % len(rows)])
+
+    return centroids
+
+  def train_numpy(self, instances, seed=0, items=None):
+    """Vectorized train(), the instances are stacked into a single matrix
+
+    Each iteration computes all the instance-centroid distances at once,
+    and updates the centroids through grouped sums.
+    """
+    matrix, items = self.prepare_matrix(instances, items)
+    self.set_clusters_state(items, matrix, *self.fit(matrix, seed))
+    logging.info(f"\n[KMEANS][FINAL-CLUSTERING]\n{self}")
+
+  def prepare_matrix(self, instances, items=None):
+    """Get the (matrix, items) to train on, normalized for the spherical KMeans
+
+    Parameters
+    ----------
+    items : list
+      The objects set as the cluster instances, check train()
+    """
+    if isinstance(instances, SparseMatrix):
+      matrix = instances
+      items = list(range(len(matrix))) if items is None else items
+    elif isinstance(instances, np.ndarray):
+      matrix = np.asarray(instances, dtype=float)
+      items = [Instance(values=row) for row in matrix] if items is None else items
+    else:
+      matrix = KMeansCluster.get_matrix(instances)
+      items = instances if items is None else items
+
+    if self.spherical:
+      matrix = KMeansCluster.normalize(matrix)
+
+    return matrix, items
+
+  def fit(self, matrix, seed=0, abandon=None):
+    """Run the vectorized training over a prepared matrix
+
+    Parameters
+    ----------
+    abandon : callable
+      Called with the RSS of each iteration, the training is abandoned
+      once it returns True
+
+    Returns
+    -------
+    tuple
+      (labels, centroids, cluster_rss) arrays, or None if abandoned
+    """
+    self.random.seed(seed)
+
+    if isinstance(matrix, SparseMatrix):
+      matrix_sq = matrix.get_row_norms_squared()
+    else:
+      matrix_sq = (matrix * matrix).sum(axis=1)
+
+    # Step 1: Create k clusters with an initial instance each
+    centroids = self.init_centroids(matrix, matrix_sq, seed)
+    if self.spherical:
+      centroids = KMeansCluster.normalize(centroids)
+
+    # Step 2: Calculate the RSS
+    rss_old = math.inf
+    labels_old = None
+    rows = np.arange(len(matrix))
+    self.iterations = 0
+    while (True):
+      self.iterations += 1
+      # Step 3: While() -> Re-assign instances to the nearest cluster
+      if self.spherical:
+        # the nearest centroid is the most similar one
+        products = KMeansCluster.get_products(matrix, centroids)
+        labels = np.argmax(products, axis=1)
+        dists = 1 - products[rows, labels]
+      else:
+        dists_squared = KMeansCluster.get_dists_squared(matrix, matrix_sq, centroids)
+        labels = np.argmin(dists_squared, axis=1)
+        dists = np.sqrt(dists_squared[rows, labels])
+
+      # the RSS of the current centroids, out of the assignment distances
+      cluster_rss = np.bincount(labels, weights=dists, minlength=self.k)
+
+      # no instance got reassigned, the centroids and the RSS would not change
+      if labels_old is not None and np.array_equal(labels, labels_old):
+        self.stop_reason = STOP_NO_REASSIGNMENT
+        break
+      labels_old = labels
+
+      # Step 4: While() -> Adjust the centroid
+      # clusters without instances keep their centroid
+      counts = np.bincount(labels, minlength=self.k)
+      sums = KMeansCluster.get_grouped_sums(matrix, labels, self.k)
+      assigned = counts > 0
+      if self.spherical:
+        centroids[assigned] = KMeansCluster.normalize(sums[assigned])
+      else:
+        centroids[assigned] = sums[assigned] / counts[assigned, None]
+
+      # Step 5: Once RSS converges break the while()
+      rss_new = KMeansCluster.get_total_rss(cluster_rss, self.k)
+
+      logging.info(f"[KMEANS][RSS: ({round(rss_old,2)} -> {round(rss_new,2)}][DIFF: {abs(rss_new-rss_old)}]")
+      self.stop_reason = self.get_stop_reason(rss_old, rss_new)
+      if self.stop_reason is not None:
         break
 
+      if abandon is not None and abandon(rss_new):
+        logging.info(f"[KMEANS][ABANDONED][RSS: {round(rss_new,2)}]")
+        return None
+
       rss_old = rss_new
 
+    # the exact RSS of the final centroids, computed once
+    dists = KMeansCluster.get_assigned_dists(matrix, matrix_sq, centroids, labels, self.spherical)
+    cluster_rss = np.bincount(labels, weights=dists, minlength=self.k)
+
+    return labels, centroids, cluster_rss
+
+  @staticmethod
+  def get_total_rss(cluster_rss, k):
+    """The RSS of the clustering, as computed by RSS() out of the clusters RSS"""
+    return sum(rss/k for rss in cluster_rss.tolist())
+
+  def set_clusters_state(self, items, matrix, labels, centroids, cluster_rss):
+    """Reflect the state of a vectorized training into the clusters"""
+    self.clusters = []
+    for c_iter in range(self.k):
+      members = np.flatnonzero(labels == c_iter)
+      centroid = Instance.from_own_array(centroids[c_iter].copy())
+      cluster = Cluster(dimensions=matrix.shape[1], label=str(c_iter), centroid=centroid)
+      cluster.instances = [items[i] for i in members.tolist()]
+      cluster.cache_rss = float(cluster_rss[c_iter])
+      cluster.set_matrix(matrix, members, self.spherical)
+      self.clusters.append(cluster)
+
   @staticmethod
   def is_rss_similar(rss1, rss2, threshold=0.00001):
     return abs(rss2 - rss1) < threshold
@@ -135,17 +755,416 @@ class KMeansCluster:
     return out
 
 
+class MiniBatchKMeansCluster(KMeansCluster):
+  """
+  Mini-batch KMeans, the clusters are updated from a stream of batches
+
+  Each batch is assigned to the nearest centroids, then each centroid moves
+  towards the mean of its batch instances, by a per-centroid learning rate
+  of the batch instances it got over all the instances it got so far.
+
+  A centroid is kept as a scale times a vector, so that moving it only
+  touches the dimensions the batch instances have, thus a batch costs time
+  proportional to its non-zero values, and not to the dimensions.
+  The dimensions grow with the batches, for example with the vocabulary
+  of the indexed docs, or stay fixed with the batches hashed by a FeatureHasher.
+  """
+  DEFAULT_BATCH_SIZE = 100
+  # the vectors are rescaled once their scale gets out of these bounds
+  MIN_SCALE = 1e-9
+  MAX_SCALE = 1e9
+
+  def __init__(self, k=2, dimensions=DEFAULT_DIMENSIONS, spherical=False, init=DEFAULT_INIT, seed=0):
+    """
+
+    Parameters
+    ----------
+    seed : int
+      Seed of the initialization, if 0 the first instances are used in order
+
+    Attributes
+    ----------
+    counts : numpy.ndarray
+      Count of the instances each centroid got so far
+    initialized : int
+      Count of the centroids initialized so far, from the first batches
+    batch_rss : float
+      RSS of the last batch, by the distances of its assignment
+    """
+    super().__init__(k, dimensions=dimensions, backend=BACKEND_NUMPY, spherical=spherical, init=init)
+    self.seed = seed
+    self.reset()
+
+  def reset(self):
+    """Drop the centroids, to start over a new stream"""
+    self.random.seed(self.seed)
+    self.vectors = np.zeros((self.k, max(self.dimensions, 1)))
+    self.scales = np.ones(self.k)
+    self.vectors_sq = np.zeros(self.k)
+    self.counts = np.zeros(self.k, dtype=np.int64)
+    self.initialized = 0
+    self.batches = 0
+    self.batch_rss = 0.0
+    self.clusters = []
+
+  def reserve(self, dimensions):
+    """Grow the centroids to the given dimensions, the new dimensions are 0"""
+    capacity = self.vectors.shape[1]
+    if dimensions > capacity:
+      # grown geometrically, to copy the centroids a few times over a stream
+      vectors = np.zeros((self.k, max(dimensions, 2 * capacity)))
+      vectors[:, :capacity] = self.vectors
+      self.vectors = vectors
+    self.dimensions = max(self.dimensions, dimensions)
+
+  def prepare_batch(self, batch):
+    """Get the batch as a sparse matrix, normalized for the spherical KMeans"""
+    if isinstance(batch, SparseMatrix):
+      matrix = batch
+    elif isinstance(batch, np.ndarray):
+      matrix = SparseMatrix.from_dense(batch)
+    else:
+      matrix = SparseMatrix.from_dense(KMeansCluster.get_matrix(batch))
+
+    if self.spherical:
+      matrix = matrix.normalize_rows()
+
+    self.reserve(matrix.shape[1])
+    return matrix
+
+  def init_batch_centroids(self, matrix):
+    """Initialize the centroids without an instance yet from the batch rows"""
+    rows = self.get_init_rows(matrix, matrix.get_row_norms_squared(), self.seed)
+    for row in rows[:self.k - self.initialized]:
+      c_iter = self.initialized
+      indices, data = matrix.get_row(row)
+      self.vectors[c_iter] = 0
+      self.vectors[c_iter, indices] = data
+      self.scales[c_iter] = 1
+      self.vectors_sq[c_iter] = float(data.dot(data))
+      self.initialized += 1
+
+  def get_batch_dists(self, matrix):
+    """Distance of each batch row to each initialized centroid
+
+    Returns
+    -------
+    numpy.ndarray
+      (rows x initialized) array, of the squared euclidean distances,
+      or of the cosine distances for the spherical KMeans
+    """
+    scales = self.scales[:self.initialized]
+    products = matrix.dot(self.vectors[:self.initialized].T) * scales
+    if self.spherical:
+      return 1 - products
+
+    dists = matrix.get_row_norms_squared()[:, None] - 2 * products
+    dists += (scales * scales * self.vectors_sq[:self.initialized])[None, :]
+    return np.maximum(dists, 0)
+
+  def partial_fit(self, batch):
+    """Update the clusters from a batch of instances
+
+    Parameters
+    ----------
+    batch : list of Instance or numpy.ndarray or SparseMatrix
+      The batch instances, a matrix holds an instance per row
+
+    Returns
+    -------
+    numpy.ndarray
+      The cluster each batch instance got assigned to
+    """
+    matrix = self.prepare_batch(batch)
+    if len(matrix) == 0:
+      return np.zeros(0, dtype=np.int64)
+
+    if self.initialized < self.k:
+      self.init_batch_centroids(matrix)
+
+    dists = self.get_batch_dists(matrix)
+    labels = np.argmin(dists, axis=1)
+    assigned = dists[np.arange(len(labels)), labels]
+    self.batch_rss = float((assigned if self.spherical else np.sqrt(assigned)).sum())
+
+    self.update_centroids(matrix, labels)
+    self.batches += 1
+    logging.info(f"[KMEANS][MINI-BATCH: {self.batches}][INSTANCES: {len(matrix)}][RSS: {round(self.batch_rss,2)}]")
+    return labels
+
+  def update_centroids(self, matrix, labels):
+    """Move each centroid towards the mean of its batch instances"""
+    batch_counts = np.bincount(labels, minlength=self.k)
+    moved = np.flatnonzero(batch_counts)
+    self.counts[moved] += batch_counts[moved]
+
+    # centroid = (1 - rate) * centroid + rate * batch mean
+    #          = (1 - rate) * centroid + batch sum / count
+    kept = 1 - batch_counts[moved] / self.counts[moved]
+    # the first instances of a centroid replace it
+    replaced = moved[kept == 0]
+    self.vectors[replaced] = 0
+    self.vectors_sq[replaced] = 0
+    self.scales[replaced] = 1
+    self.scales[moved[kept > 0]] *= kept[kept > 0]
+
+    # add the batch sums at the touched dimensions only
+    capacity = self.vectors.shape[1]
+    flat = labels[matrix.get_row_ids()].astype(np.int64) * capacity + matrix.indices
+    touched, inverse = np.unique(flat, return_inverse=True)
+    sums = np.bincount(inverse, weights=matrix.data)
+    clusters, columns = np.divmod(touched, capacity)
+
+    old = self.vectors[clusters, columns]
+    new = old + sums / (self.counts[clusters] * self.scales[clusters])
+    self.vectors[clusters, columns] = new
+    self.vectors_sq += np.bincount(clusters, weights=new * new - old * old, minlength=self.k)
+
+    if self.spherical:
+      norms = self.scales[moved] * np.sqrt(np.maximum(self.vectors_sq[moved], 0))
+      norms[norms == 0] = 1
+      self.scales[moved] /= norms
+
+    scales = self.scales[moved]
+    for c_iter in moved[(scales < self.MIN_SCALE) | (scales > self.MAX_SCALE)].tolist():
+      self.vectors[c_iter] *= self.scales[c_iter]
+      self.vectors_sq[c_iter] = float(self.vectors[c_iter].dot(self.vectors[c_iter]))
+      self.scales[c_iter] = 1
+
+  def get_centroids(self):
+    """Get the centroids as a dense (clusters x dimensions) array"""
+    return self.scales[:, None] * self.vectors[:, :self.dimensions]
+
+  def predict(self, batch):
+    """Get the nearest cluster of each of the batch instances, without updating the clusters"""
+    if self.initialized == 0:
+      raise ValueError("The clusters are not fitted yet")
+    return np.argmin(self.get_batch_dists(self.prepare_batch(batch)), axis=1)
+
+  def train(self, instances, seed=0, items=None, batch_size=DEFAULT_BATCH_SIZE, epochs=1):
+    """Stream the instances by batches, then set the clusters as KMeansCluster.train() does
+
+    Parameters
+    ----------
+    seed : int
+      if 0, the batches are streamed in order, otherwise they are shuffled
+    """
+    self.seed = seed
+    self.reset()
+
+    matrix, items = self.prepare_matrix(instances, items)
+    if not isinstance(matrix, SparseMatrix):
+      matrix = SparseMatrix.from_dense(matrix)
+
+    rows = list(range(len(matrix)))
+    for epoch in range(epochs):
+      if seed != 0:
+        self.random.shuffle(rows)
+      for start in range(0, len(rows), batch_size):
+        self.partial_fit(matrix.take_rows(rows[start:start + batch_size]))
+
+    dists = self.get_batch_dists(matrix)
+    labels = np.argmin(dists, axis=1)
+    assigned = dists[np.arange(len(labels)), labels]
+    if not self.spherical:
+      assigned = np.sqrt(assigned)
+    cluster_rss = np.bincount(labels, weights=assigned, minlength=self.k)
+
+    self.set_clusters_state(items, matrix, labels, self.get_centroids(), cluster_rss)
+    logging.info(f"\n[KMEANS][FINAL-CLUSTERING]\n{self}")
+
+class HamerlyKMeansCluster(KMeansCluster):
+  """
+  KMeans accelerated by the triangle inequality (Hamerly's algorithm)
+
+  Gives the clustering of KMeansCluster, while skipping most of the
+  instance-centroid distances after the first iterations. Each instance keeps
+  an upper bound of the distance to its centroid, and a lower bound of the
+  distance to any other centroid. An instance can not change its cluster if
+  its upper bound is below both its lower bound and half the distance of its
+  centroid to the nearest other centroid, thus its distances are skipped.
+
+  The bounds are loosened by the centroid moves after each iteration, only
+  the instances failing the test get their upper bound tightened to the exact
+  distance, then get tested again before computing all their distances.
+
+  The exact RSS of each iteration takes a distance per instance, thus it is
+  only computed if a tol or an abandon callback needs it, otherwise the
+  training stops once no instance gets reassigned, or at max_iter.
+  Only the euclidean distance is supported.
+  """
+  def __init__(self, k=2, dimensions=DEFAULT_DIMENSIONS, init=DEFAULT_INIT, max_iter=None, tol=None):
+    """
+
+    Attributes
+    ----------
+    distances_evaluated : int
+      Count of the instance-centroid distances computed by the last training
+    distances_skipped : int
+      Count of the distances KMeansCluster computes over the same iterations,
+      minus distances_evaluated, negative if the bounds did not pay off
+    """
+    super().__init__(k, dimensions=dimensions, backend=BACKEND_NUMPY, init=init, max_iter=max_iter, tol=tol)
+    self.distances_evaluated = 0
+    self.distances_skipped = 0
+
+  @staticmethod
+  def get_rows(matrix, rows):
+    if isinstance(matrix, SparseMatrix):
+      return matrix.take_rows(rows)
+    return matrix[rows]
+
+  @staticmethod
+  def get_dists(matrix, matrix_sq, centroids, rows):
+    """Euclidean distance of each of the given rows to every centroid"""
+    sub = HamerlyKMeansCluster.get_rows(matrix, rows)
+    return np.sqrt(KMeansCluster.get_dists_squared(sub, matrix_sq[rows], centroids))
+
+  @staticmethod
+  def get_two_nearest(dists):
+    """Get the (labels, nearest, second nearest) distances of each row of dists"""
+    labels = np.argmin(dists, axis=1)
+    rows = np.arange(len(dists))
+    nearest = dists[rows, labels]
+    if dists.shape[1] < 2:
+      return labels, nearest, np.full(len(dists), math.inf)
+
+    others = dists.copy()
+    others[rows, labels] = math.inf
+    return labels, nearest, others.min(axis=1)
+
+  def fit(self, matrix, seed=0, abandon=None):
+    """Run the bounded training over a prepared matrix, check KMeansCluster.fit()"""
+    self.random.seed(seed)
+    n = len(matrix)
+    all_rows = np.arange(n)
+    is_rss_needed = self.tol is not None or abandon is not None
+
+    if isinstance(matrix, SparseMatrix):
+      matrix_sq = matrix.get_row_norms_squared()
+    else:
+      matrix_sq = (matrix * matrix).sum(axis=1)
+
+    # Step 1: Create k clusters with an initial instance each
+    centroids = self.init_centroids(matrix, matrix_sq, seed)
+
+    self.distances_evaluated = 0
+    upper = np.full(n, math.inf)
+    lower = np.zeros(n)
+    labels = np.zeros(n, dtype=np.int64)
+
+    # Step 2: Calculate the RSS
+    rss_old = math.inf
+    labels_old = None
+    self.iterations = 0
+    while (True):
+      self.iterations += 1
+      # Step 3: While() -> Re-assign the instances that may change their cluster
+      if self.k > 1:
+        centroid_dists = np.sqrt(KMeansCluster.get_dists_squared(centroids, (centroids * centroids).sum(axis=1), centroids))
+        np.fill_diagonal(centroid_dists, math.inf)
+        half_nearest = centroid_dists.min(axis=1) / 2
+      else:
+        half_nearest = np.full(self.k, math.inf)
+
+      bounds = np.maximum(half_nearest[labels], lower)
+      candidates = all_rows[upper > bounds]
+
+      # tighten the upper bounds of the instances failing the test, then test them again
+      tightened = candidates[np.isfinite(upper[candidates])]
+      if len(tightened) > 0:
+        sub = HamerlyKMeansCluster.get_rows(matrix, tightened)
+        upper[tightened] = KMeansCluster.get_assigned_dists(sub, matrix_sq[tightened], centroids, labels[tightened])
+        self.distances_evaluated += len(tightened)
+        candidates = candidates[upper[candidates] > bounds[candidates]]
+
+      if len(candidates) > 0:
+        dists = HamerlyKMeansCluster.get_dists(matrix, matrix_sq, centroids, candidates)
+        labels = labels.copy()
+        labels[candidates], upper[candidates], lower[candidates] = HamerlyKMeansCluster.get_two_nearest(dists)
+        self.distances_evaluated += len(candidates) * self.k
+
+      if is_rss_needed:
+        # the RSS of the current centroids, which tightens all the upper bounds
+        upper = KMeansCluster.get_assigned_dists(matrix, matrix_sq, centroids, labels)
+        self.distances_evaluated += n
+        cluster_rss = np.bincount(labels, weights=upper, minlength=self.k)
+
+      # no instance got reassigned, the centroids and the RSS would not change
+      if labels_old is not None and np.array_equal(labels, labels_old):
+        self.stop_reason = STOP_NO_REASSIGNMENT
+        break
+      labels_old = labels
+
+      # Step 4: While() -> Adjust the centroid
+      # clusters without instances keep their centroid
+      counts = np.bincount(labels, minlength=self.k)
+      sums = KMeansCluster.get_grouped_sums(matrix, labels, self.k)
+      assigned = counts > 0
+      previous = centroids.copy()
+      centroids[assigned] = sums[assigned] / counts[assigned, None]
+
+      # the distance to the own centroid grows at most by its move,
+      # the distance to any other centroid shrinks at most by the farthest move of the others
+      moves = np.sqrt(((centroids - previous) ** 2).sum(axis=1))
+      upper = upper + moves[labels]
+      farthest = np.argmax(moves)
+      others_move = np.full(n, moves[farthest])
+      if self.k > 1:
+        others_move[labels == farthest] = np.partition(moves, -2)[-2]
+      lower = np.maximum(lower - others_move, 0)
+
+      if not is_rss_needed:
+        if self.max_iter is not None and self.iterations >= self.max_iter:
+          self.stop_reason = STOP_MAX_ITER
+          break
+        continue
+
+      # Step 5: Once RSS converges break the while()
+      rss_new = KMeansCluster.get_total_rss(cluster_rss, self.k)
+
+      logging.info(f"[KMEANS][RSS: ({round(rss_old,2)} -> {round(rss_new,2)}][DIFF: {abs(rss_new-rss_old)}]")
+      self.stop_reason = self.get_stop_reason(rss_old, rss_new)
+      if self.stop_reason is not None:
+        break
+
+      if abandon is not None and abandon(rss_new):
+        logging.info(f"[KMEANS][ABANDONED][RSS: {round(rss_new,2)}]")
+        return None
+
+      rss_old = rss_new
+
+    # the exact RSS of the final centroids, computed once
+    dists = KMeansCluster.get_assigned_dists(matrix, matrix_sq, centroids, labels)
+    self.distances_evaluated += n
+    cluster_rss = np.bincount(labels, weights=dists, minlength=self.k)
+
+    # KMeansCluster computes every distance on each iteration, then the final RSS
+    self.distances_skipped = self.iterations * n * self.k + n - self.distances_evaluated
+    logging.info(f"[KMEANS][DISTANCES][EVALUATED: {self.distances_evaluated}][SKIPPED: {self.distances_skipped}]")
+    return labels, centroids, cluster_rss
+
 class Cluster:
 
   # Maximum visualized instances
   MAX_INSTANCES = 2
 
-  def __init__(self, instances=None, dimensions=DEFAULT_DIMENSIONS, label=""):
+  def __init__(self, instances=None, dimensions=DEFAULT_DIMENSIONS, label="", centroid=None):
     self.instances = [] if instances is None else instances
+    # running sum and count of the instances, kept by add_instance() and remove_instance()
+    self.sum = None
+    self.count = 0
+    # set by the vectorized backends, the rows of the members in a shared matrix
+    self.matrix = None
+    self.members = None
+    self.spherical = False
     # set self.cache_centroid
     self.dimensions = dimensions
     self.label = label # an identifier, useful for debugging
-    self.UpdateCentroid(init=True)
+    if centroid is None:
+      self.UpdateCentroid(init=True)
+    else:
+      self.cache_centroid = centroid
     # set self.cache_rss
     self.cache_rss = None
     self.UpdateRSS()
@@ -168,15 +1187,43 @@ class Cluster:
 
   def UpdateRSS(self):
     logging.debug(f"[KMeans][RSS-UPDATE][CLUSTER: {self.label}]")
+    if self.is_matrix_set():
+      self.cache_rss = float(self.get_member_dists().sum())
+      logging.debug(f"[KMeans][RSS-UPDATE][{self.cache_rss}]")
+      return
+
     sum = 0
     for inst in self.instances:
       sum += inst.get_dist(self.cache_centroid)
     self.cache_rss = sum
     logging.debug(f"[KMeans][RSS-UPDATE][{self.cache_rss}]")
 
+  def clear_instances(self):
+    """Drop the instances, keeping the centroid, and start the running sum"""
+    self.instances = []
+    self.sum = Instance(self.dimensions)
+    self.count = 0
+
+  def add_instance(self, instance):
+    """Account for an instance in the running sum, without appending it to the instances"""
+    self.sum += instance
+    self.count += 1
+
+  def remove_instance(self, instance):
+    """Drop an instance from the running sum, without removing it from the instances"""
+    self.sum -= instance
+    self.count -= 1
+
   def UpdateCentroid(self, init=False):
     logging.debug(f"[KMEANS][CENTROID-UPDATE][CLUSTER: {self.label}][{len(self.instances)} INSTANCES]")
-    if len(self.instances) > 0:
+    if self.sum is not None:
+      # kept as the instances moved, no need to sum the instances again
+      if self.count > 0:
+        self.cache_centroid = self.sum/self.count
+      elif init:
+        self.cache_centroid = Instance(self.dimensions, generate_random=True)
+
+    elif len(self.instances) > 0:
       sum = Instance(self.dimensions)
       for inst in self.instances:
         sum += inst
@@ -200,66 +1247,151 @@ class Cluster:
     instances_str = [f"{i}" for i in instances]
     return f"{instances_str}" if len(self.instances) <= self.MAX_INSTANCES else f"{str(instances_str)[:-1]},...]"
 
+  def set_matrix(self, matrix, members, spherical=False):
+    """Set the shared matrix the cluster instances are rows of
+
+    Parameters
+    ----------
+    matrix : numpy.ndarray or SparseMatrix
+      (instances x dimensions) matrix
+    members : numpy.ndarray
+      row of each of the cluster instances, in the same order
+    spherical : bool
+      the distances are cosine distances
+    """
+    self.matrix = matrix
+    self.members = members
+    self.spherical = spherical
+
+  def is_matrix_set(self):
+    # the instances could get reassigned after the matrix got set
+    return self.matrix is not None and len(self.members) == len(self.instances)
+
+  def get_member_dists(self):
+    """Distance of each of the instances to the centroid, through the shared matrix"""
+    centroid = self.cache_centroid.array
+
+    if isinstance(self.matrix, SparseMatrix):
+      rows = self.matrix.take_rows(self.members)
+      products = rows.dot(centroid)
+      if self.spherical:
+        return 1 - products
+      dists_sq = rows.get_row_norms_squared() - 2 * products + centroid.dot(centroid)
+      return np.sqrt(np.maximum(dists_sq, 0))
+
+    rows = self.matrix[self.members]
+    if self.spherical:
+      return 1 - rows @ centroid
+    return np.sqrt(((rows - centroid) ** 2).sum(axis=1))
+
   def get_instances_ordered_by_dist(self):
+    if self.is_matrix_set():
+      dists = self.get_member_dists()
+      return [self.instances[i] for i in np.argsort(dists, kind="stable").tolist()]
+
     # no need for capturing the sqrt, the squared_dist is sufficient
     # even a sum of absolute differences could be sufficient too
     return sorted(self.instances, key=lambda x: x.get_dist_squared(self.cache_centroid))
 
 class Instance():
+  """A point of the clustered space
+
+  The values are kept in a float array, which could be a view into a row
+  of a shared matrix, or the array of the caller, to not copy the instances
+  of a matrix. Such an array is only read, it gets copied on the first
+  in-place update.
+
+  Attributes
+  ----------
+  array : numpy.ndarray
+    The values of the instance
+  data : object
+    Used for connecting the algorithm to other problems
+    for example it would store the Doc for this project
+  """
+  __slots__ = ("array", "data", "_owned")
+
   MAX_DIMENSION_VIS = 10
 
   def __init__(self, dimensions=DEFAULT_DIMENSIONS, values=None, generate_random=False, data=None):
-    # override the dimensions param with the shape if a value if given
-    self.dimensions = dimensions if (values is None) else len(values)
-
+    # the dimensions param is overridden by the shape if values are given
     self.set_values(dimensions, values, generate_random)
-
-    # Used for connecting the algorithm to other problems
-    # for example it would store the Doc for this project
     self.data = data
 
   def set_values(self, dimensions, values, generate_random):
     if values is None:
-      self.values = []
       if generate_random:
-        for d in range(self.dimensions):
-          self.values.append(random.randrange(0, 100))
+        self.array = np.array([random.randrange(0, 100) for d in range(dimensions)], dtype=float)
       else:
-        for d in range(dimensions):
-          self.values.append(0)
+        self.array = np.zeros(dimensions)
+      self._owned = True
     else:
-      self.values = values
+      # no copy for a float array, for example a matrix row
+      self.array = np.asarray(values, dtype=float)
+      self._owned = False
+
+  @staticmethod
+  def from_own_array(array):
+    """Wrap a newly allocated array, that the instance may update in place"""
+    instance = Instance(values=array)
+    instance._owned = True
+    return instance
+
+  @property
+  def dimensions(self):
+    return len(self.array)
+
+  @property
+  def values(self):
+    """A copy of the values as a list, the array is preferred for computations
+
+    Writing into the list leaves the instance as it is,
+    assign the values instead.
+    """
+    return self.array.tolist()
+
+  @values.setter
+  def values(self, values):
+    self.array = np.asarray(values, dtype=float)
+    self._owned = False
+
+  @staticmethod
+  def get_other_array(other):
+    if isinstance(other, Instance):
+      return other.array
+    elif isinstance(other, (int, float)):
+      return other
+    print(f"Given type is {type(other)}")
+    raise TypeError
+
+  def get_own_array(self):
+    """Get the array for an in-place update, copying it first if it is not owned"""
+    if not self._owned:
+      self.array = self.array.copy()
+      self._owned = True
+    return self.array
 
   def __add__(self, other):
-    values = []
-    for dim in range(self.dimensions):
-      if isinstance(other, int) or isinstance(other, float):
-        val = self.values[dim] + other
-      elif isinstance(other, Instance):
-        val = self.values[dim] + other.values[dim]
-      else:
-        print(f"Given type is {type(other)}")
-        raise TypeError
-      values.append(val)
+    return Instance.from_own_array(self.array + Instance.get_other_array(other))
 
-    return Instance(self.dimensions, values)
+  def __sub__(self, other):
+    return Instance.from_own_array(self.array - Instance.get_other_array(other))
 
   def __truediv__(self, other):
-    values = []
-    for dim in range(self.dimensions):
-      if isinstance(other, int):
-        val = self.values[dim] / other
-      elif isinstance(other, Instance):
-        val = self.values[dim] / other.values[dim]
-      values.append(val)
+    return Instance.from_own_array(self.array / Instance.get_other_array(other))
 
-    return Instance(self.dimensions, values)
+  def __iadd__(self, other):
+    array = self.get_own_array()
+    array += Instance.get_other_array(other)
+    return self
+
+  def __isub__(self, other):
+    array = self.get_own_array()
+    array -= Instance.get_other_array(other)
+    return self
 
   def __eq__(self, other):
-    for dim in range(self.dimensions):
-      if self.values[dim] != other.values[dim]:
-        return False
-    return True
+    return np.array_equal(self.array, other.array)
 
   def __str__(self):
     if self.dimensions > self.MAX_DIMENSION_VIS:
@@ -269,21 +1401,8 @@ class Instance():
       return f"{rounded_values}"
 
   def get_dist_squared(self, other):
-    distsquared = 0
-    for dim in range(self.dimensions):
-      distsquared += (self.values[dim] - other.values[dim])**2
-
-    return distsquared
+    diff = self.array - other.array
+    return float(diff.dot(diff))
 
   def get_dist(self, other):
-    distsquared = 0
-    for dim in range(self.dimensions):
-      distsquared += (self.values[dim] - other.values[dim])**2
-
-    # if (distsquared == 0):
-    #   print(self.values)
-    #   print(other.values)
-    #   print(f"squared_dist: {distsquared}")
-    #   print(f"dist: {math.sqrt(distsquared)}")
-
-    return math.sqrt(distsquared)
+    return math.sqrt(self.get_dist_squared(other))
@@ -229,7 +229,8 @@ class LinkedList():
         if (unique == False):
           newnode = prev_node.inject(othernode)
           self.count = self.count + 1
-        return newnode
+          return newnode
+        return node
 
   def has(self, othernode):
     """
@@ -0,0 +1,100 @@
+import heapq
+import sys
+
+from tut_py_irtx.LinkedList import *
+from tut_py_irtx.Posting import *
+
+# Size of each unit object, measured once per type on a sample
+_unit_sizes = {}
+
+def get_object_size(obj):
+  """Shallow size of an object along with its attributes dict, in bytes"""
+  size = sys.getsizeof(obj)
+  attributes = getattr(obj, "__dict__", None)
+  if attributes is not None:
+    size += sys.getsizeof(attributes)
+  return size
+
+def get_unit_size(name, create):
+  """Size of a sample object, measured on the first call
+
+  Parameters
+  ----------
+  name : str
+    Key of the unit, for example "node"
+  create : function
+    Creates the sample object
+  """
+  size = _unit_sizes.get(name)
+  if size is None:
+    size = _unit_sizes[name] = get_object_size(create())
+  return size
+
+def get_node_size():
+  return get_unit_size("node", lambda: Node(None))
+
+def get_posting_size():
+  return get_unit_size("posting", lambda: Posting("0"))
+
+def get_dict_size(index):
+  """Size of a dict table along with its str keys, the values are not included"""
+  return sys.getsizeof(index) + sum(sys.getsizeof(key) for key in index)
+
+class MemoryReport():
+  """Estimated memory of an index, broken down by component
+
+  The sizes are estimated from the kept counts times the measured size of
+  each unit object, for example the postings count times the size of a
+  linked list node and a Posting, thus no linked list gets walked.
+  Objects shared with other components, such as the doc ids referred to
+  by the postings, are accounted once, by their owner.
+
+  Attributes
+  ----------
+  name : str
+    Name of the reported index
+  entries : int
+    Count of the index entries, for example the terms
+  components : dict
+    component -> estimated bytes
+  largest : list of tuple
+    (key, count, bytes) of the largest entries, in descending order
+  """
+
+  def __init__(self, name, entries=0):
+    self.name = name
+    self.entries = entries
+    self.components = {}
+    self.largest = []
+
+  def add(self, component, size):
+    self.components[component] = self.components.get(component, 0) + int(size)
+
+  @property
+  def total(self):
+    return sum(self.components.values())
+
+  @staticmethod
+  def get_largest(items, n, key):
+    """The n largest of the items, without sorting all of them"""
+    return heapq.nlargest(n, items, key=key) if n > 0 else []
+
+  def to_dict(self):
+    return {
+      "name": self.name,
+      "entries": self.entries,
+      "total": self.total,
+      "components": dict(self.components),
+      "largest": [list(entry) for entry in self.largest],
+    }
+
+  def __str__(self):
+    out = f"{self.name}: {self.entries} entries, {self.total / 1024:.1f} KB\n"
+    for component, size in sorted(self.components.items(), key=lambda item: item[1], reverse=True):
+      share = 100 * size / self.total if self.total > 0 else 0
+      out += f"  {component:12} {size / 1024:12.1f} KB {share:6.2f}%\n"
+    if len(self.largest) > 0:
+      out += "  largest:\n"
+      for key, count, size in self.largest:
+        out += f"    {str(key):20} {count:8} {size / 1024:10.1f} KB\n"
+    return out
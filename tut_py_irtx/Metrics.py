@@ -0,0 +1,189 @@
+import bisect
+import contextlib
+import time
+
+# Stages of the hot paths, each gets a timer
+STAGE_TOKENIZE = "tokenize"
+STAGE_MERGE = "merge"
+STAGE_SORT = "sort"
+STAGE_INTERSECT = "intersect"
+STAGE_SCORE = "score"
+STAGE_EXPAND = "expand"
+
+# Upper bounds of the latency buckets, in seconds
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10)
+
+# Returned by Metrics.timer() while disabled, shared as it keeps no state
+NULL_TIMER = contextlib.nullcontext()
+
+class Histogram():
+  """Counts of the observed values per bucket, along with their sum
+
+  Attributes
+  ----------
+  buckets : tuple of float
+    Sorted upper bounds of the buckets, the values above the last bound
+    are only counted in the total count
+  counts : list of int
+    Count of the values of each bucket, not cumulative
+  """
+  __slots__ = ("buckets", "counts", "sum", "count")
+
+  def __init__(self, buckets=DEFAULT_BUCKETS):
+    self.buckets = tuple(buckets)
+    self.counts = [0] * (len(self.buckets) + 1)
+    self.sum = 0.0
+    self.count = 0
+
+  def observe(self, value):
+    self.counts[bisect.bisect_left(self.buckets, value)] += 1
+    self.sum += value
+    self.count += 1
+
+  def get_cumulative_counts(self):
+    """Count of the values under or at each bucket bound, the last one is for +Inf"""
+    cumulative = []
+    total = 0
+    for count in self.counts:
+      total += count
+      cumulative.append(total)
+    return cumulative
+
+  def to_dict(self):
+    bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+    return {
+      "count": self.count,
+      "sum": self.sum,
+      "buckets": dict(zip(bounds, self.get_cumulative_counts())),
+    }
+
+class Timer():
+  """Context manager observing the elapsed monotonic time into a histogram"""
+  __slots__ = ("histogram", "start")
+
+  def __init__(self, histogram):
+    self.histogram = histogram
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc):
+    self.histogram.observe(time.perf_counter() - self.start)
+    return False
+
+class Metrics():
+  """Registry of the counters, the histograms and the stage timers
+
+  Disabled by default, a disabled registry records nothing, its timer()
+  returns a shared no-op context, thus an instrumented hot path only pays
+  for an attribute check or a call per stage.
+
+  Examples
+  --------
+  >>> METRICS.enable()
+  >>> with METRICS.timer(STAGE_MERGE):
+  ...   METRICS.increment("new_terms", 3)
+  >>> print(METRICS.to_prometheus())
+  """
+
+  def __init__(self, enabled=False, buckets=DEFAULT_BUCKETS):
+    self.enabled = enabled
+    self.buckets = buckets
+    self.reset()
+
+  def reset(self):
+    self.counters = {}
+    self.histograms = {}
+    # stage -> histogram of its durations
+    self.timers = {}
+
+  def enable(self):
+    self.enabled = True
+
+  def disable(self):
+    self.enabled = False
+
+  def increment(self, name, value=1):
+    if self.enabled:
+      self.counters[name] = self.counters.get(name, 0) + value
+
+  def observe(self, name, value):
+    if self.enabled:
+      histogram = self.histograms.get(name)
+      if histogram is None:
+        histogram = self.histograms[name] = Histogram(self.buckets)
+      histogram.observe(value)
+
+  def timer(self, stage):
+    """Time the enclosed block of the given stage
+
+    Returns
+    -------
+    context manager
+    """
+    if not self.enabled:
+      return NULL_TIMER
+
+    histogram = self.timers.get(stage)
+    if histogram is None:
+      histogram = self.timers[stage] = Histogram(self.buckets)
+    return Timer(histogram)
+
+  def get_seconds(self, stage):
+    """Total time spent in the stage"""
+    histogram = self.timers.get(stage)
+    return 0.0 if histogram is None else histogram.sum
+
+  def to_dict(self):
+    return {
+      "counters": dict(self.counters),
+      "histograms": {name: histogram.to_dict() for name, histogram in self.histograms.items()},
+      "timers": {stage: histogram.to_dict() for stage, histogram in self.timers.items()},
+    }
+
+  @staticmethod
+  def format_histogram(name, histogram, labels=""):
+    """Format the histogram samples in the Prometheus text format"""
+    separator = "," if labels else ""
+    bounds = [str(bound) for bound in histogram.buckets] + ["+Inf"]
+    lines = []
+    for bound, count in zip(bounds, histogram.get_cumulative_counts()):
+      lines.append(f'{name}_bucket{{{labels}{separator}le="{bound}"}} {count}')
+    labels = f"{{{labels}}}" if labels else ""
+    lines.append(f"{name}_sum{labels} {histogram.sum}")
+    lines.append(f"{name}_count{labels} {histogram.count}")
+    return lines
+
+  def to_prometheus(self, prefix="irtx"):
+    """Export the metrics in the Prometheus text exposition format
+
+    The counters are suffixed by _total, the stage timers are exported
+    as a single stage_seconds histogram, labeled by the stage.
+
+    Returns
+    -------
+    str
+    """
+    lines = []
+    for name, value in sorted(self.counters.items()):
+      lines.append(f"# TYPE {prefix}_{name}_total counter")
+      lines.append(f"{prefix}_{name}_total {value}")
+
+    for name, histogram in sorted(self.histograms.items()):
+      lines.append(f"# TYPE {prefix}_{name} histogram")
+      lines.extend(Metrics.format_histogram(f"{prefix}_{name}", histogram))
+
+    if len(self.timers) > 0:
+      lines.append(f"# TYPE {prefix}_stage_seconds histogram")
+      for stage, histogram in sorted(self.timers.items()):
+        lines.extend(Metrics.format_histogram(f"{prefix}_stage_seconds", histogram, f'stage="{stage}"'))
+
+    return "\n".join(lines) + "\n" if lines else ""
+
+  def __str__(self):
+    state = "enabled" if self.enabled else "disabled"
+    return f"metrics ({state}): {len(self.counters)} counters, {len(self.histograms)} histograms, {len(self.timers)} timers"
+
+# The registry the hot paths report to
+METRICS = Metrics()
@@ -0,0 +1,173 @@
+import logging
+
+import numpy as np
+
+from tut_py_irtx.PerceptronClassifier import *
+
+class MultiLabelPerceptronClassifier(PerceptronClassifier):
+  """One-vs-rest perceptron over any count of labels
+
+  A perceptron is trained per label, to tell the docs of the label from the
+  rest, all of them sharing the analyzed docs and a single feature index.
+  The weights are kept as a (term ids x labels) matrix, thus every label
+  of a doc is scored in a single product.
+
+  In the multi-class mode a doc gets the label of the highest margin,
+  in the multi-label mode a doc gets every label of a positive margin.
+  """
+  def __init__(self, instances=None, analyzer=None, store=None, epochs=1, averaged=False,
+               labels=None, multi_label=False, hasher=None, track_terms=False):
+    """
+
+    Parameters
+    ----------
+    instances : list of Doc
+      Labeled docs to train on, each could have multiple labels
+    labels : list
+      The labels to learn, defaults to the labels of the instances
+    multi_label : bool
+      Predict every label of a positive margin, instead of the single
+      label of the highest margin
+    hasher : FeatureHasher
+      Hash the terms into a fixed feature space, check PerceptronClassifier
+    track_terms : bool
+      Keep the hashed terms seen while training, for debugging only
+
+    Attributes
+    ----------
+    weights : dict
+      label -> (text -> weight) of each feature, synced after each training
+    weight_vector : numpy.ndarray
+      (columns x labels) weights, only meaningful for the features
+    """
+    super().__init__(instances, analyzer=analyzer, store=store, epochs=epochs, averaged=averaged, hasher=hasher,
+                     track_terms=track_terms)
+    if labels is None:
+      labels = {label for instance in self.instances if isinstance(instance.labels, list) for label in instance.labels}
+    self.labels = sorted(labels)
+    self.label_ids = {label: i for i, label in enumerate(self.labels)}
+    self.multi_label = multi_label
+    self.weights = {label: {} for label in self.labels}
+    self.weight_vector = np.zeros((0, len(self.labels)))
+    self.is_feature = np.zeros(0, dtype=bool)
+    if hasher is not None:
+      self.reserve(hasher.width)
+
+  def __str__(self):
+    return f"{len(self.instances)}-{len(self.feature_ids)}-{len(self.labels)}"
+
+  def sync_weights(self, term_ids=None):
+    if self.hasher is not None:
+      for text, (column, sign) in self.hashed_terms.items():
+        for label, weight in zip(self.labels, self.weight_vector[column].tolist()):
+          self.weights[label][text] = sign * weight
+      return
+
+    term_ids = self.feature_ids if term_ids is None else term_ids
+    terms = self.store.terms
+    for term_id, weights in zip(term_ids, self.weight_vector[term_ids].tolist()):
+      for label, weight in zip(self.labels, weights):
+        self.weights[label][terms[term_id]] = weight
+
+  def get_target_matrix(self, instances):
+    """Get the +1/-1 target of each instance for each label
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+      (targets, valid), the targets matrix and whether each instance has valid labels
+    """
+    targets = -np.ones((len(instances), len(self.labels)), dtype=np.int64)
+    valid = np.ones(len(instances), dtype=bool)
+    for i, instance in enumerate(instances):
+      if not isinstance(instance.labels, list):
+        logging.error("instance labels were expected to be a list")
+        valid[i] = False
+        continue
+      for label in instance.labels:
+        # labels out of the learnt ones are ignored
+        if label in self.label_ids:
+          targets[i, self.label_ids[label]] = 1
+    return targets, valid
+
+  def train(self):
+    """Train the perceptrons of all the labels at once, check PerceptronClassifier.train()"""
+    matrix = self.get_feature_matrix(self.instances, train=True)
+    targets, valid = self.get_target_matrix(self.instances)
+    indptr, indices, data = matrix.indptr, matrix.indices, matrix.data
+
+    # features are initialized in order of their first appearance
+    for i in range(len(matrix)):
+      if valid[i]:
+        self.add_features(indices[indptr[i]:indptr[i+1]])
+
+    weights = self.weight_vector
+    if self.averaged:
+      updates_sum = np.zeros(weights.shape)
+      step = 1
+
+    for epoch in range(self.epochs):
+      mistakes = 0
+      for i in range(len(matrix)):
+        if not valid[i]:
+          continue
+
+        term_ids = indices[indptr[i]:indptr[i+1]]
+        counts = data[indptr[i]:indptr[i+1]]
+        predictions = np.where(counts.dot(weights[term_ids]) > 0, 1, -1)
+        wrong = np.flatnonzero(predictions != targets[i])
+        if len(wrong) > 0:
+          # only the perceptrons of the mispredicted labels are updated
+          cells = np.ix_(term_ids, wrong)
+          update = np.outer(counts, self.FACTOR * targets[i, wrong])
+          weights[cells] += update
+          if self.averaged:
+            updates_sum[cells] += step * update
+          mistakes += len(wrong)
+
+        if self.averaged:
+          step += 1
+
+      logging.info(f"[PERCEPTRON_CLASSIFIER][EPOCH: {epoch}][MISTAKES: {mistakes}]")
+
+    if self.averaged:
+      weights -= updates_sum / step
+
+    self.sync_weights()
+
+  def get_predicted_labels(self, margins):
+    """Get the sorted predicted labels out of the margins of a doc"""
+    if self.multi_label:
+      return [self.labels[j] for j in np.flatnonzero(margins > 0).tolist()]
+    if len(margins) == 0:
+      return []
+    return [self.labels[int(np.argmax(margins))]]
+
+  def predict_batch(self, docs):
+    """Predict the docs at once, through a single sparse matrix product
+
+    Returns
+    -------
+    tuple
+      (labels, margins), the sorted list of the predicted labels of each doc,
+      and the (docs x labels) array of the raw margins
+    """
+    matrix = self.get_feature_matrix(docs, grow=False)
+    margins = matrix.dot(self.weight_vector * self.is_feature[:, None])
+    return [self.get_predicted_labels(row) for row in margins], margins
+
+  def predict(self, instance, test=True):
+    labels, _ = self.predict_batch([instance])
+    return labels[0]
+
+  def assign_labels(self, in_insts):
+    labels, _ = self.predict_batch(in_insts)
+    for instance, predicted_labels in zip(in_insts, labels):
+      instance.predicted_labels.extend(predicted_labels)
+    return in_insts
+
+  def get_extreme_weights(self, n=10, order=1, label=None):
+    """Check PerceptronClassifier.get_extreme_weights(), for the weights of the given label"""
+    source = self.weights[label]
+    texts = sorted(source.keys(), key=lambda text: source[text], reverse=(order != 1))
+    return texts[:n+1] if n > 0 else texts
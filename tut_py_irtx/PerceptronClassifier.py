@@ -1,76 +1,365 @@
 import logging
 import random
+import zlib
+from multiprocessing import Pipe, Process
+
+import numpy as np
 
 from tut_py_irtx.util import *
 # from tut_py_irtx.Term import *
 from tut_py_irtx.Doc import *
+from tut_py_irtx.Analyzer import *
+from tut_py_irtx.DocStore import *
+from tut_py_irtx.SparseMatrix import *
+from tut_py_irtx.FeatureHasher import *
 
 class PerceptronClassifier():
   """A document is a representation of the structured form
      that the code retrieves info from"""
-  def __init__(self, instances=None):
+
+  # New observations affect to 70% w.r.t. the previous ones
+  # a factor of the learning rate
+  FACTOR = 0.7
+  # the initial weight of a feature is drawn from [-INIT_WEIGHT, INIT_WEIGHT]
+  INIT_WEIGHT = 0.3
+  # seconds a stopped worker is waited for, before being terminated
+  JOIN_TIMEOUT = 5.0
+
+  def __init__(self, instances=None, analyzer=None, store=None, epochs=1, averaged=False,
+               hasher=None, workers=1, track_terms=False):
+    """
+
+    Parameters
+    ----------
+    instances : list of Doc
+      Labeled docs to train on
+    analyzer : Analyzer
+      Analysis chain turning the docs into features,
+      should be shared with the indexers when the weights are compared
+      against the indexed terms, ignored if a store is given
+    store : DocStore
+      Store of the analyzed docs, pass the IndexController.store to reuse
+      the docs analyzed while indexing, a private store is created if None
+    epochs : int
+      Count of the passes over the instances per train()
+    averaged : bool
+      Train an averaged perceptron, the weights are averaged over
+      all the training steps, which generalizes better than the last weights
+    hasher : FeatureHasher
+      Hash the analyzed tokens into a fixed feature space, instead of a weight
+      per term id, the docs then bypass the store, and nothing is kept per term,
+      thus the memory stays bounded by the hasher width whatever the vocabulary size
+    workers : int
+      Count of the processes training over shards of the instances,
+      the feature space gets hashed, with a default FeatureHasher if None
+    track_terms : bool
+      Keep the column and sign of each hashed term seen while training,
+      to reflect their weights into the weights dict, for debugging only
+      as it grows with the vocabulary
+
+    Attributes
+    ----------
+    weights : dict
+      text -> weight of each feature, synced after each training,
+      empty when hashed unless the terms are tracked
+    weight_vector : numpy.ndarray
+      weight of each column, a term id of the store or a hashed column,
+      only meaningful for the features
+    feature_ids : list of int
+      columns of the features, the columns seen while training, in order of appearance
+    """
     self.instances = [] if instances is None else instances
+    self.store = DocStore(analyzer) if store is None else store
+    self.epochs = epochs
+    self.averaged = averaged
+    self.workers = workers
+    if hasher is None and workers > 1:
+      hasher = FeatureHasher()
+    self.hasher = hasher
     self.weights = {}
+    self.weight_vector = np.zeros(0)
+    self.is_feature = np.zeros(0, dtype=bool)
+    self.feature_ids = []
+    self.track_terms = track_terms
+    # text -> (column, sign) of the hashed terms seen while training, if tracked
+    self.hashed_terms = {}
+    if hasher is not None:
+      self.reserve(hasher.width)
+
+  @property
+  def analyzer(self):
+    return self.store.analyzer
+
+  def get_term_counts(self, instance, grow=True):
+    """Get the (text, count) pairs of the instance terms from the store"""
+    entry = self.store.get(instance, grow)
+    terms = self.store.terms
+    return [(terms[term_id], count) for term_id, count in zip(entry.term_ids.tolist(), entry.counts.tolist())]
 
   def __str__(self):
     return f"{len(self.instances)}-{(len(self.weights.keys()))}"
 
-  def train(self):
-    # update self.weights
+  def reserve(self, size):
+    """Grow the weight vector to cover the given count of term ids"""
+    capacity = len(self.weight_vector)
+    if size > capacity:
+      capacity = max(size, 2 * capacity)
+      # a weight vector could hold a row of weights per term id
+      weight_vector = np.zeros((capacity,) + self.weight_vector.shape[1:])
+      weight_vector[:len(self.weight_vector)] = self.weight_vector
+      is_feature = np.zeros(capacity, dtype=bool)
+      is_feature[:len(self.is_feature)] = self.is_feature
+      self.weight_vector = weight_vector
+      self.is_feature = is_feature
+
+  def add_features(self, term_ids):
+    """Turn the unseen term ids into features with a random initial weight
+
+    Returns
+    -------
+    numpy.ndarray
+      the newly added term ids
+    """
+    self.reserve(int(term_ids.max()) + 1 if len(term_ids) > 0 else 0)
+    new_ids = term_ids[~self.is_feature[term_ids]]
+    # hashed columns could repeat
+    _, first = np.unique(new_ids, return_index=True)
+    new_ids = new_ids[np.sort(first)]
+    if len(new_ids) > 0:
+      shape = (len(new_ids),) + self.weight_vector.shape[1:]
+      initial_weights = [random.uniform(-self.INIT_WEIGHT, self.INIT_WEIGHT) for _ in range(int(np.prod(shape)))]
+      self.weight_vector[new_ids] = np.reshape(initial_weights, shape)
+      self.is_feature[new_ids] = True
+      self.feature_ids.extend(new_ids.tolist())
+    return new_ids
 
-    # New observations affect to 70% w.r.t. the previous ones
-    # a factor of the learning rate
-    FACTOR = 0.7
+  def sync_weights(self, term_ids=None):
+    """Reflect the weight vector into the weights dict, for the given or all the features"""
+    if self.hasher is not None:
+      # each term gets the signed weight of its column
+      for text, (column, sign) in self.hashed_terms.items():
+        self.weights[text] = sign * float(self.weight_vector[column])
+      return
 
-    for instance in self.instances:
+    term_ids = self.feature_ids if term_ids is None else term_ids
+    terms = self.store.terms
+    for term_id, weight in zip(term_ids, self.weight_vector[term_ids].tolist()):
+      self.weights[terms[term_id]] = weight
+
+  def track_hashed_terms(self, term_counts):
+    """Register the column and sign of the hashed terms, check track_terms"""
+    for text in term_counts:
+      if text not in self.hashed_terms:
+        self.hashed_terms[text] = self.hasher.hash_signed_text(text)
+
+  def get_features(self, instance, grow=True, train=False):
+    """Get the feature columns and values of a doc
+
+    Parameters
+    ----------
+    grow : bool
+      Store the doc and grow the vocabulary, ignored if hashed
+    train : bool
+      Track the hashed terms, if enabled
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+      (columns, values), the term ids and counts if not hashed,
+      otherwise the hashed columns and signed counts of the analyzed tokens
+    """
+    if self.hasher is None:
+      entry = self.store.get(instance, grow)
+      return entry.term_ids, entry.counts
+
+    term_counts = self.analyzer.count_terms(instance.text)
+    if train and self.track_terms:
+      self.track_hashed_terms(term_counts)
+    return self.hasher.get_row(term_counts)
+
+  def get_feature_matrix(self, docs, grow=True, train=False):
+    """Get the sparse matrix of the docs over the feature space, a row per doc
+
+    The hashed docs are analyzed straight into their columns, as FeatureHasher.transform()
+    does, thus the unseen terms still land in their column.
+    """
+    if self.hasher is None:
+      dimensions = None if grow else len(self.weight_vector)
+      return self.store.get_matrix(docs, dimensions=dimensions, grow=grow)
+
+    rows = [self.get_features(doc, train=train) for doc in docs]
+    return SparseMatrix.from_rows(rows, self.hasher.width).sum_duplicates()
+
+  def get_label_vector(self, instances):
+    """Get the +1/-1 label of each instance, 0 for the instances without a valid one"""
+    labels = np.zeros(len(instances), dtype=np.int64)
+    for i, instance in enumerate(instances):
       if not isinstance(instance.labels, list) or \
          len(instance.labels) == 0 or \
          not isinstance(instance.labels[0], int):
         logging.error("instance labels[0] was expected to exist and be either -1 or +1")
+        continue
+      labels[i] = instance.labels[0]
+    return labels
+
+  def train(self):
+    """Train over the instances, encoded once into a sparse matrix of term counts
 
-      prediction = self.predict(instance, test=False)
-      # this line consumes a lot of time
-      # logging.debug(self.get_weights_slice(0))
-      if prediction == instance.labels[0]:
-        pass
-      else:
-        # update weights
-        terms = Doc.fetch_terms(instance)
-
-        weight_sum = sum([self.weights[term.text] for term in terms])
-        # sign is a learning rate of 0.5 of the y-yhat
-        sign = 1 if weight_sum > 0 else -1
-        for term in terms:
-          logging.debug( "[PERCEPTRON_CLASSIFIER]" +
-                        f"[PREV_WEIGHT: {self.weights[term.text]}]" +
-                        f"[STEP: {FACTOR *sign}]")
-          self.weights[term.text] = self.weights[term.text] - FACTOR * sign
-
-      # this line consumes a lot of time
-      # logging.debug(self.get_weights_slice(0))
+    An instance updates the weights only if it got mispredicted,
+    each epoch is a tight loop over the arrays of the matrix.
+    """
+    if self.workers > 1:
+      return self.train_parallel()
+
+    matrix, labels = self.init_training()
+    weights = self.weight_vector
+    if self.averaged:
+      # the averaged weights are weights - updates_sum / step,
+      # updates_sum accumulating each update scaled by its step
+      updates_sum = np.zeros(len(weights))
+      step = 1
+    else:
+      updates_sum = None
+      step = 1
+
+    for epoch in range(self.epochs):
+      mistakes, step = train_epoch(weights, matrix.indptr, matrix.indices, matrix.data, labels,
+                                   self.FACTOR, updates_sum, step)
+      logging.info(f"[PERCEPTRON_CLASSIFIER][EPOCH: {epoch}][MISTAKES: {mistakes}]")
+
+    if self.averaged:
+      weights -= updates_sum / step
+
+    self.sync_weights()
+
+  def init_training(self):
+    """Encode the instances, and initialize the features in order of their first appearance
+
+    Returns
+    -------
+    tuple
+      (matrix, labels) of the instances
+    """
+    matrix = self.get_feature_matrix(self.instances, train=True)
+    labels = self.get_label_vector(self.instances)
+    indptr, indices = matrix.indptr, matrix.indices
+    for i in range(len(matrix)):
+      if labels[i] != 0:
+        self.add_features(indices[indptr[i]:indptr[i+1]])
+    return matrix, labels
+
+  def get_shards(self, count):
+    """Partition the instances by the hash of their index, a list of rows per shard"""
+    shards = [[] for _ in range(count)]
+    for i, instance in enumerate(self.instances):
+      shards[zlib.crc32(str(instance.index).encode("utf-8")) % count].append(i)
+    return [shard for shard in shards if len(shard) > 0]
+
+  def train_parallel(self):
+    """Train over shards of the instances in parallel, by iterative parameter mixing
+
+    Each epoch, every worker runs a perceptron epoch over its shard,
+    starting from the current weights, then the weights are mixed back
+    as the mean of the workers weights.
+    The averaged perceptron averages the mixed weights over the epochs.
+    """
+    matrix, labels = self.init_training()
+
+    workers = []
+    for shard in self.get_shards(self.workers):
+      shard_matrix = matrix.take_rows(shard)
+      connection, worker_connection = Pipe()
+      process = Process(target=_train_shard, daemon=True,
+                        args=(worker_connection, shard_matrix.indptr, shard_matrix.indices, shard_matrix.data,
+                              labels[shard], self.FACTOR))
+      process.start()
+      # only the worker holds its end, thus its exit is seen as an EOFError
+      worker_connection.close()
+      workers.append((process, connection))
+
+    weights = self.weight_vector
+    averaged_weights = np.zeros(len(weights))
+    try:
+      for epoch in range(self.epochs):
+        for _, connection in workers:
+          connection.send(weights)
+
+        mixed = np.zeros(len(weights))
+        mistakes = 0
+        for _, connection in workers:
+          shard_weights, shard_mistakes = connection.recv()
+          mixed += shard_weights / len(workers)
+          mistakes += shard_mistakes
+
+        weights[:] = mixed
+        averaged_weights += mixed / self.epochs
+        logging.info(f"[PERCEPTRON_CLASSIFIER][EPOCH: {epoch}][MISTAKES: {mistakes}][SHARDS: {len(workers)}]")
+    finally:
+      for process, connection in workers:
+        try:
+          connection.send(None)
+        except (BrokenPipeError, OSError):
+          # the worker already exited
+          pass
+      for process, connection in workers:
+        process.join(self.JOIN_TIMEOUT)
+        if process.is_alive():
+          logging.warning(f"[PERCEPTRON_CLASSIFIER] terminating the hung worker {process.pid}")
+          process.terminate()
+          process.join()
+        connection.close()
+
+    if self.averaged:
+      weights[:] = averaged_weights
+
+    self.sync_weights()
+
+  def get_margin(self, term_ids, counts):
+    """Sum the weights of the known features, each multiplied by its count"""
+    known = term_ids < len(self.weight_vector)
+    term_ids, counts = term_ids[known], counts[known]
+    known = self.is_feature[term_ids]
+    return float(self.weight_vector[term_ids[known]].dot(counts[known]))
 
   def predict(self, instance, test=True):
-    # stub to a specific target
-    instance_weights = []
-    for term in Doc.fetch_terms(instance):
-      if test == False:
-        self.weights.setdefault(term.text, random.uniform(-0.3, 0.3))
+    # the vocabulary only grows while training
+    columns, values = self.get_features(instance, grow=not test, train=not test)
+    if test == False:
+      new_ids = self.add_features(columns)
+      self.sync_weights(new_ids.tolist())
 
-      if term.text in self.weights.keys():
-        instance_weights.append(self.weights[term.text])
-    # weights are multiplied by 1 due to existence in the current instance
-    total_weight = sum(instance_weights)
+    # weights are multiplied by the count of each term in the current instance
+    total_weight = self.get_margin(columns, values)
 
     if total_weight > 0:
       return [1]
     else:
       return [-1]
 
+  def predict_batch(self, docs):
+    """Predict the docs at once, through a single sparse matrix-vector product
+
+    The docs are analyzed against the store vocabulary without growing it,
+    thus unseen terms are dropped, unless hashed, in which case they get
+    the weight of their column.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+      (labels, margins), the +1/-1 label and the raw margin of each doc
+    """
+    matrix = self.get_feature_matrix(docs, grow=False)
+    margins = matrix.dot(np.where(self.is_feature, self.weight_vector, 0))
+    labels = np.where(margins > 0, 1, -1)
+    return labels, margins
+
   def assign_labels(self, in_insts):
     out_insts = []
 
-    for instance in in_insts:
-      out_insts.append(self.assign_label(instance))
+    labels, _ = self.predict_batch(in_insts)
+    for instance, label in zip(in_insts, labels.tolist()):
+      instance.predicted_labels.append(label)
+      out_insts.append(instance)
 
     return out_insts
 
@@ -135,3 +424,49 @@ class PerceptronClassifier():
       out.append(key)
 
     return out
+
+def train_epoch(weights, indptr, indices, data, labels, factor, updates_sum=None, step=1):
+  """Run a perceptron epoch over the rows of a CSR matrix, updating the weights in place
+
+  Parameters
+  ----------
+  labels : numpy.ndarray
+    +1/-1 label of each row, the rows of a 0 label are skipped
+  updates_sum : numpy.ndarray
+    Sum of the updates scaled by their step, for the averaged perceptron
+
+  Returns
+  -------
+  tuple
+    (mistakes, step), the count of the mispredicted rows, and the next step
+  """
+  mistakes = 0
+  for i in range(len(labels)):
+    label = labels[i]
+    if label == 0:
+      continue
+
+    columns = indices[indptr[i]:indptr[i+1]]
+    counts = data[indptr[i]:indptr[i+1]]
+    prediction = 1 if weights[columns].dot(counts) > 0 else -1
+    if prediction != label:
+      update = (factor * label) * counts
+      weights[columns] += update
+      if updates_sum is not None:
+        updates_sum[columns] += step * update
+      mistakes += 1
+
+    if updates_sum is not None:
+      step += 1
+
+  return mistakes, step
+
+def _train_shard(connection, indptr, indices, data, labels, factor):
+  """Worker process, runs an epoch over its shard for each weights it receives"""
+  while True:
+    weights = connection.recv()
+    if weights is None:
+      break
+    mistakes, _ = train_epoch(weights, indptr, indices, data, labels, factor)
+    connection.send((weights, mistakes))
+  connection.close()
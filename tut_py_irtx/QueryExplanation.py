@@ -0,0 +1,136 @@
+import time
+
+# Stages of a query, in order of execution
+QUERY_STAGES = ("build", "analyze", "expand", "lookup", "intersect", "score")
+
+class TermExplanation():
+  """How a single query text got resolved
+
+  Attributes
+  ----------
+  text : str
+    The query text as given
+  analyzed : str
+    The analyzed text, None if dropped by the analyzer
+  cache_hit : bool
+    Whether the analyzed form came from the analyzer cache,
+    None for the wildcards, which are not analyzed
+  expansions : list of str
+    Terms a wildcard got expanded to
+  postings : int
+    Count of the postings of the term, or of the joint postings of its expansions
+  intersection : int
+    Count of the docs matching all the texts so far
+  union : int
+    Count of the docs matching any of the texts so far
+  seconds : dict
+    stage -> seconds spent on this text
+  """
+
+  def __init__(self, text):
+    self.text = text
+    self.analyzed = None
+    self.cache_hit = None
+    self.expansions = []
+    self.postings = 0
+    self.intersection = 0
+    self.union = 0
+    self.seconds = {}
+
+  def add_seconds(self, stage, seconds):
+    self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+  def to_dict(self):
+    return {
+      "text": self.text,
+      "analyzed": self.analyzed,
+      "cache_hit": self.cache_hit,
+      "expansions": list(self.expansions),
+      "postings": self.postings,
+      "intersection": self.intersection,
+      "union": self.union,
+      "seconds": dict(self.seconds),
+    }
+
+class QueryExplanation():
+  """Profile of a query, check IndexController.query_intersection(explain=True)
+
+  Attributes
+  ----------
+  terms : list of TermExplanation
+    A term explanation per query text, in order of the query
+  docs_scored : int
+    Count of the docs a rank got computed for
+  results : int
+    Count of the returned docs
+  seconds : dict
+    stage -> seconds spent on the whole query, check QUERY_STAGES
+  """
+
+  def __init__(self, text_list, wildcard=False, ranked=False):
+    self.text_list = list(text_list)
+    self.wildcard = wildcard
+    self.ranked = ranked
+    self.terms = []
+    self.docs_scored = 0
+    self.results = 0
+    self.seconds = {}
+    self.total_seconds = 0.0
+
+  def add_term(self, text):
+    term = TermExplanation(text)
+    self.terms.append(term)
+    return term
+
+  def add_seconds(self, stage, seconds, term=None):
+    """Account the seconds of a stage, to the given term as well if any"""
+    self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+    if term is not None:
+      term.add_seconds(stage, seconds)
+
+  @property
+  def cache_hits(self):
+    return sum(1 for term in self.terms if term.cache_hit)
+
+  def to_dict(self):
+    return {
+      "query": list(self.text_list),
+      "wildcard": self.wildcard,
+      "ranked": self.ranked,
+      "terms": [term.to_dict() for term in self.terms],
+      "docs_scored": self.docs_scored,
+      "cache_hits": self.cache_hits,
+      "results": self.results,
+      "seconds": dict(self.seconds),
+      "total_seconds": self.total_seconds,
+    }
+
+  def __str__(self):
+    out  = f"query: {self.text_list} | wildcard: {self.wildcard} | ranked: {self.ranked}\n"
+    out += f"{'text':15} {'analyzed':15} {'cache':>6} {'expands':>8} {'postings':>9} {'inter':>6} {'union':>6} {'ms':>9}\n"
+    for term in self.terms:
+      cache = "-" if term.cache_hit is None else ("hit" if term.cache_hit else "miss")
+      ms = sum(term.seconds.values()) * 1000
+      out += f"{term.text:15} {str(term.analyzed):15} {cache:>6} {len(term.expansions):8} {term.postings:9} {term.intersection:6} {term.union:6} {ms:9.3f}\n"
+    stages = " | ".join(f"{stage}: {self.seconds[stage] * 1000:.3f}ms" for stage in QUERY_STAGES if stage in self.seconds)
+    out += f"docs scored: {self.docs_scored} | results: {self.results} | {stages} | total: {self.total_seconds * 1000:.3f}ms"
+    return out
+
+class StageClock():
+  """Splits the elapsed monotonic time between the stages of an explanation
+
+  Each lap accounts the time since the previous lap to the given stage,
+  a None explanation turns every lap into a no-op.
+  """
+  __slots__ = ("explanation", "last")
+
+  def __init__(self, explanation):
+    self.explanation = explanation
+    self.last = time.perf_counter() if explanation is not None else 0.0
+
+  def lap(self, stage, term=None):
+    if self.explanation is None:
+      return
+    now = time.perf_counter()
+    self.explanation.add_seconds(stage, now - self.last, term)
+    self.last = now
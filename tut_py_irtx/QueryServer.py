@@ -0,0 +1,403 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from tut_py_irtx.errors import *
+from tut_py_irtx.IndexController import *
+from tut_py_irtx.Metrics import *
+
+# Status of a response
+STATUS_OK = "ok"
+STATUS_ERROR = "error"
+STATUS_TIMEOUT = "timeout"
+
+# The controller each worker process queries, built by _init_worker
+_worker_controller = None
+
+def _init_worker(docs, analyzer):
+  global _worker_controller
+  _worker_controller = IndexController(docs, analyzer)
+  _worker_controller.build()
+
+def _get_worker_pid():
+  return os.getpid()
+
+def _run_worker_query(text_list, wildcard, ranked, limit):
+  return run_query(_worker_controller, text_list, wildcard, ranked, limit)
+
+def run_query(controller, text_list, wildcard=False, ranked=False, limit=None):
+  """Query the controller, keeping only what a response needs
+
+  Returns
+  -------
+  int
+    Count of the matching docs
+  list of tuple
+    (doc index, rank) of the first limit docs, the rank is None unless ranked
+  """
+  hits = controller.query(text_list, wildcard=wildcard, ranked=ranked).get_hits()
+  count = len(hits)
+  if limit is not None:
+    hits = hits[:limit]
+  return count, [(doc.index, rank) for doc, rank in hits]
+
+class QueryRequest():
+  """A parsed request line
+
+  A request is a JSON object on a single line, for example
+  {"id": 1, "query": ["the", "numb*"], "wildcard": true, "ranked": false, "limit": 10}
+  the op defaults to "query", the "stats" op returns the server stats instead
+  """
+  OPS = ("query", "stats")
+
+  def __init__(self, request_id=None, op="query", text_list=None, wildcard=False, ranked=False, limit=None):
+    self.request_id = request_id
+    self.op = op
+    self.text_list = [] if text_list is None else text_list
+    self.wildcard = wildcard
+    self.ranked = ranked
+    self.limit = limit
+
+  @staticmethod
+  def parse(line):
+    """Parse a request line
+
+    Raises
+    ------
+    QueryRequestError
+      If the line is not a valid request
+    """
+    try:
+      payload = json.loads(line)
+    except (json.JSONDecodeError, UnicodeDecodeError) as ex:
+      raise QueryRequestError(f"Malformed request: {ex}")
+    if not isinstance(payload, dict):
+      raise QueryRequestError("A request should be a JSON object")
+
+    request = QueryRequest(payload.get("id"), payload.get("op", "query"))
+    if request.op not in QueryRequest.OPS:
+      raise QueryRequestError(f"Unsupported op [{request.op}], expected one of {QueryRequest.OPS}", request.request_id)
+    if request.op != "query":
+      return request
+
+    text = payload.get("query")
+    text_list = [text] if isinstance(text, str) else text
+    if not isinstance(text_list, list) or len(text_list) == 0 or not all(isinstance(t, str) for t in text_list):
+      raise QueryRequestError("The query should be a text or a non empty list of texts", request.request_id)
+    request.text_list = text_list
+    for flag in ("wildcard", "ranked"):
+      if not isinstance(payload.get(flag, False), bool):
+        raise QueryRequestError(f"The {flag} flag should be a boolean", request.request_id)
+    request.wildcard = payload.get("wildcard", False)
+    request.ranked = payload.get("ranked", False)
+
+    limit = payload.get("limit")
+    # a bool is an int, but not a limit
+    if limit is not None and (not isinstance(limit, int) or isinstance(limit, bool) or limit < 0):
+      raise QueryRequestError("The limit should be a non negative integer", request.request_id)
+    request.limit = limit
+    return request
+
+class QueryServer():
+  """Asynchronous JSON lines query server over a TCP or a Unix socket
+
+  Each connection sends a request per line and gets a response per line,
+  the requests of a connection may be pipelined and are answered as soon as
+  they complete, thus a response carries the id of its request.
+
+  The queries run on a worker pool, off the event loop:
+  - workers > 0: a process pool, each process builds its own controller
+    from the docs and the analyzer of the given one, which should thus be
+    picklable, the queries of different processes run in parallel,
+    the processes are started and built before the server listens
+  - workers == 0: a thread pool querying the snapshot published by the
+    given controller, the queries share the GIL but not the event loop
+
+  At most max_pending queries are in flight, once reached the connections
+  are not read any further until a query completes, which pushes back on
+  the clients through the socket buffers. A query that exceeds the timeout
+  gets a timeout response, it is dropped if it did not start yet, otherwise
+  it keeps its pending slot until its worker is done.
+
+  Examples
+  --------
+  >>> server = await QueryServer(ic, workers=2).start(port=8642)
+  >>> await server.serve_forever()
+  """
+  DEFAULT_MAX_PENDING = 64
+  DEFAULT_TIMEOUT = 5.0
+  DEFAULT_MAX_LINE = 64 * 1024
+
+  def __init__(self, controller, workers=0, max_pending=DEFAULT_MAX_PENDING, timeout=DEFAULT_TIMEOUT, max_line=DEFAULT_MAX_LINE):
+    """
+
+    Parameters
+    ----------
+    controller : IndexController
+      Controller to serve, it gets built once before serving
+    workers : int
+      Count of the worker processes, 0 to query from a thread pool
+    max_pending : int
+      Max count of the queries in flight
+    timeout : float
+      Seconds a query may take, None to wait for it
+    max_line : int
+      Max length of a request line, in bytes
+    """
+    if workers < 0:
+      raise ValueError(f"The workers count should not be negative, got {workers}")
+    if max_pending <= 0:
+      raise ValueError(f"The max pending count should be positive, got {max_pending}")
+
+    self.controller = controller
+    self.workers = workers
+    self.max_pending = max_pending
+    self.timeout = timeout
+    self.max_line = max_line
+
+    self.executor = None
+    self.server = None
+    self.slots = None
+    self.pending = 0
+    self.writers = set()
+    self.stats = {"connections": 0, "requests": 0, "served": 0, "errors": 0, "timeouts": 0}
+
+  def create_executor(self):
+    if self.workers > 0:
+      return ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                 initargs=(self.controller.doc_list, self.controller.analyzer))
+    return ThreadPoolExecutor(thread_name_prefix="query")
+
+  def submit(self, request):
+    """Submit the query of the request to the worker pool
+
+    Returns
+    -------
+    concurrent.futures.Future
+      Resolves to the output of run_query()
+    """
+    if self.workers > 0:
+      return self.executor.submit(_run_worker_query, request.text_list, request.wildcard, request.ranked, request.limit)
+    return self.executor.submit(run_query, self.controller, request.text_list, request.wildcard, request.ranked, request.limit)
+
+  async def warm_up(self):
+    """Start the worker processes, each building its controller, instead of on the first queries"""
+    if self.workers > 0:
+      # the pool spawns a process per task submitted while none is idle
+      futures = [self.executor.submit(_get_worker_pid) for _ in range(self.workers)]
+      await asyncio.gather(*[asyncio.wrap_future(future) for future in futures])
+
+  async def start(self, host="127.0.0.1", port=0, path=None):
+    """Build the controller and listen on the given TCP address, or on the Unix socket path if given"""
+    self.controller.build()
+    self.executor = self.create_executor()
+    self.slots = asyncio.Semaphore(self.max_pending)
+    await self.warm_up()
+
+    if path is not None:
+      self.server = await asyncio.start_unix_server(self.handle, path=path, limit=self.max_line)
+    else:
+      self.server = await asyncio.start_server(self.handle, host, port, limit=self.max_line)
+    logging.info(f"[QUERY-SERVER] listening on {self.address} with {self.workers} worker(s)")
+    return self
+
+  @property
+  def address(self):
+    """(host, port) of the TCP socket, or the path of the Unix socket"""
+    return self.server.sockets[0].getsockname()
+
+  async def serve_forever(self):
+    await self.server.serve_forever()
+
+  async def close(self):
+    """Stop listening, drop the connections and shut the worker pool down"""
+    self.server.close()
+    for writer in list(self.writers):
+      writer.close()
+    await self.server.wait_closed()
+    await asyncio.to_thread(self.executor.shutdown, True, cancel_futures=True)
+
+  async def handle(self, reader, writer):
+    """Serve the requests of a connection until it gets closed"""
+    self.writers.add(writer)
+    self.stats["connections"] += 1
+    tasks = set()
+    try:
+      while True:
+        try:
+          line = await reader.readline()
+        except ValueError:
+          # the line exceeded the stream limit, the rest of the stream can not be framed
+          await self.respond(writer, {"id": None, "status": STATUS_ERROR, "error": f"Request lines are limited to {self.max_line} bytes"})
+          break
+        except ConnectionError:
+          break
+        if not line:
+          break
+        if not line.strip():
+          continue
+
+        await self.acquire_slot()
+        task = asyncio.create_task(self.process(line, writer))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    finally:
+      if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+      self.writers.discard(writer)
+      writer.close()
+
+  async def process(self, line, writer):
+    """Answer a request line, the caller acquires a pending slot for it"""
+    start = time.perf_counter()
+    self.stats["requests"] += 1
+    METRICS.increment("server_requests")
+    try:
+      request = QueryRequest.parse(line)
+    except QueryRequestError as ex:
+      self.release_slot()
+      self.stats["errors"] += 1
+      await self.respond(writer, {"id": ex.request_id, "status": STATUS_ERROR, "error": ex.message})
+      return
+
+    if request.op == "stats":
+      self.release_slot()
+      await self.respond(writer, {"id": request.request_id, "status": STATUS_OK, "stats": self.get_stats()})
+      return
+
+    loop = asyncio.get_running_loop()
+    response = {"id": request.request_id}
+    future = None
+    try:
+      # raises if the pool is broken or shut down
+      future = self.submit(request)
+      # the slot is held until the worker is done, even if the query timed out
+      future.add_done_callback(lambda _: self.release_slot_threadsafe(loop))
+      count, hits = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+    except asyncio.TimeoutError:
+      self.stats["timeouts"] += 1
+      response.update(status=STATUS_TIMEOUT, error=f"The query exceeded {self.timeout} seconds")
+    except Exception as ex:
+      self.stats["errors"] += 1
+      logging.warning(f"[QUERY-SERVER] query {request.text_list} failed: {ex!r}")
+      response.update(status=STATUS_ERROR, error=repr(ex))
+    else:
+      self.stats["served"] += 1
+      response.update(status=STATUS_OK, count=count, docs=[{"index": index, "rank": rank} for index, rank in hits])
+    finally:
+      if future is None:
+        # the query never reached a worker
+        self.release_slot()
+
+    seconds = time.perf_counter() - start
+    METRICS.observe("server_latency", seconds)
+    response["seconds"] = seconds
+    await self.respond(writer, response)
+
+  async def acquire_slot(self):
+    """Wait for a pending slot, which stops reading the waiting connection"""
+    await self.slots.acquire()
+    self.pending += 1
+
+  def release_slot(self):
+    self.pending -= 1
+    self.slots.release()
+
+  def release_slot_threadsafe(self, loop):
+    """Release a slot from a worker thread, the slots are gone once the loop is closed"""
+    if not loop.is_closed():
+      try:
+        loop.call_soon_threadsafe(self.release_slot)
+      except RuntimeError:
+        # the loop got closed in between
+        pass
+
+  async def respond(self, writer, response):
+    try:
+      writer.write(json.dumps(response).encode() + b"\n")
+      await writer.drain()
+    except ConnectionError:
+      # the client left, its responses are dropped
+      pass
+
+  def get_stats(self):
+    stats = dict(self.stats)
+    stats["pending"] = self.pending
+    stats["workers"] = self.workers
+    return stats
+
+class QueryClient():
+  """Client of a QueryServer, the requests of concurrent tasks are pipelined over one connection
+
+  Examples
+  --------
+  >>> client = await QueryClient().connect(port=8642)
+  >>> response = await client.query(["the", "numb*"], wildcard=True)
+  >>> await client.close()
+  """
+
+  def __init__(self):
+    self.reader = None
+    self.writer = None
+    self.receiver = None
+    self.next_id = 0
+    # request id -> future of its response
+    self.pending = {}
+
+  async def connect(self, host="127.0.0.1", port=None, path=None, limit=QueryServer.DEFAULT_MAX_LINE):
+    if path is not None:
+      self.reader, self.writer = await asyncio.open_unix_connection(path, limit=limit)
+    else:
+      self.reader, self.writer = await asyncio.open_connection(host, port, limit=limit)
+    self.receiver = asyncio.create_task(self.receive())
+    return self
+
+  async def receive(self):
+    """Resolve the pending requests as their responses arrive"""
+    error = ConnectionError("The server closed the connection")
+    try:
+      while True:
+        line = await self.reader.readline()
+        if not line:
+          break
+        response = json.loads(line)
+        future = self.pending.pop(response.get("id"), None)
+        if future is not None and not future.done():
+          future.set_result(response)
+    except Exception as ex:
+      error = ex
+    for future in self.pending.values():
+      if not future.done():
+        future.set_exception(error)
+    self.pending.clear()
+
+  async def request(self, payload):
+    """Send a request, returns its response as a dict"""
+    self.next_id += 1
+    payload = dict(payload, id=self.next_id)
+    future = asyncio.get_running_loop().create_future()
+    self.pending[self.next_id] = future
+    self.writer.write(json.dumps(payload).encode() + b"\n")
+    await self.writer.drain()
+    return await future
+
+  async def query(self, text, wildcard=False, ranked=False, limit=None):
+    payload = {"query": text, "wildcard": wildcard, "ranked": ranked}
+    if limit is not None:
+      payload["limit"] = limit
+    return await self.request(payload)
+
+  async def stats(self):
+    return await self.request({"op": "stats"})
+
+  async def close(self):
+    self.writer.close()
+    try:
+      await self.writer.wait_closed()
+    except ConnectionError:
+      pass
+    if self.receiver is not None:
+      await self.receiver
@@ -0,0 +1,185 @@
+import numpy as np
+
+class SparseMatrix():
+  """A compressed sparse row (CSR) matrix
+
+  Only the operations needed by the learners are implemented, on top of
+  plain NumPy arrays, the values of row i are
+  data[indptr[i]:indptr[i+1]] at the columns indices[indptr[i]:indptr[i+1]]
+
+  Attributes
+  ----------
+  data : numpy.ndarray
+    The non-zero values
+  indices : numpy.ndarray
+    The column of each value of data
+  indptr : numpy.ndarray
+    Offset of each row in data, of size rows+1
+  shape : tuple of int
+    (rows, columns)
+  """
+
+  def __init__(self, data, indices, indptr, shape):
+    self.data = np.asarray(data, dtype=float)
+    self.indices = np.asarray(indices, dtype=np.int64)
+    self.indptr = np.asarray(indptr, dtype=np.int64)
+    self.shape = (int(shape[0]), int(shape[1]))
+    self._row_ids = None
+
+  @classmethod
+  def from_rows(cls, rows, columns=None):
+    """Create a matrix from a list of (indices, values) rows
+
+    Parameters
+    ----------
+    rows : list of tuple
+      (indices, values) of the non-zero values of each row
+    columns : int
+      Count of columns, defaults to the max index + 1
+    """
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    for i, (indices, _) in enumerate(rows):
+      indptr[i+1] = indptr[i] + len(indices)
+
+    if len(rows) > 0 and indptr[-1] > 0:
+      indices = np.concatenate([np.asarray(row[0], dtype=np.int64) for row in rows])
+      data = np.concatenate([np.asarray(row[1], dtype=float) for row in rows])
+    else:
+      indices = np.zeros(0, dtype=np.int64)
+      data = np.zeros(0)
+
+    if columns is None:
+      columns = int(indices.max()) + 1 if len(indices) > 0 else 0
+
+    return cls(data, indices, indptr, (len(rows), columns))
+
+  @classmethod
+  def from_dense(cls, matrix):
+    matrix = np.asarray(matrix, dtype=float)
+    rows, indices = np.nonzero(matrix)
+    indptr = np.zeros(matrix.shape[0] + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=matrix.shape[0]), out=indptr[1:])
+    return cls(matrix[rows, indices], indices, indptr, matrix.shape)
+
+  def __len__(self):
+    return self.shape[0]
+
+  @property
+  def nnz(self):
+    return len(self.data)
+
+  def get_row_ids(self):
+    """Row of each of the non-zero values"""
+    if self._row_ids is None:
+      self._row_ids = np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+    return self._row_ids
+
+  def get_row(self, i):
+    """Return the (indices, values) of row i"""
+    start, end = self.indptr[i], self.indptr[i+1]
+    return self.indices[start:end], self.data[start:end]
+
+  def take_rows(self, rows):
+    """Return a new matrix of the given rows, in the given order"""
+    rows = np.asarray(rows, dtype=np.int64)
+    starts = self.indptr[rows]
+    lengths = self.indptr[rows + 1] - starts
+
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+    # position of each taken value in the original data
+    positions = np.repeat(starts - indptr[:-1], lengths) + np.arange(indptr[-1])
+    return SparseMatrix(self.data[positions], self.indices[positions], indptr, (len(rows), self.shape[1]))
+
+  def with_data(self, data):
+    """Return a matrix sharing the structure, with the given values"""
+    matrix = SparseMatrix(data, self.indices, self.indptr, self.shape)
+    matrix._row_ids = self._row_ids
+    return matrix
+
+  def sum_duplicates(self):
+    """Return a matrix with the values at the same row and column summed,
+    the columns of each row get sorted"""
+    columns = max(self.shape[1], 1)
+    keys = self.get_row_ids() * columns + self.indices
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    rows, indices = np.divmod(unique_keys, columns)
+
+    indptr = np.zeros(self.shape[0] + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=self.shape[0]), out=indptr[1:])
+    data = np.bincount(inverse, weights=self.data, minlength=len(unique_keys))
+    return SparseMatrix(data, indices, indptr, self.shape)
+
+  def to_dense(self):
+    matrix = np.zeros(self.shape)
+    matrix[self.get_row_ids(), self.indices] = self.data
+    return matrix
+
+  def get_row_norms_squared(self):
+    return np.bincount(self.get_row_ids(), weights=self.data * self.data, minlength=self.shape[0])
+
+  def normalize_rows(self):
+    """Return a copy with each non-empty row scaled to a unit length"""
+    norms = np.sqrt(self.get_row_norms_squared())
+    norms[norms == 0] = 1
+    return self.with_data(self.data / norms[self.get_row_ids()])
+
+  def dot(self, other):
+    """Matrix product with a dense vector (columns,) or matrix (columns x m)
+
+    Returns
+    -------
+    numpy.ndarray
+      (rows,) or (rows x m) dense array
+    """
+    other = np.asarray(other, dtype=float)
+    if other.ndim == 1:
+      return np.bincount(self.get_row_ids(), weights=self.data * other[self.indices], minlength=self.shape[0])
+
+    out = np.zeros((self.shape[0], other.shape[1]))
+    if self.nnz == 0:
+      return out
+
+    # each non-zero value contributes to a row of the result,
+    # contributions of a row are contiguous, thus reduced per row
+    contributions = other[self.indices] * self.data[:, None]
+    filled = np.diff(self.indptr) > 0
+    out[filled] = np.add.reduceat(contributions, self.indptr[:-1][filled], axis=0)
+    return out
+
+  def dot_rows(self, vectors, vector_ids):
+    """Dot product of each row with one of the given dense vectors
+
+    Parameters
+    ----------
+    vectors : numpy.ndarray
+      (vectors x columns) dense array
+    vector_ids : numpy.ndarray
+      The vector each row is multiplied with, for example the cluster
+      of each row, to get the dot product with its centroid
+
+    Returns
+    -------
+    numpy.ndarray
+      (rows,) array
+    """
+    row_ids = self.get_row_ids()
+    values = vectors[vector_ids[row_ids], self.indices]
+    return np.bincount(row_ids, weights=self.data * values, minlength=self.shape[0])
+
+  def get_grouped_sums(self, labels, groups):
+    """Sum the rows of each group into a dense (groups x columns) array
+
+    Parameters
+    ----------
+    labels : numpy.ndarray
+      Group of each row
+    groups : int
+      Count of the groups
+    """
+    columns = self.shape[1]
+    flat = labels[self.get_row_ids()] * columns + self.indices
+    return np.bincount(flat, weights=self.data, minlength=groups * columns).reshape(groups, columns)
+
+  def __str__(self):
+    return f"sparse matrix of {self.shape[0]}x{self.shape[1]} with {self.nnz} non-zero values"
@@ -6,3 +6,11 @@ class IndexNotFoundError(Exception):
       self.message = message
 
     super().__init__(self.message)
+
+class QueryRequestError(ValueError):
+  def __init__(self, message, request_id=None):
+    """An invalid request, along with its id if it could be parsed"""
+    self.message = message
+    self.request_id = request_id
+
+    super().__init__(self.message)
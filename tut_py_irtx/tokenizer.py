@@ -0,0 +1,56 @@
+import re
+from collections import Counter
+
+import tut_py_irtx.util as util
+
+# Separators are replaced by a space in a single pass,
+# instead of chaining a str.replace() call per separator
+SEPARATORS = re.compile(r'\[newline\]|\[NEWLINE\]|[,"”“?!]')
+
+def preprocess(text):
+  """Replace the separators with spaces and drop the non-ascii characters
+
+  Parameters
+  ----------
+  text : str
+    The raw text of a document
+
+  Returns
+  -------
+  str
+    The text ready to be split on whitespaces
+  """
+  return SEPARATORS.sub(" ", text).encode('ascii', 'ignore').decode('ascii')
+
+def split(text):
+  """Return the raw (non-normalized) tokens of the given text"""
+  return preprocess(text).split()
+
+def tokenize(text):
+  """Return the normalized tokens of the given text, in order of appearance
+
+  Repeated tokens are kept, use `count_tokens()` to get them grouped.
+
+  Parameters
+  ----------
+  text : str
+    The raw text of a document
+
+  Returns
+  -------
+  list of str
+    The normalized tokens, each normalized as `util.normalize()` would do
+  """
+  # the preprocessed text is pure ascii, thus lowering it once is
+  # equivalent to lowering each token on its own
+  return [token.strip(util.NORMALIZE_STRIP_CHARS) for token in preprocess(text).lower().split()]
+
+def count_tokens(text):
+  """Return a mapping of each normalized token to its count in the given text
+
+  Returns
+  -------
+  dict
+    token -> count, ordered by the first appearance of each token
+  """
+  return dict(Counter(tokenize(text)))
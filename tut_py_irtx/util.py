@@ -25,6 +25,9 @@ def slice_list_of_dict(indict, end, start=0):
 
   return outlist
 
+# Characters stripped from both ends of a text while normalizing it
+NORMALIZE_STRIP_CHARS = ",.#@:\""
+
 def normalize(text):
-  return text.lower().strip(",.#@:\"")
+  return text.lower().strip(NORMALIZE_STRIP_CHARS)
 